@@ -25,6 +25,10 @@ def run(cosmo, data, command_line):
     Starting from an existing folder, with some chains, constraining a certain
     model, and having some derived parameters, the idea is to recompute the
     cosmological code to follow additional derived parameters.
+
+    If the run was done with `--store-evaluations`, and the new derived
+    parameters were stored with `--store-derived`, they are read from the
+    evaluation store instead (see :class:`io_mp.EvaluationStore`).
     """
     target_folder = command_line.Der_target_folder
     # If it does not exist, create it
@@ -37,7 +41,8 @@ def run(cosmo, data, command_line):
     #  If it exists, we recover all chains within.
     if os.path.isdir(starting_folder):
         for elem in os.listdir(starting_folder):
-            if elem.find("__") != -1:
+            if elem.find("__") != -1 and \
+                    os.path.splitext(elem)[1] in ['.txt', '.bin']:
                 chains.append(elem)
 
     # Read the additional derived parameter, remove the needs for output=mPk
@@ -51,6 +56,7 @@ def run(cosmo, data, command_line):
     for param in new_derived:
         data.mcmc_parameters[param] = Parameter(
             [0, None, None, 0, 1, 'derived'], param)
+    data.update_parameter_index()
     # Reset the cosmo_arguments dict output entry, and adapt it in case a
     # derived parameter requires a particular CLASS behaviour.
     data.cosmo_arguments.update({'output': ''})
@@ -93,20 +99,34 @@ def extend_chain(data, cosmo, command_line, target_folder, chain_name,
     parameter_names.extend([
         elem for elem in data.get_mcmc_parameters(['derived'])
         if elem not in new_derived])
-    with open(input_path, 'r') as input_chain:
-        with open(output_path, 'w') as output_chain:
-            for line in input_chain:
-                if line[0] == '#':
-                    output_chain.write(line)
-                    continue
-                params = line.split()
-                # recover the likelihood of this point
-                loglike = -float(params[1])
-                N = int(params[0])
-                # Assign all the recovered values to the data structure
-                for index, param in enumerate(parameter_names):
-                    data.mcmc_parameters[param]['current'] = \
-                        float(params[2+index])
+    derived_names = data.get_mcmc_parameters(['derived'])
+    store = data.parameter_store
+    evaluations = io_mp.EvaluationStore(command_line.folder)
+    # The new chain is written in the same format as the input one
+    with io_mp.open_chain(output_path, data,
+                          io_mp.is_binary_chain(input_path)) as output_chain:
+        for line in io_mp.iterate_chain(input_path):
+            if isinstance(line, str):
+                output_chain.write(line)
+                continue
+            params = line
+            # recover the likelihood of this point
+            loglike = -float(params[1])
+            N = int(params[0])
+            # Assign all the recovered values to the data structure
+            data.parameter_store.set_current(
+                [float(params[2+index])
+                 for index in range(len(parameter_names))],
+                parameter_names)
+            # Look for the derived parameters in the evaluation store
+            record = evaluations.get(evaluations.key(
+                store.varying_cosmo_names,
+                store.current[store.varying_cosmo_indices]))
+            if record is not None and all(
+                    name in record['derived'] for name in derived_names):
+                derived = dict((name, record['derived'][name])
+                               for name in derived_names)
+            else:
                 # Compute the cosmology
                 data.update_cosmo_arguments()
                 if cosmo.state:
@@ -118,15 +138,14 @@ def extend_chain(data, cosmo, command_line, target_folder, chain_name,
                     pass
                 # Recover all the derived parameters
                 derived = cosmo.get_current_derived_parameters(
-                    data.get_mcmc_parameters(['derived']))
-                for name, value in derived.iteritems():
-                    data.mcmc_parameters[name]['current'] = value
-                for name in derived.iterkeys():
-                    data.mcmc_parameters[elem]['current'] /= \
-                        data.mcmc_parameters[elem]['scale']
-                # Accept the point
-                sampler.accept_step(data)
-                io_mp.print_vector([output_chain], N, loglike, data)
+                    derived_names)
+            for name, value in derived.iteritems():
+                data.mcmc_parameters[name]['current'] = \
+                    value/data.mcmc_parameters[name]['scale']
+            data.parameter_store.read_current(derived.iterkeys())
+            # Accept the point
+            sampler.accept_step(data)
+            io_mp.print_vector([output_chain], N, loglike, data)
     print output_path, 'written'
 
 
@@ -32,10 +32,9 @@ import io_mp
 from itertools import ifilterfalse
 from itertools import ifilter
 import scipy.ndimage
-
 # Defined to remove the burnin for all the points that were produced before the
 # first time where -log-likelihood <= min-minus-log-likelihood+LOG_LKL_CUTOFF
-LOG_LKL_CUTOFF = 3
+from statistics_mp import LOG_LKL_CUTOFF
 
 NUM_COLORS = 6
 
@@ -150,7 +149,8 @@ def prepare(files, info):
 
     .. note::
         Only files ending with .txt will be selected, to keep compatibility
-        with CosmoMC format
+        with CosmoMC format, along with the chains in binary format, ending
+        with .bin (see :class:`io_mp.BinaryChain`)
 
     .. note::
         New in version 2.0.0: if you ask to analyze a Nested Sampling
@@ -1381,7 +1381,8 @@ def recover_folder_and_files(files):
     `separate_files`"""
     # The following list defines the substring that a chain should contain for
     # the code to recognise it as a proper chain.
-    substrings = ['.txt', '__']
+    substrings = ['__']
+    extensions = ['.txt', '.bin']
     limit = 10
     # If the first element is a folder, grab all chain files inside
     if os.path.isdir(files[0]):
@@ -1389,7 +1390,8 @@ def recover_folder_and_files(files):
         files = [os.path.join(folder, elem) for elem in os.listdir(folder)
                  if not os.path.isdir(os.path.join(folder, elem))
                  and not os.path.getsize(os.path.join(folder, elem)) < limit
-                 and all([x in elem for x in substrings])]
+                 and all([x in elem for x in substrings])
+                 and any([x in elem for x in extensions])]
     # Otherwise, extract the folder from the chain file-name.
     else:
         # If the name is completely wrong, say it
@@ -1402,7 +1404,8 @@ def recover_folder_and_files(files):
                  if os.path.join(folder, elem) in np.copy(files)
                  and not os.path.isdir(os.path.join(folder, elem))
                  and not os.path.getsize(os.path.join(folder, elem)) < limit
-                 and all([x in elem for x in substrings])]
+                 and all([x in elem for x in substrings])
+                 and any([x in elem for x in extensions])]
     basename = os.path.basename(folder)
     return folder, files, basename
 
@@ -1544,9 +1547,12 @@ def find_maximum_of_likelihood(info):
         #                    for line in open(chain_file, 'r')]))
         #
         # This reads the chains excluding comment lines:
-        with open(chain_file, 'r') as f:
-            cheese = (np.array([float(line.split()[1].strip())
-                                for line in ifilterfalse(iscomment,f)]))
+        if io_mp.is_binary_chain(chain_file):
+            cheese = io_mp.read_binary_chain(chain_file)[1][:, 1]
+        else:
+            with open(chain_file, 'r') as f:
+                cheese = (np.array([float(line.split()[1].strip())
+                                    for line in ifilterfalse(iscomment,f)]))
 
         try:
             min_minus_lkl.append(cheese[:].min())
@@ -1607,9 +1613,14 @@ def remove_bad_points(info):
         #                    for line in open(chain_file, 'r')]))
         #
         # This read the chains excluding comment lines:
-        with open(chain_file, 'r') as f:
-            cheese = (np.array([[float(elem) for elem in line.split()]
-                                for line in ifilterfalse(iscomment,f)]))
+        if io_mp.is_binary_chain(chain_file):
+            _, cheese, comments = io_mp.read_binary_chain(chain_file)
+            comments = [text for _, text in comments]
+        else:
+            with open(chain_file, 'r') as f:
+                cheese = (np.array([[float(elem) for elem in line.split()]
+                                    for line in ifilterfalse(iscomment,f)]))
+            comments = None
         # If the file contains a broken line with a different number of
         # elements, the previous array generation might fail, and will not have
         # the correct shape. Hence the following command will fail. To avoid
@@ -1626,7 +1637,7 @@ def remove_bad_points(info):
                         ['-> %s' % line for line in
                          open(chain_file, 'r') if
                          len(line.split()) != len(info.backup_names)+2])))
-        line_count = float(sum(1 for line in open(chain_file, 'r')))
+        line_count = float(np.shape(cheese)[0])
 
         # Logging the information obtained until now.
         number_of_steps = cheese[:, 0].sum()
@@ -1653,8 +1664,11 @@ def remove_bad_points(info):
             # Read all comments in chains about times when proposal was updated
             # The last of these comments gives the number of lines to be skipped in the files
             if info.markovian and not info.update:
-                with open(chain_file, 'r') as f:
-                    for line in ifilter(iscomment,f):
+                if comments is None:
+                    with open(chain_file, 'r') as f:
+                        comments = list(ifilter(iscomment, f))
+                for line in comments:
+                    if line.find('update proposal') != -1:
                         start = int(line.split()[2])
                 markovian = start
 
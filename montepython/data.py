@@ -7,10 +7,15 @@
 import os
 import sys
 import math
-import random as rd
 import warnings
 import subprocess as sp
 import re
+import time
+import random
+import threading
+from array import array
+import numpy as np
+import scipy.interpolate as interpolate
 
 import io_mp  # Needs to talk to io_mp.py file for the logging
                                # of parameters
@@ -31,6 +36,13 @@ except ImportError:
             "to manually install the ordereddict package by placing" +
             "the file ordereddict.py in your Python Path")
 
+# Seeds are drawn in [0, MAX_SEED), leaving room for the chain number to be
+# added
+MAX_SEED = 2**30
+
+# Largest over-sampling factor chosen by Data.tune_blocks
+MAX_OVER_SAMPLING = 100
+
 
 class Data(object):
     """
@@ -67,7 +79,9 @@ class Data(object):
         * :attr:`boundary_loglike`
         * :attr:`cosmo_arguments`
         * :attr:`mcmc_parameters`
+        * :attr:`parameter_store`
         * :attr:`need_cosmo_update`
+        * :attr:`cosmo_cache`
         * :attr:`log_flag`
 
         .. note::
@@ -111,9 +125,6 @@ class Data(object):
 
         """
 
-        # Initialisation of the random seed
-        rd.seed()
-
         # Store the parameter file
         self.param = command_line.param
 
@@ -155,6 +166,10 @@ class Data(object):
         :rtype: ordereddict
         """
 
+        # Cache of the results of :meth:`get_mcmc_parameters`, emptied by
+        # :meth:`update_parameter_index`
+        self._parameter_index = {}
+
         # Arguments for PyMultiNest
         self.NS_param_names = []
         self.NS_arguments = {}
@@ -184,6 +199,16 @@ class Data(object):
         # Default value for the number of steps
         self.N = 10
 
+        # Default format of the chains
+        self.chain_format = 'text'
+        """
+        Format of the chains, 'text' or 'binary' (see
+        :class:`io_mp.BinaryChain`). It can be set in the parameter file with
+        `data.chain_format`, or with the command line flag `--chain-format`.
+
+        :rtype: str
+        """
+
         # Create the variable out, and out_name, which will be initialised
         # later by the :mod:`io_mp` module
         self.out = None
@@ -198,6 +223,14 @@ class Data(object):
         # dictionary.
         self.fill_mcmc_parameters()
 
+        # The format of the chains asked in the command line has priority
+        if command_line.chain_format is not None:
+            self.chain_format = command_line.chain_format
+        if self.chain_format not in ['text', 'binary']:
+            raise io_mp.ConfigurationError(
+                "The format of the chains should be 'text' or 'binary', "
+                "not '%s'" % self.chain_format)
+
         # Test if the recovered path agrees with the one extracted from
         # the configuration file.
         if self.path != {}:
@@ -224,6 +257,22 @@ class Data(object):
             # set all chains to master if no MPI
             rank = 0
 
+        # Initialisation of the random number generator of this chain, seeded
+        # once and for all. An explicit seed is shifted by the number of the
+        # chain once it is known, see :meth:`seed_chain`.
+        if command_line.seed is not None:
+            self.seed = command_line.seed
+        else:
+            self.seed = np.random.RandomState().randint(MAX_SEED)
+        self.random_numbers = RandomNumbers(self.seed)
+        """
+        Generator of the random numbers used by the Metropolis-Hastings
+        algorithm, see :class:`RandomNumbers`. The seed is stored in
+        :attr:`seed`, and written in the header of the chain.
+
+        :rtype: :class:`RandomNumbers`
+        """
+
         # Recover the cosmological code version (and git hash if relevant).
         # To implement a new cosmological code, please add another case to the
         # test below.
@@ -316,6 +365,56 @@ class Data(object):
         :rtype: bool
         """
 
+        self.evaluation_store = None
+        """
+        If not None, instance of :class:`io_mp.EvaluationStore`, where the
+        results of the cosmological module are written at every new point.
+        Set by :func:`mcmc.chain` with the flag `--store-evaluations`.
+        """
+
+        self.cosmo_cache = CosmologyCache(command_line.cosmo_cache)
+        """
+        Results of the likelihoods and derived parameters for the most recently
+        used cosmologies, see :class:`CosmologyCache`.
+
+        :rtype: :class:`CosmologyCache`
+        """
+
+        self.profiler = Profiler(command_line.profile is not None)
+        """
+        Timings of the different stages of the computation, enabled with the
+        flag `--profile`, see :class:`Profiler`.
+
+        :rtype: :class:`Profiler`
+        """
+
+        self.cl_cache = ClCache(self.cosmo_arguments)
+        """
+        Spectra of the cosmological module, converted to :math:`\mu {\\rm
+        K}^2`, shared by the likelihoods for the current cosmology, see
+        :class:`ClCache`.
+
+        :rtype: :class:`ClCache`
+        """
+
+        self.background = BackgroundTable(self.cosmo_arguments)
+        """
+        Distances and Hubble rate at the redshifts requested by the
+        likelihoods during their initialisation, computed once per cosmology,
+        see :class:`BackgroundTable`.
+
+        :rtype: :class:`BackgroundTable`
+        """
+
+        self.power_spectrum = PowerSpectrumGrid(self.cosmo_arguments)
+        """
+        Matter power spectrum at the redshifts and wavenumbers requested by
+        the likelihoods during their initialisation, computed once per
+        cosmology, see :class:`PowerSpectrumGrid`.
+
+        :rtype: :class:`PowerSpectrumGrid`
+        """
+
         # logging the parameter file (only if folder does not exist !)
         ## temporary variable for readability
         log_param = os.path.join(command_line.folder, 'log.param')
@@ -349,7 +448,9 @@ class Data(object):
             io_mp.log_default_configuration(self, command_line)
 
         # Log plotting parameter names file for compatibility with GetDist
-        io_mp.log_parameter_names(self, command_line)
+        # (once, as the MPI processes initialise concurrently)
+        if not rank:
+            io_mp.log_parameter_names(self, command_line)
 
     def fill_mcmc_parameters(self):
         """
@@ -404,6 +505,29 @@ class Data(object):
         instances from the class :class:`parameter` (inheriting from dict)
         """
 
+        self.update_parameter_index()
+
+    def update_parameter_index(self):
+        """
+        Rebuild everything derived from the content of :attr:`mcmc_parameters`
+
+        The role and status of the parameters never change after their
+        creation, so the lists returned by :meth:`get_mcmc_parameters` are
+        cached, and the :attr:`parameter_store` is built once. This method
+        must be called whenever parameters are added to
+        :attr:`mcmc_parameters`, as in :func:`add_derived.run`.
+
+        """
+        self._parameter_index = {}
+
+        self.parameter_store = ParameterStore(self.mcmc_parameters)
+        """
+        Array-backed view of :attr:`mcmc_parameters`, used by all the routines
+        called at every step. See :class:`ParameterStore`.
+
+        :rtype: :class:`ParameterStore`
+        """
+
     def initialise_likelihoods(self, experiments):
         """
         Given an array of experiments, return an ordered dict of instances
@@ -595,8 +719,10 @@ class Data(object):
                 raise io_mp.ConfigurationError(
                     "nuisance parameter %s " % elem +
                     "is associated to no likelihood")
-        # Store the result
+        # Store the result. The blocks follow the ordering of the varying
+        # parameters, until :meth:`tune_blocks` is called.
         self.block_parameters = array
+        self.block_order = range(len(self.get_mcmc_parameters(['varying'])))
 
         # Setting a default value for the over_sampling array
         if not self.over_sampling:
@@ -616,6 +742,74 @@ class Data(object):
         # Create a list of indices corresponding of the oversampling strategy
         self.assign_over_sampling_indices()
 
+    def tune_blocks(self, cosmo_cost, likelihood_costs):
+        """
+        Order the blocks and set their over-sampling from the measured costs
+
+        Following Lewis 2013 (`Efficient sampling of fast and slow
+        cosmological parameters <http://arxiv.org/abs/1304.4473>`_), the
+        blocks of nuisance parameters are ordered from the slowest likelihood
+        to the fastest. Indeed, with the Cholesky decomposition, varying a
+        block also changes the following ones, so that only the likelihoods of
+        this block and of the following ones must be computed again.
+
+        The over-sampling factors are then chosen so that the time spent
+        varying the nuisance parameters is similar to the time spent varying
+        the cosmological parameters, shared equally between the blocks. They
+        are limited to :data:`MAX_OVER_SAMPLING`.
+
+        This rebuilds :attr:`block_parameters`, :attr:`over_sampling` and
+        :attr:`over_sampling_indices`, and sets :attr:`block_order`, the
+        position of the varying parameters in the order of the blocks, used
+        by :func:`mcmc.compute_cholesky`.
+
+        Parameters
+        ----------
+        cosmo_cost : float
+            Mean time needed by the cosmological module
+        likelihood_costs : dict
+            Mean time needed by every likelihood
+
+        """
+        varying = self.get_mcmc_parameters(['varying'])
+        nuisance = self.get_mcmc_parameters(['varying', 'nuisance'])
+
+        # As in :meth:`group_parameters_in_blocks`, a nuisance parameter
+        # shared between likelihoods belongs to the block of the first one
+        blocks = []
+        used_nuisance = []
+        for likelihood in self.lkl.itervalues():
+            names = [elem for elem in nuisance if elem in likelihood.nuisance
+                     and elem not in used_nuisance]
+            used_nuisance.extend(names)
+            if names:
+                blocks.append(
+                    (likelihood_costs.get(likelihood.name, 0.), names))
+        blocks.sort(key=lambda block: -block[0])
+
+        self.block_order = [varying.index(elem) for elem in
+                            self.get_mcmc_parameters(['varying', 'cosmo'])]
+        self.block_parameters = [len(self.block_order)]
+        for _, names in blocks:
+            self.block_order.extend([varying.index(elem) for elem in names])
+            self.block_parameters.append(len(self.block_order))
+
+        # Cost of a step in every block: all the likelihoods for the
+        # cosmological block, the ones of the following blocks otherwise
+        slow_cost = cosmo_cost+sum(likelihood_costs.itervalues())
+        sizes = np.diff([0]+self.block_parameters)
+        self.over_sampling = [1]
+        for index in range(len(blocks)):
+            cost = sum([block[0] for block in blocks[index:]])
+            if cost > 0:
+                factor = int(round(slow_cost*sizes[0] / (
+                    len(blocks)*sizes[index+1]*cost)))
+            else:
+                factor = MAX_OVER_SAMPLING
+            self.over_sampling.append(min(max(factor, 1), MAX_OVER_SAMPLING))
+
+        self.assign_over_sampling_indices()
+
     def assign_over_sampling_indices(self):
         """
         Create the list of varied parameters given the oversampling
@@ -630,6 +824,19 @@ class Data(object):
                 for _ in range(self.over_sampling[block_index]):
                     self.over_sampling_indices.append(index)
 
+    def seed_chain(self, number):
+        """
+        Seed the random numbers of the chain of the given number
+
+        An explicit seed, given with `--seed`, is shifted by the number of the
+        chain minus one, so that the chains sharing a folder, or the processes
+        of an MPI run, are different, while a given chain can be reproduced.
+        A drawn seed is kept as is.
+        """
+        if self.command_line.seed is not None:
+            self.seed = self.command_line.seed + number - 1
+            self.random_numbers = RandomNumbers(self.seed)
+
     def read_version(self, param_file):
         """
         Extract version and subversion from an existing log.param
@@ -667,16 +874,28 @@ class Data(object):
 
             will only return the nuisance parameters that are being varied.
 
+        .. note::
+
+            The result is computed only once for each `table_of_strings`, see
+            :meth:`update_parameter_index`. A new list is returned at every
+            call, so that it can be safely modified.
+
         """
+        key = tuple(table_of_strings)
+        try:
+            return list(self._parameter_index[key])
+        except KeyError:
+            pass
         table = []
-        for key, value in self.mcmc_parameters.iteritems():
+        for name, value in self.mcmc_parameters.iteritems():
             number = 0
             for subvalue in value.itervalues():
                 for string in table_of_strings:
                     if subvalue == string:
                         number += 1
             if number == len(table_of_strings):
-                table.append(key)
+                table.append(name)
+        self._parameter_index[key] = tuple(table)
         return table
 
     def check_for_slow_step(self, new_step):
@@ -685,24 +904,15 @@ class Data(object):
         changed, and if no, skip computation of the cosmology.
 
         """
-        parameter_names = self.get_mcmc_parameters(['varying'])
-        cosmo_names = self.get_mcmc_parameters(['cosmo'])
+        store = self.parameter_store
 
-        need_change = 0
-
-        # For all elements in the varying parameters:
-        for elem in parameter_names:
-            i = parameter_names.index(elem)
-            # If it is a cosmological parameter
-            if elem in cosmo_names:
-                if self.mcmc_parameters[elem]['current'] != new_step[i]:
-                    need_change += 1
+        # Compare the whole varying vector at once. Before the first step, the
+        # current values are not defined (nan), and everything is flagged as
+        # changed.
+        changed = store.current[store.varying_indices] != new_step
 
         # If any cosmological value was changed,
-        if need_change > 0:
-            self.need_cosmo_update = True
-        else:
-            self.need_cosmo_update = False
+        self.need_cosmo_update = bool(changed[store.cosmo_positions].any())
 
         for likelihood in self.lkl.itervalues():
             # If the cosmology changed, you need to recompute the likelihood
@@ -712,16 +922,8 @@ class Data(object):
                 continue
             # Otherwise, check if the nuisance parameters of this likelihood
             # were changed
-            need_change = 0
-            for elem in parameter_names:
-                i = parameter_names.index(elem)
-                if elem in likelihood.nuisance:
-                    if self.mcmc_parameters[elem]['current'] != new_step[i]:
-                        need_change += 1
-            if need_change > 0:
-                likelihood.need_update = True
-            else:
-                likelihood.need_update = False
+            likelihood.need_update = bool(
+                changed[store.positions(likelihood.nuisance)].any())
 
     def update_cosmo_arguments(self):
         """
@@ -751,17 +953,19 @@ class Data(object):
             set, like :code:`N_ncdm` to 2, in this example.
 
         """
-        # For all elements in any cosmological parameters
-        for elem in self.get_mcmc_parameters(['cosmo']):
-            # Fill in the dictionnary with the current value of parameters
-            self.cosmo_arguments[elem] = \
-                self.mcmc_parameters[elem]['current'] *\
-                self.mcmc_parameters[elem]['scale']
+        store = self.parameter_store
+        # Fill in the dictionnary with the current value of parameters. The
+        # fixed ones were already multiplied by their scale once and for all.
+        self.cosmo_arguments.update(store.fixed_cosmo_arguments)
+        indices = store.varying_cosmo_indices
+        self.cosmo_arguments.update(zip(
+            store.varying_cosmo_names,
+            store.current[indices]*store.scale[indices]))
 
         # For all elements in the cosmological parameters from the mcmc list,
         # translate any-one that is not directly a CLASS parameter into one.
         # The try: except: syntax ensures that the first call
-        for elem in self.get_mcmc_parameters(['cosmo']):
+        for elem in store.cosmo_names:
             # infer h from Omega_Lambda and delete Omega_Lambda
             if elem == 'Omega_Lambda':
                 omega_b = self.cosmo_arguments['omega_b']
@@ -802,7 +1006,7 @@ class Data(object):
                 original_name = re.search(r'(.*)__1', elem).groups()[0]
                 # Recover the values of all the other elements
                 values = [self.cosmo_arguments[elem]]
-                for other_elem in self.get_mcmc_parameters(['cosmo']):
+                for other_elem in store.cosmo_names:
                     match = re.search(r'%s__([2-9])' % original_name,
                                       other_elem)
                     if match:
@@ -820,9 +1024,9 @@ class Data(object):
         """
         Static method to call for checking if a folder was already initialised
 
-        This method can be used to speed up the mpi initialisation in
-        :mod:`run`. If a process finds that the folder is already a proper
-        Monte Python one, it sends directly a 'go' signal to its next in line.
+        A folder is initialised once its log.param is completely written,
+        which the process of rank 0 of :func:`run.mpi_run` does before the
+        others start.
 
         .. warning::
 
@@ -911,8 +1115,7 @@ class Data(object):
         parameters = ctx.getParams()
 
         # Storing them as current points
-        for index, elem in enumerate(self.get_mcmc_parameters(["varying"])):
-            self.mcmc_parameters[elem]['current'] = parameters[index]
+        self.parameter_store.set_current(parameters)
 
         # Propagating this to the cosmo_arguments dictionary
         self.update_cosmo_arguments()
@@ -1006,6 +1209,902 @@ class Parameter(dict):
         self['prior'] = prior.Prior(array)
 
 
+class ParameterStore(object):
+    """
+    Array-backed mirror of :attr:`Data.mcmc_parameters`
+
+    The dictionary of :class:`Parameter` is convenient to read, but looking up
+    every field of every parameter at each step of the Markov chain is
+    measurably slow when running with many nuisance parameters. This class
+    stores the `current` and `last_accepted` values, the scales and the
+    boundaries as contiguous numpy arrays, along with precomputed masks and
+    index arrays for every role, so that the per-step routines can work on
+    vectors.
+
+    Every modification going through this class is written back to the
+    dictionaries of :attr:`Data.mcmc_parameters`, since the likelihoods read
+    their nuisance parameters from there.
+
+    .. note::
+
+        The store is ordered like :attr:`Data.mcmc_parameters`. The *varying
+        vector*, used everywhere in :mod:`mcmc`, follows the ordering of
+        :code:`data.get_mcmc_parameters(['varying'])`.
+
+    Attributes
+    ----------
+    names : list
+        Names of all the parameters
+    current : numpy array
+        Current value of every parameter (`nan` if not yet defined)
+    last_accepted : numpy array
+        Last accepted value of every parameter (`nan` if not yet defined)
+    scale : numpy array
+        Scale of every parameter
+    lower : numpy array
+        Lower boundary (`-inf` if unbound)
+    upper : numpy array
+        Upper boundary (`+inf` if unbound)
+    varying, cosmo, nuisance, derived : numpy array
+        Boolean masks over all the parameters
+    varying_indices : numpy array
+        Indices of the varying parameters
+    output_indices : numpy array
+        Indices of the varying and derived parameters, in the order in which
+        they are written to the chains
+    cosmo_positions : numpy array
+        Positions of the cosmological parameters inside the varying vector
+
+    """
+
+    def __init__(self, mcmc_parameters):
+        self.parameters = mcmc_parameters
+        self.names = list(mcmc_parameters.iterkeys())
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+        size = len(self.names)
+        self.current = np.empty(size, 'float64')
+        self.current.fill(np.nan)
+        self.last_accepted = np.copy(self.current)
+        self.scale = np.ones(size, 'float64')
+        self.lower = -np.inf*np.ones(size, 'float64')
+        self.upper = np.inf*np.ones(size, 'float64')
+        self.varying = np.zeros(size, 'bool')
+        self.cosmo = np.zeros(size, 'bool')
+        self.nuisance = np.zeros(size, 'bool')
+        self.derived = np.zeros(size, 'bool')
+
+        for i, (name, param) in enumerate(mcmc_parameters.iteritems()):
+            self.scale[i] = param['scale']
+            self.varying[i] = param['status'] == 'varying'
+            self.cosmo[i] = param['role'] == 'cosmo'
+            self.nuisance[i] = param['role'] == 'nuisance'
+            self.derived[i] = param['role'] == 'derived'
+            for field, array in zip(
+                    ['current', 'last_accepted'],
+                    [self.current, self.last_accepted]):
+                if field in param:
+                    try:
+                        array[i] = param[field]
+                    except (TypeError, ValueError):
+                        pass
+            # Same convention as in the parameter file: -1 or None means that
+            # there is no boundary
+            lower, upper = param['initial'][1:3]
+            if lower is not None and str(lower) != str(-1):
+                self.lower[i] = lower
+            if upper is not None and str(upper) != str(-1):
+                self.upper[i] = upper
+
+        self.varying_indices = np.flatnonzero(self.varying)
+        self.varying_names = [self.names[i] for i in self.varying_indices]
+        self.derived_indices = np.flatnonzero(self.derived)
+        self.derived_names = [self.names[i] for i in self.derived_indices]
+        self.output_indices = np.concatenate(
+            [self.varying_indices, self.derived_indices])
+        self.cosmo_names = [name for i, name in enumerate(self.names)
+                            if self.cosmo[i]]
+        self.cosmo_positions = np.flatnonzero(
+            self.cosmo[self.varying_indices])
+
+        # The cosmological arguments are obtained by multiplying the current
+        # value by the scale. For fixed parameters, this is done once and for
+        # all, keeping the original type of the value.
+        self.varying_cosmo_indices = np.flatnonzero(
+            self.cosmo & self.varying)
+        self.varying_cosmo_names = [
+            self.names[i] for i in self.varying_cosmo_indices]
+        self.fixed_cosmo_arguments = [
+            (name, mcmc_parameters[name]['current'] *
+             mcmc_parameters[name]['scale'])
+            for name in self.cosmo_names
+            if mcmc_parameters[name]['status'] != 'varying']
+
+        # Cache of the positions of groups of parameters inside the varying
+        # vector, filled by :meth:`positions`
+        self._positions = {}
+
+    def positions(self, names):
+        """
+        Return the positions inside the varying vector of the given names
+
+        Names that are not varying are ignored. The result is cached, as this
+        is typically called with the nuisance parameters of a likelihood at
+        every step.
+
+        """
+        key = tuple(names)
+        try:
+            return self._positions[key]
+        except KeyError:
+            varying_position = dict(
+                (name, i) for i, name in enumerate(self.varying_names))
+            positions = np.array(
+                [varying_position[name] for name in names
+                 if name in varying_position], 'int')
+            self._positions[key] = positions
+            return positions
+
+    def get_values(self, names):
+        """Return a tuple of the current values of `names`"""
+        return tuple([self.current[self.index[name]] for name in names])
+
+    def get_current(self):
+        """Return a copy of the varying vector at the current point"""
+        return self.current[self.varying_indices]
+
+    def get_last_accepted(self):
+        """
+        Return a copy of the varying vector at the last accepted point
+
+        If no point was accepted yet (initialisation routine), return instead
+        the mean values from the parameter file.
+
+        """
+        vector = self.last_accepted[self.varying_indices]
+        if np.isnan(vector).any():
+            vector = np.array(
+                [self.parameters[name]['initial'][0]
+                 for name in self.varying_names], 'float64')
+        return vector
+
+    def set_current(self, vector, names=None):
+        """
+        Set the current value of the varying parameters (or of `names`)
+
+        """
+        self._set('current', self.current, vector, names)
+
+    def set_last_accepted(self, vector, names=None):
+        """
+        Set the last accepted value of the varying parameters (or of `names`)
+
+        """
+        self._set('last_accepted', self.last_accepted, vector, names)
+
+    def read_current(self, names):
+        """
+        Update the stored current values of `names` from the dictionaries
+
+        This is needed whenever a routine writes directly into
+        :attr:`Data.mcmc_parameters`, for instance the cosmological module
+        when extracting derived parameters.
+
+        """
+        for name in names:
+            self.current[self.index[name]] = self.parameters[name]['current']
+
+    def accept(self):
+        """
+        Transfer the current point to the last accepted one
+
+        This affects only the varying and derived parameters, exactly like
+        :func:`sampler.accept_step`.
+
+        """
+        indices = self.output_indices
+        self.last_accepted[indices] = self.current[indices]
+        for i in indices:
+            self.parameters[self.names[i]]['last_accepted'] = \
+                self.last_accepted[i]
+
+    def in_bounds(self, vector):
+        """Test whether the varying vector lies within the boundaries"""
+        indices = self.varying_indices
+        return not ((vector < self.lower[indices]).any() or
+                    (vector > self.upper[indices]).any())
+
+    def output_vector(self):
+        """
+        Return the last accepted values to be written to the chain
+
+        It contains the varying parameters, followed by the derived ones.
+
+        """
+        return self.last_accepted[self.output_indices]
+
+    def _set(self, field, array, vector, names):
+        """Write `vector` in `array`, and propagate it to the dictionaries"""
+        if names is None:
+            names = self.varying_names
+            array[self.varying_indices] = vector
+        else:
+            for name, value in zip(names, vector):
+                array[self.index[name]] = value
+        for name, value in zip(names, vector):
+            self.parameters[name][field] = value
+
+
+class CosmologyCache(object):
+    """
+    Results already obtained for given cosmological arguments
+
+    Many points visited by the samplers share the same cosmology: the fast
+    steps only vary nuisance parameters, a rejected fast step is often
+    followed by a jump back to the last accepted cosmology, and the Fisher
+    matrix computation evaluates the center point several times. For each
+    set of :attr:`Data.cosmo_arguments`, this cache remembers the value of the
+    likelihoods (for the values of their nuisance parameters), the derived
+    parameters, and whether the cosmological module failed. When everything
+    is known, :func:`sampler.compute_lkl` does not call the cosmological
+    module at all.
+
+    Only the :attr:`size` most recently used cosmologies are kept, and for
+    each of them, only the last value of every likelihood: the fast steps
+    hardly ever come back to the same nuisance parameters. With a size of 0
+    (the default of `--cosmo-cache`), nothing is kept.
+
+    Attributes
+    ----------
+    entries : ordereddict
+        For each key, a dictionary containing the log likelihoods under
+        `loglkl`, indexed by the likelihood name, as a tuple of the values of
+        its nuisance parameters and of the log likelihood, the derived
+        parameters under `derived` (None if not computed), and `failed`.
+    computed_key : tuple
+        Key of the cosmology currently held by the cosmological module
+    hits, misses : int
+        Number of times a cosmology was found, or not, in the cache
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = od()
+        self.computed_key = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(cosmo_arguments):
+        """
+        Return a canonical, hashable version of the cosmological arguments
+
+        The representation of the values is used, so that two floats are only
+        considered equal if they are exactly the same.
+
+        """
+        return tuple(sorted(
+            [(name, repr(value)) for name, value in
+             cosmo_arguments.iteritems()]))
+
+    def get(self, key):
+        """
+        Return the entry corresponding to `key`
+
+        A new empty entry is created in case of a miss, and the least
+        recently used one is removed if the cache is full. Without size, a
+        new entry is always returned, and not counted as a miss.
+
+        """
+        if self.size <= 0:
+            return {'loglkl': {}, 'derived': None, 'failed': False}
+        try:
+            entry = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            entry = {'loglkl': {}, 'derived': None, 'failed': False}
+            self.misses += 1
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+
+class CosmologyQuantities(object):
+    """
+    Quantities obtained from the cosmological module, shared by the
+    likelihoods
+
+    Base class of :class:`ClCache`, :class:`BackgroundTable` and
+    :class:`PowerSpectrumGrid`. The quantities are computed by
+    :meth:`compute` when they are first asked for a cosmology, identified by
+    the instance of the cosmological module holding it and by the key of
+    :attr:`Data.cosmo_arguments` (see :meth:`CosmologyCache.key`). They are
+    thus always those of the cosmology given to the likelihood, whatever the
+    sampler calling it (:func:`sampler.compute_lkl`, or the CosmoHammer,
+    which calls the likelihoods directly).
+
+    The quantities of the :attr:`size` most recent cosmologies are kept, so
+    that alternating between the two ends of a dragged proposal (see
+    :func:`mcmc.drag`) does not compute them again.
+
+    Attributes
+    ----------
+    cosmo_arguments : dict
+        Arguments of the cosmological module, shared with the
+        :class:`Data` instance
+    key : tuple
+        Identity of the instance of the cosmological module and key of the
+        cosmology of the quantities, or None if they are not computed
+    fields : tuple
+        Names of the attributes set by :meth:`compute`
+
+    """
+
+    # Shared by the instances, as a lock can not be pickled
+    _lock = threading.RLock()
+
+    fields = ()
+    size = 2
+
+    def __init__(self, cosmo_arguments):
+        self.cosmo_arguments = cosmo_arguments
+        self.key = None
+        self._states = od()
+
+    def update(self, cosmo, key=None):
+        """
+        Compute the quantities for the cosmology held by `cosmo`, if needed
+
+        Parameters
+        ----------
+        key : tuple
+            Key of :attr:`cosmo_arguments`, computed again if not given
+
+        Returns
+        -------
+        computed : bool
+            Whether the quantities were computed
+
+        """
+        if key is None:
+            key = CosmologyCache.key(self.cosmo_arguments)
+        key = (id(cosmo), key)
+        with self._lock:
+            if key == self.key:
+                return False
+            computed = key not in self._states
+            if computed:
+                self.key = None
+                self.compute(cosmo)
+                state = dict(
+                    (name, getattr(self, name)) for name in self.fields)
+            else:
+                state = self._states.pop(key)
+                for name, value in state.iteritems():
+                    setattr(self, name, value)
+            self._states[key] = state
+            if len(self._states) > self.size:
+                self._states.popitem(last=False)
+            self.key = key
+        return computed
+
+    def reset(self):
+        """Forget the quantities computed for all the cosmologies"""
+        with self._lock:
+            self.key = None
+            self._states.clear()
+
+    def compute(self, cosmo):
+        """Set the attributes named in :attr:`fields` from `cosmo`"""
+        raise NotImplementedError(
+            'Must implement method compute() in %s' % (
+                self.__class__.__name__))
+
+
+class ClCache(CosmologyQuantities):
+    """
+    Spectra of the cosmological module for the current cosmology
+
+    The lensed and unlensed :math:`C_\ell` are extracted from the
+    cosmological module, and converted to :math:`\mu {\\rm K}^2` (except
+    for the `pp` and `ell` entries), only once per cosmology, up to the
+    highest multipole computed, which is the highest one requested by the
+    likelihoods (see :meth:`likelihood_class.Likelihood.need_cosmo_arguments`).
+    :meth:`likelihood_class.Likelihood.get_cl` and
+    :meth:`likelihood_class.Likelihood.get_unlensed_cl` then serve every
+    likelihood a new dictionary of read-only arrays, sliced up to the
+    multipole it asks for, without any copy. A likelihood modifying the
+    spectra must thus work on a copy.
+
+    The cache is emptied by :meth:`get` when the cosmology changed (see
+    :class:`CosmologyQuantities`). The extraction is protected by a lock, for
+    the likelihoods computed in threads.
+
+    Attributes
+    ----------
+    spectra : dict
+        Converted spectra, under `lensed_cl` and `raw_cl`
+
+    """
+
+    fields = ('spectra', )
+
+    def __init__(self, cosmo_arguments):
+        CosmologyQuantities.__init__(self, cosmo_arguments)
+        self.spectra = {}
+
+    def compute(self, cosmo):
+        """Start with no spectra, extracted when first asked by :meth:`get`"""
+        self.spectra = {}
+
+    def get(self, cosmo, kind, l_max=-1):
+        """
+        Return the spectra up to `l_max`, in :math:`\mu {\\rm K}^2`
+
+        Parameters
+        ----------
+        cosmo : :class:`Class`
+            Cosmological module, holding the current cosmology
+        kind : str
+            Name of the method of the cosmological module returning the
+            spectra, `lensed_cl` or `raw_cl`
+        l_max : int
+            Highest multipole, all the computed ones if negative
+
+        """
+        with self._lock:
+            self.update(cosmo)
+            try:
+                spectra = self.spectra[kind]
+            except KeyError:
+                spectra = getattr(cosmo, kind)()
+                # All quantities need to be multiplied by this factor, except
+                # the phi-phi term, that is already dimensionless
+                factor = (cosmo.T_cmb()*1.e6)**2
+                for name in spectra.iterkeys():
+                    if name not in ['pp', 'ell']:
+                        spectra[name] = spectra[name]*factor
+                    spectra[name].flags.writeable = False
+                self.spectra[kind] = spectra
+
+        if l_max < 0:
+            return dict(spectra)
+        if l_max >= len(spectra['ell']):
+            raise io_mp.LikelihoodError(
+                "The cosmological module computed the Cls up to l=%d, while "
+                "l=%d is asked" % (len(spectra['ell'])-1, l_max))
+        return dict((name, value[:l_max+1])
+                    for name, value in spectra.iteritems())
+
+
+class RedshiftTable(CosmologyQuantities):
+    """
+    Quantities computed once per cosmology at the redshifts of the likelihoods
+
+    Base class of :class:`BackgroundTable` and :class:`PowerSpectrumGrid`,
+    collecting the redshifts requested by the likelihoods during their
+    initialisation.
+
+    Attributes
+    ----------
+    z : numpy array
+        Requested redshifts, each of them only once
+
+    """
+
+    def __init__(self, cosmo_arguments):
+        CosmologyQuantities.__init__(self, cosmo_arguments)
+        self.z = np.array([], 'float64')
+        self._positions = {}
+
+    def request(self, z):
+        """
+        Add redshifts to the table, and return their indices
+
+        Parameters
+        ----------
+        z : float or array
+            Redshifts needed by the likelihood
+
+        Returns
+        -------
+        indices : numpy array
+            Indices of the redshifts in the arrays of the table, with the
+            shape of `z`
+
+        """
+        z = np.asarray(z, 'float64')
+        indices = np.empty(z.shape, 'int')
+        new = []
+        for position, value in np.ndenumerate(z):
+            if value not in self._positions:
+                self._positions[value] = len(self.z)+len(new)
+                new.append(value)
+            indices[position] = self._positions[value]
+        if new:
+            self.z = np.append(self.z, new)
+            self.reset()
+        return indices
+
+
+class BackgroundTable(RedshiftTable):
+    """
+    Background quantities at the redshifts requested by the likelihoods
+
+    Instead of asking the cosmological module for the distances one redshift
+    at a time, the likelihoods register their redshifts with :meth:`request`
+    when they are initialised, and keep the returned indices. When the table
+    is first asked with :meth:`get` for a new cosmology (or before the
+    likelihoods are computed by :func:`sampler.compute_lkl`), :meth:`compute`
+    obtains the comoving distance and the Hubble rate at all the redshifts at
+    once, with the function `z_of_r` of the cosmological module. The other distances follow from the comoving one
+    for a flat universe. This is checked against the angular distance at the
+    highest redshift, and the angular distance is otherwise asked at every
+    redshift.
+
+    The likelihoods then read the arrays with their indices, for instance
+
+    .. code::
+
+        # in __init__
+        self.indices = data.background.request(self.z)
+        # in loglkl
+        D_A = data.background.get(cosmo).angular_distance[self.indices]
+
+    Attributes
+    ----------
+    comoving_distance, angular_distance, luminosity_distance : numpy array
+        Distances at the redshifts :attr:`z`, in Mpc
+    hubble : numpy array
+        Hubble rate at these redshifts, in 1/Mpc
+    rs_drag : float
+        Sound horizon at the baryon drag epoch, in Mpc
+
+    """
+
+    fields = ('comoving_distance', 'angular_distance', 'luminosity_distance',
+              'hubble', 'rs_drag')
+
+    def __init__(self, cosmo_arguments):
+        RedshiftTable.__init__(self, cosmo_arguments)
+        self.comoving_distance = np.array([], 'float64')
+        self.angular_distance = np.array([], 'float64')
+        self.luminosity_distance = np.array([], 'float64')
+        self.hubble = np.array([], 'float64')
+        self.rs_drag = None
+
+    def get(self, cosmo):
+        """
+        Return the table, filled for the cosmology held by `cosmo`
+
+        """
+        self.update(cosmo)
+        return self
+
+    def compute(self, cosmo):
+        """
+        Fill the table for the cosmology held by `cosmo`
+
+        """
+        self.comoving_distance, self.hubble = [
+            np.asarray(elem, 'float64') for elem in cosmo.z_of_r(self.z)]
+        transverse = self.comoving_distance
+        last = np.argmax(self.z)
+        if abs(cosmo.angular_distance(self.z[last])*(1+self.z[last]) -
+               transverse[last]) > 1e-8*transverse[last]:
+            transverse = np.array(
+                [cosmo.angular_distance(z) for z in self.z])*(1+self.z)
+        self.angular_distance = transverse/(1+self.z)
+        self.luminosity_distance = transverse*(1+self.z)
+        self.rs_drag = cosmo.rs_drag()
+
+
+class PowerSpectrumGrid(RedshiftTable):
+    """
+    Matter power spectrum at the redshifts requested by the likelihoods
+
+    The likelihoods register with :meth:`request` the redshifts and the range
+    of wavenumbers where they need :math:`P(k,z)`, and keep the returned
+    indices. When the grid is first asked for a new cosmology (or before the
+    likelihoods are computed by :func:`sampler.compute_lkl`), :meth:`compute`
+    asks the cosmological module, in a single call to its function `get_pk`, for the power spectrum on a grid of
+    :attr:`k_per_decade` logarithmically spaced wavenumbers per decade,
+    covering all the requested ranges, at all the requested redshifts. The
+    likelihoods then obtain the spectrum at arrays of wavenumbers with
+    :meth:`get`, which interpolates it with cubic splines of :math:`\ln P` in
+    :math:`\ln k`, at the exact redshifts.
+
+    Outside of the range given to :meth:`get`, the power spectrum is set to
+    zero. A wavenumber inside of this range but outside of the grid, which
+    the cosmological module did not compute, raises
+    :class:`io_mp.OutOfGridError`, and the point is rejected.
+
+    Attributes
+    ----------
+    ranges : list
+        Ranges of wavenumbers requested, as tuples (`k_min`, `k_max`,
+        `h_units`), whose bounds can be functions of the cosmological module
+    k : numpy array
+        Wavenumbers of the grid, in 1/Mpc
+    splines : list
+        Interpolation of :math:`\ln P` in :math:`\ln k` at every redshift
+
+    """
+
+    k_per_decade = 50
+
+    fields = ('k', 'splines')
+
+    def __init__(self, cosmo_arguments):
+        RedshiftTable.__init__(self, cosmo_arguments)
+        self.ranges = []
+        self.k = None
+        self.splines = []
+
+    def request(self, z, k_min, k_max, h_units=False):
+        """
+        Add redshifts and a range of wavenumbers, and return their indices
+
+        Parameters
+        ----------
+        z : float or array
+            Redshifts needed by the likelihood
+        k_min, k_max : float or function
+            Range of wavenumbers needed by the likelihood, in 1/Mpc, or in
+            h/Mpc if `h_units` is True. A bound depending on the cosmology is
+            given as a function of the cosmological module, called for every
+            new cosmology. The cosmological module must compute the power
+            spectrum up to `k_max` (see
+            :meth:`likelihood_class.Likelihood.need_cosmo_arguments`).
+
+        Returns
+        -------
+        indices : numpy array
+            Indices of the redshifts, to be given to :meth:`get`
+
+        """
+        self.ranges.append((k_min, k_max, h_units))
+        self.reset()
+        return RedshiftTable.request(self, z)
+
+    def compute(self, cosmo):
+        """
+        Fill the grid for the cosmology held by `cosmo`
+
+        """
+        h = cosmo.h()
+        bounds = np.array([
+            [(bound(cosmo) if callable(bound) else bound)*(h if h_units else 1.)
+             for bound in (k_min, k_max)]
+            for k_min, k_max, h_units in self.ranges])
+        k_min, k_max = bounds[:, 0].min(), bounds[:, 1].max()
+        size = max(4, int(math.ceil(
+            self.k_per_decade*math.log10(k_max/k_min)))+1)
+        self.k = np.exp(np.linspace(math.log(k_min), math.log(k_max), size))
+        self.k[0], self.k[-1] = k_min, k_max
+
+        # The wavenumbers are the same at every redshift
+        k = np.tile(self.k[:, np.newaxis, np.newaxis], (1, len(self.z), 1))
+        pk = cosmo.get_pk(k, self.z, size, len(self.z), 1)[:, :, 0]
+        log_k = np.log(self.k)
+        self.splines = [interpolate.InterpolatedUnivariateSpline(
+            log_k, np.log(pk[:, index])) for index in range(len(self.z))]
+
+    def get(self, cosmo, k, indices, k_min=0., k_max=np.inf):
+        """
+        Return the power spectrum, in :math:`{\\rm Mpc}^3`, for the cosmology
+        held by `cosmo`
+
+        Parameters
+        ----------
+        k : array
+            Wavenumbers, in 1/Mpc
+        indices : array
+            Indices of the redshifts returned by :meth:`request`, broadcast
+            against `k`
+        k_min, k_max : float
+            Range of wavenumbers, in 1/Mpc, outside of which the power
+            spectrum is set to zero
+
+        """
+        self.update(cosmo)
+        k, indices = np.broadcast_arrays(np.asarray(k, 'float64'), indices)
+        pk = np.zeros(k.shape, 'float64')
+        inside = (k >= k_min) & (k <= k_max)
+        if inside.any() and (k[inside].min() < self.k[0] or
+                             k[inside].max() > self.k[-1]):
+            raise io_mp.OutOfGridError(
+                "P(k) is needed for k in [%g, %g] 1/Mpc, but was only "
+                "computed in [%g, %g] 1/Mpc. Please increase the range of "
+                "wavenumbers requested by the likelihood." % (
+                    k[inside].min(), k[inside].max(), self.k[0], self.k[-1]))
+        for index in np.unique(indices[inside]):
+            selection = inside & (indices == index)
+            pk[selection] = np.exp(self.splines[index](np.log(k[selection])))
+        return pk
+
+
+class RandomNumbers(object):
+    """
+    Seeded source of random numbers, drawn in blocks
+
+    Drawing the standard normal and uniform deviates one by one, as required
+    by the proposal density and the acceptance test, has a cost that is not
+    negligible for fast steps. They are instead generated by blocks of
+    :attr:`block_size` numbers, and served from this buffer.
+
+    The sequence only depends on the seed, which allows to reproduce a chain.
+
+    """
+    block_size = 4096
+
+    def __init__(self, seed):
+        self.state = np.random.RandomState(seed)
+        self._normals = np.empty(0)
+        self._normal_index = 0
+        self._uniforms = np.empty(0)
+        self._uniform_index = 0
+
+    def normal(self, size):
+        """Return an array of `size` standard normal deviates"""
+        if self._normal_index + size > len(self._normals):
+            self._normals = np.concatenate([
+                self._normals[self._normal_index:],
+                self.state.standard_normal(max(self.block_size, size))])
+            self._normal_index = 0
+        result = self._normals[self._normal_index:self._normal_index+size]
+        self._normal_index += size
+        return result
+
+    def uniform(self):
+        """Return one uniform deviate in [0, 1)"""
+        if self._uniform_index == len(self._uniforms):
+            self._uniforms = self.state.random_sample(self.block_size)
+            self._uniform_index = 0
+        self._uniform_index += 1
+        return self._uniforms[self._uniform_index-1]
+
+
+class StageTimings(object):
+    """
+    Durations of the calls of one stage, see :class:`Profiler`
+
+    The number of calls, the sum and the sum of squares of the durations are
+    kept, for the mean and standard deviation, with a uniform sample of at
+    most :attr:`size` of the durations for the percentiles (reservoir
+    sampling), so that the memory does not grow with the length of the chain.
+
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.count = 0
+        self.total = 0.
+        self.total_squares = 0.
+        self.sample = array('d')
+        # A generator of its own, to leave the random numbers of the chain
+        # unchanged
+        self.random = random.Random(size)
+
+    def add(self, duration):
+        """Record the duration of a call"""
+        self.count += 1
+        self.total += duration
+        self.total_squares += duration**2
+        if len(self.sample) < self.size:
+            self.sample.append(duration)
+        else:
+            index = self.random.randint(0, self.count-1)
+            if index < self.size:
+                self.sample[index] = duration
+
+    def mean(self):
+        """Return the mean duration, or 0 if never timed"""
+        if not self.count:
+            return 0.
+        return self.total/self.count
+
+    def std(self):
+        """Return the standard deviation of the durations"""
+        if not self.count:
+            return 0.
+        return math.sqrt(max(
+            0., self.total_squares/self.count-self.mean()**2))
+
+    def percentiles(self, q):
+        """Return the percentiles `q` of the durations, from the sample"""
+        return np.percentile(np.frombuffer(self.sample, 'float64'), q)
+
+
+class Profiler(object):
+    """
+    Timings of the different stages of the computation of a chain
+
+    The code to be timed is surrounded by calls to :meth:`start` and
+    :meth:`stop`. When the profiler is disabled, these calls return
+    immediately, so that they can be left in place. The durations of every
+    stage are summarised in a :class:`StageTimings`, of bounded size. The
+    first duration of a stage is recorded while holding a lock, as the
+    likelihoods computed in threads may add their stages at the same time.
+
+    Attributes
+    ----------
+    timings : ordereddict
+        :class:`StageTimings` of every stage
+    evaluations, computations : int
+        Number of computations of the likelihood, and number of them that
+        needed the cosmological module
+
+    """
+
+    # Shared by the instances, as a lock can not be pickled
+    _lock = threading.Lock()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timings = od()
+        self.evaluations = 0
+        self.computations = 0
+
+    def start(self):
+        """Return the starting time of a stage, or None if disabled"""
+        if self.enabled:
+            return time.time()
+
+    def stop(self, stage, start):
+        """Record the duration of a stage started at `start`"""
+        if self.enabled:
+            duration = time.time()-start
+            try:
+                self.timings[stage].add(duration)
+            except KeyError:
+                with self._lock:
+                    if stage not in self.timings:
+                        self.timings[stage] = StageTimings()
+                    self.timings[stage].add(duration)
+
+    def mean(self, stage):
+        """Return the mean duration of a stage, or 0 if never timed"""
+        if stage not in self.timings:
+            return 0.
+        return self.timings[stage].mean()
+
+    def summary(self, cache=None):
+        """
+        Return a text summary of the timings
+
+        It contains, for every stage, the number of calls, the total time, and
+        the mean, standard deviation, median and 90 and 99 percentiles of a
+        call, followed by the fraction of the likelihood computations that did
+        not need the cosmological module, and the hit rate of the `cache`
+        (:class:`CosmologyCache`) if given.
+
+        """
+        lines = ['# %-32s %10s %10s %10s %10s %10s %10s %10s' % (
+            'stage', 'calls', 'total [s]', 'mean [ms]', 'std', 'median',
+            '90%', '99%')]
+        for stage, timings in self.timings.iteritems():
+            lines.append(
+                '%-34s %10d %10.3f %10.3f %10.3f %10.3f %10.3f %10.3f' % (
+                    (stage, timings.count, timings.total,
+                     1e3*timings.mean(), 1e3*timings.std()) +
+                    tuple(1e3*timings.percentiles([50, 90, 99]))))
+        if self.evaluations:
+            lines.append(
+                '# cosmological module skipped in %.1f%% of the %d '
+                'likelihood computations' % (
+                    100.*(1-float(self.computations)/self.evaluations),
+                    self.evaluations))
+        if cache is not None and cache.hits+cache.misses:
+            lines.append(
+                '# cosmological models found in cache: %.1f%% (%d hits, %d '
+                'misses)' % (100.*cache.hits/(cache.hits+cache.misses),
+                             cache.hits, cache.misses))
+        return '\n'.join(lines)+'\n'
+
+
 class Container(object):
     """Dummy class to act as a namespace for data"""
     pass
@@ -48,6 +48,11 @@ def run(cosmo, data, command_line):
     that will become non-integer. Indeed, the multiplicity is also a probe of
     the posterior, and this new, higher likelihood should have had a higher
     multiplicity.
+
+    If the starting run was done with `--store-evaluations` and
+    `--store-spectra`, the new likelihoods that only need the spectra are
+    computed from the stored ones (see :class:`StoredCosmology`), without
+    calling the cosmological module.
     """
     # Check that the command_line "--IS-starting-folder" points to an existing
     # Monte Python folder run, or a subset of files, and store in any case all
@@ -64,7 +69,8 @@ def run(cosmo, data, command_line):
         starting_folder = starting_folder[0]
         if os.path.isdir(starting_folder):
             for elem in os.listdir(starting_folder):
-                if elem.find("__") != -1:
+                if elem.find("__") != -1 and \
+                        os.path.splitext(elem)[1] in ['.txt', '.bin']:
                     chains.append(elem)
     # Else, it is a list of chains, of which we recover folder name, and store
     # all of them in chains.
@@ -158,32 +164,106 @@ def translate_chain(data, cosmo, command_line,
     output_path = os.path.join(command_line.folder, chain_name)
     print ' -> reading ', input_path
     parameter_names = data.get_mcmc_parameters(['varying'])
-    with open(input_path, 'r') as input_chain:
-        with open(output_path, 'w') as output_chain:
-            for line in input_chain:
-                params = line.split()
-                # recover the likelihood of this point
-                if not ignore_likelihood:
-                    loglike = -float(params[1])
-                else:
-                    loglike = 0
-                N = float(params[0])
-                # Assign all the recovered values to the data structure
-                for index, param in enumerate(parameter_names):
-                    data.mcmc_parameters[param]['current'] = \
-                        float(params[2+index])
-                data.update_cosmo_arguments()
+    store = data.parameter_store
+    evaluations = io_mp.EvaluationStore(starting_folder)
+    # The new chain is written in the same format as the input one
+    with io_mp.open_chain(output_path, data,
+                          io_mp.is_binary_chain(input_path)) as output_chain:
+        for line in io_mp.iterate_chain(input_path):
+            if isinstance(line, str):
+                output_chain.write(line)
+                continue
+            params = line
+            # recover the likelihood of this point
+            if not ignore_likelihood:
+                loglike = -float(params[1])
+            else:
+                loglike = 0
+            N = float(params[0])
+            # Assign all the recovered values to the data structure
+            data.parameter_store.set_current(
+                [float(params[2+index])
+                 for index in range(len(parameter_names))])
+            data.update_cosmo_arguments()
 
+            # Try first with the results stored by the starting run
+            record = evaluations.get(evaluations.key(
+                store.varying_cosmo_names,
+                store.current[store.varying_cosmo_indices]))
+            newloglike = None
+            if record is not None and 'lensed_cl' in record:
+                try:
+                    newloglike = sampler.compute_lkl(
+                        StoredCosmology(record), data)
+                except (AttributeError, KeyError):
+                    pass
+                # The real cosmological module was not computed at this
+                # point
+                data.cosmo_cache.computed_key = None
+            if newloglike is None:
                 newloglike = sampler.compute_lkl(cosmo, data)
 
-                weight = math.exp(newloglike)
-                newloglike += loglike
-                # Accept the point
-                sampler.accept_step(data)
-                io_mp.print_vector([output_chain], N*weight, newloglike, data)
+            weight = math.exp(newloglike)
+            newloglike += loglike
+            # Accept the point
+            sampler.accept_step(data)
+            io_mp.print_vector([output_chain], N*weight, newloglike, data)
     print output_path, 'written'
 
 
+class StoredCosmology(object):
+    """
+    Stand-in for the cosmological module, built from a stored evaluation
+
+    It exposes the part of the classy interface that can be answered from a
+    record of :class:`io_mp.EvaluationStore`: the spectra, the CMB
+    temperature and the stored derived parameters. Asking for anything else
+    raises an AttributeError, and asking for a quantity that was not stored
+    raises a KeyError, in which case the real cosmological module should be
+    used instead.
+
+    """
+    state = True
+
+    def __init__(self, record):
+        self.record = record
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def compute(self, *args, **kwargs):
+        pass
+
+    def struct_cleanup(self):
+        pass
+
+    def empty(self):
+        pass
+
+    def T_cmb(self):
+        return self.record['T_cmb']
+
+    def lensed_cl(self, l_max=-1):
+        return self._get_cl('lensed_cl', l_max)
+
+    def raw_cl(self, l_max=-1):
+        return self._get_cl('raw_cl', l_max)
+
+    def get_current_derived_parameters(self, names):
+        return dict((name, self.record['derived'][name]) for name in names)
+
+    def _get_cl(self, kind, l_max):
+        """Return a copy of the stored spectra, up to l_max if specified"""
+        cl = self.record[kind]
+        if l_max < 0:
+            return dict((key, copy(value)) for key, value in cl.iteritems())
+        if len(cl['ell']) <= l_max:
+            raise KeyError(
+                "The stored spectra only go up to l=%d" % (len(cl['ell'])-1))
+        return dict((key, value[:l_max+1].copy())
+                    for key, value in cl.iteritems())
+
+
 def translate_chain_star(args):
     """Trick function for multiprocessing"""
     return translate_chain(*args)
@@ -80,7 +80,7 @@ def initialise(custom_command=''):
 
         # Initialising the sampler
         # MH: Creating the file that will contain the chain
-        if command_line.method == 'MH':
+        if command_line.method in ['MH', 'DA']:
             io_mp.create_output_files(command_line, data)
         # NS: Creating the NS subfolder and the MultiNest arguments
         elif command_line.method == 'NS':
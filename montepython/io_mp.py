@@ -11,7 +11,10 @@ contrary, if there are more arguments, they will be detailled.
 
 This module also defines a new class :class:`File`, that extends
 :py:class:`file`, which provides a tail function. It is used in
-:func:`sampler.read_args_from_chain`.
+:func:`sampler.read_args_from_chain`. The class :class:`EvaluationStore`
+handles the file storing the results of the cosmological module computed
+during a run, and the class :class:`BinaryChain` writes the chains in binary
+format (see :func:`read_binary_chain` and :func:`iterate_chain` to read them).
 
 Finally, the way the error messages are displayed is set there, along with
 ascii-art for the exclamation mark sign.
@@ -21,6 +24,13 @@ import os
 import re  # Module to handle regular expressions
 from datetime import date
 import fcntl
+import struct
+import cPickle as pickle
+import json
+import threading
+import time
+import Queue
+import numpy as np
 import textwrap  # used to format the error messages
 
 # Ascii art for error display
@@ -80,6 +90,52 @@ def log_likelihood_parameters(likelihood, command_line):
     #tolog.close()
 
 
+def log_random_seed(data, command_line):
+    """
+    Write down the seed of the random number generator to log.param
+
+    Every chain appends its own seed, along with its name, when it is created.
+    The seed is also stored at the top of the chain, see
+    :func:`create_output_files`.
+
+    """
+    with open(os.path.join(command_line.folder, 'log.param'), 'a') as log:
+        log.write('\n#-----Random-seed of {0}: {1}-----\n'.format(
+            os.path.basename(data.out_name), data.seed))
+
+
+def log_block_tuning(data, command_line):
+    """
+    Write down the blocks and over-sampling chosen by the chain to log.param
+
+    They are written as comments, since the blocks may be ordered differently
+    from the default ones (see :meth:`data.Data.tune_blocks`). The names of
+    the parameters of every block are given, in the order of the jumps.
+
+    Every chain writes its own choice, which depends on the costs it
+    measured. The entry is written at once, while holding a lock on the file,
+    so that the entries of chains running in parallel are not mixed.
+
+    """
+    varying = data.get_mcmc_parameters(['varying'])
+    names = [varying[index] for index in data.block_order]
+    blocks = [names[start:end] for start, end in zip(
+        [0]+data.block_parameters[:-1], data.block_parameters)]
+    entry = '\n\n#-----Block-tuning-{0}-----\n'.format(
+        os.path.basename(data.out_name))
+    for block, over_sampling in zip(blocks, data.over_sampling):
+        entry += '# block {0} (x{1})\n'.format(
+            ', '.join(block), over_sampling)
+    entry += '# data.over_sampling = {0}\n'.format(data.over_sampling)
+    with open(os.path.join(command_line.folder, 'log.param'), 'a') as log:
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+        try:
+            log.write(entry)
+            log.flush()
+        finally:
+            fcntl.flock(log.fileno(), fcntl.LOCK_UN)
+
+
 def log_cosmo_arguments(data, command_line):
     """
     Write down the `cosmo_arguments` used to log.param
@@ -200,24 +256,64 @@ def print_vector(out, N, loglkl, data):
 
     """
 
+    # Format the line only once, from the array of the last accepted values of
+    # the varying and derived parameters
+    vector = data.parameter_store.output_vector()
+    line = None
     for j in range(len(out)):
-        out[j].write('%.4g  %.6g\t' % (N, -loglkl))
-        for elem in data.get_mcmc_parameters(['varying']):
-            out[j].write('%.6e\t' %
-                         data.mcmc_parameters[elem]['last_accepted'])
-        for elem in data.get_mcmc_parameters(['derived']):
-            out[j].write('%.6e\t' %
-                         data.mcmc_parameters[elem]['last_accepted'])
-        out[j].write('\n')
+        if isinstance(out[j], BinaryChain):
+            out[j].write_point(N, -loglkl, vector)
+        else:
+            if line is None:
+                line = format_point(N, -loglkl, vector)
+            out[j].write(line)
+
+
+def format_point(N, minus_loglkl, vector):
+    """Return the line of a text chain corresponding to a point"""
+    return '%.4g  %.6g\t' % (N, minus_loglkl) + ''.join(
+        '%.6e\t' % value for value in vector) + '\n'
+
+
+def write_profile(data):
+    """
+    Write the summary of the timings of the chain next to it
+
+    See :class:`data.Profiler`.
+
+    """
+    with open(os.path.splitext(data.out_name)[0]+'.profile', 'w') as profile:
+        profile.write(data.profiler.summary(data.cosmo_cache))
 
 
 def refresh_file(data):
     """
-    Closes and reopen the output file to write any buffered quantities
+    Force the buffered quantities of the output file to the disk
+
+    The file stays open, so that it keeps its lock (see
+    :func:`create_output_files`). Binary chains are written to the disk by
+    their own thread, and are left untouched.
+
+    """
+    if isinstance(data.out, BinaryChain):
+        return
+    data.out.flush()
+    os.fsync(data.out.fileno())
+
+
+def open_chain(path, data, binary=False):
+    """
+    Create a new chain file for the varying and derived parameters of `data`
+
+    Returns a file, or a :class:`BinaryChain` if `binary` is True.
 
     """
-    data.out.close()
-    data.out = open(data.out_name, 'a')
+    if not binary:
+        return open(path, 'w')
+    names = data.get_mcmc_parameters(['varying'])
+    names.extend(data.get_mcmc_parameters(['derived']))
+    return BinaryChain(
+        path, names, [data.mcmc_parameters[name]['scale'] for name in names])
 
 
 def create_output_files(command_line, data):
@@ -236,6 +332,40 @@ def create_output_files(command_line, data):
         changing things here.
 
     """
+    # When a checkpoint of the restart chain exists, the chain is resumed in
+    # place: it is truncated to its length at the time of the checkpoint, and
+    # the new points are appended to it (see :func:`mcmc.chain`)
+    if command_line.restart is not None and os.path.isfile(
+            checkpoint_path(command_line.restart)):
+        command_line.restart = get_resumed_chain(command_line.restart)
+        data.out_name = command_line.restart
+        if is_binary_chain(data.out_name):
+            names = data.get_mcmc_parameters(['varying'])
+            names.extend(data.get_mcmc_parameters(['derived']))
+            data.out = BinaryChain(
+                data.out_name, names,
+                [data.mcmc_parameters[name]['scale'] for name in names],
+                append=True)
+        else:
+            data.out = open(data.out_name, 'a')
+        # The chain is only truncated once locked, so that it cannot be
+        # modified while another run is still writing to it
+        try:
+            lock(data.out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except LockError:
+            data.out.close()
+            raise ConfigurationError(
+                "The chain %s is being written by another run, " % (
+                    data.out_name) + "and can not be resumed.")
+        os.ftruncate(data.out.fileno(),
+                     read_checkpoint(command_line.restart)['chain_size'])
+        print 'Resuming %s\n' % data.out_name
+        return
+
+    if data.chain_format == 'binary':
+        extension = '.bin'
+    else:
+        extension = '.txt'
     if command_line.restart is None:
         number = command_line.N
     else:
@@ -254,25 +384,43 @@ def create_output_files(command_line, data):
                     suffix = int(files.split('__')[-1].split('.')[0])
         suffix += 1
         while trying:
-            data.out = open(os.path.join(
-                command_line.folder, outname_base)+str(suffix)+'.txt', 'w')
+            data.out = open_chain(os.path.join(
+                command_line.folder, outname_base)+str(suffix)+extension,
+                data, data.chain_format == 'binary')
             try:
                 lock(data.out, fcntl.LOCK_EX | fcntl.LOCK_NB)
                 trying = False
             except LockError:
                 suffix += 1
         data.out_name = os.path.join(
-            command_line.folder, outname_base)+str(suffix)+'.txt'
+            command_line.folder, outname_base)+str(suffix)+extension
         print 'Creating %s\n' % data.out_name
     else:
         data.out_name = os.path.join(
-            command_line.folder, outname_base)+command_line.chain_number+'.txt'
-        data.out = open(data.out_name, 'w')
+            command_line.folder,
+            outname_base)+command_line.chain_number+extension
+        data.out = open_chain(
+            data.out_name, data, data.chain_format == 'binary')
         print 'Creating %s\n' % data.out_name
+        # An arbitrary chain number is used as the first chain
+        try:
+            suffix = int(command_line.chain_number)
+        except ValueError:
+            suffix = 1
+    # Seed the random number generator from the number of the chain, and
+    # store the seed at the top of the chain, to allow reproducing it
+    data.seed_chain(suffix)
+    data.out.write('# Random seed: %d\n' % data.seed)
+    log_random_seed(data, command_line)
     # in case of a restart, copying the whole thing in the new file
     if command_line.restart is not None:
-        for line in open(command_line.restart, 'r'):
-            data.out.write(line)
+        if (data.chain_format == 'binary' or
+                is_binary_chain(command_line.restart)):
+            for line in iterate_chain(command_line.restart):
+                write_chain_line(data.out, line)
+        else:
+            for line in open(command_line.restart, 'r'):
+                data.out.write(line)
 
 
 def get_tex_name(name, number=1):
@@ -350,6 +498,70 @@ def write_covariance_matrix(covariance_matrix, names, path):
                     cov.write('%.5e\t' % covariance_matrix[i][j])
             cov.write('\n')
 
+def start_fisher_points(path, fingerprint):
+    """
+    Create the file storing the points of the Fisher stencil
+
+    Its first line contains the fingerprint of the configuration that
+    computed the points, see :func:`read_fisher_points`. An existing file is
+    emptied.
+    """
+    with open(path, 'w') as points:
+        points.write('# %s\n' % fingerprint)
+
+
+def write_fisher_point(path, key, loglike):
+    """
+    Append the log-likelihood of a point of the Fisher stencil to a file
+
+    Several processes may write to the same file, so the file is locked while
+    writing the line. If the last line was left incomplete by an interrupted
+    run, the new one starts on the next line.
+    """
+    with open(path, 'a+') as points:
+        fcntl.flock(points.fileno(), fcntl.LOCK_EX)
+        try:
+            points.seek(0, os.SEEK_END)
+            complete = True
+            if points.tell():
+                points.seek(-1, os.SEEK_END)
+                complete = points.read(1) == '\n'
+                points.seek(0, os.SEEK_END)
+            if not complete:
+                points.write('\n')
+            points.write('%s\t%.10e\n' % (key, loglike))
+            points.flush()
+        finally:
+            fcntl.flock(points.fileno(), fcntl.LOCK_UN)
+
+
+def read_fisher_points(path, fingerprint):
+    """
+    Read the points written by :func:`write_fisher_point`
+
+    Returns a dictionary of the log-likelihoods, indexed by the keys of the
+    points. Incomplete lines, written when the run was interrupted, are
+    ignored: only the lines ending with a newline are complete. If the file
+    does not exist, or was started by :func:`start_fisher_points` with another
+    fingerprint, None is returned.
+    """
+    points = {}
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as points_file:
+        if points_file.readline().strip() != '# %s' % fingerprint:
+            return None
+        for line in points_file:
+            if not line.endswith('\n'):
+                continue
+            try:
+                key, loglike = line.split('\t')
+                points[key] = float(loglike)
+            except ValueError:
+                continue
+    return points
+
+
 def write_bestfit_file(bestfit, names, path):
     """
     Store the bestfit parameters to a file
@@ -449,6 +661,465 @@ class File(file):
         return line_list[-lines_2find:]
 
 
+# First line of the chains in binary format
+BINARY_CHAIN_MAGIC = 'MONTEPYTHON-BINARY-CHAIN-1\n'
+
+
+class BinaryChain(object):
+    """
+    Chain written in binary format by a background thread
+
+    The file starts with a header of two lines: :data:`BINARY_CHAIN_MAGIC`,
+    and a JSON dictionary describing the `columns` (multiplicity,
+    -log-likelihood and the parameter names) and the `scales` of the
+    parameters. It is followed by fixed-width records of little-endian
+    float64, one per point, with the same columns as the text chains, but
+    without loss of precision.
+
+    A comment is stored as a record starting with -1 (an impossible
+    multiplicity) and the length of the text, followed by as many records as
+    needed to hold the text.
+
+    The records are put in a bounded queue, and written by a thread, that
+    forces them to the disk every `sync_interval` seconds. Writing never
+    blocks the chain, unless the queue is full.
+
+    If writing fails, the thread keeps the error, and discards the following
+    records, so that the chain never waits for it. The error is raised in the
+    chain at the next call of :meth:`write`, :meth:`write_point`,
+    :meth:`flush` or :meth:`close`.
+
+    """
+
+    def __init__(self, path, names, scales, queue_length=1024,
+                 sync_interval=10., append=False):
+        self.name = path
+        self.width = len(names)+2
+        self.sync_interval = sync_interval
+        self.queue = Queue.Queue(queue_length)
+        # Error raised while writing, see _write_records
+        self.error = None
+        self.closed = False
+        # When appending to an existing chain, the header is already there
+        if append:
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            self.queue.put(BINARY_CHAIN_MAGIC + json.dumps({
+                'columns': ['multiplicity', '-loglkl'] + list(names),
+                'scales': list(scales)}) + '\n')
+        self.thread = threading.Thread(target=self._write_records)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, text):
+        """Write a comment"""
+        length = len(text)
+        record_size = 8*self.width
+        number = -(-length // record_size)
+        head = np.zeros(self.width, '<f8')
+        head[:2] = -1, length
+        self._put(head.tostring()+text.ljust(number*record_size, '\0'))
+
+    def write_point(self, N, minus_loglkl, vector):
+        """Write a point, with its multiplicity and -log-likelihood"""
+        record = np.empty(self.width, '<f8')
+        record[:2] = N, minus_loglkl
+        record[2:] = vector
+        self._put(record.tostring())
+
+    def flush(self):
+        """Wait until everything is written to the disk"""
+        self._put('flush')
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        """Write everything to the disk, stop the thread and close the file"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self._check_error()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __deepcopy__(self, memo):
+        """A copy of the data (see :func:`sampler.get_covariance_matrix`)
+        writes to the same chain"""
+        return self
+
+    def _put(self, item):
+        """Queue an item for the thread, unless writing already failed"""
+        self._check_error()
+        self.queue.put(item)
+
+    def _check_error(self):
+        """Raise in the chain the error met by the thread, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def _write_records(self):
+        """Loop of the background thread"""
+        last_sync = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.sync_interval)
+            except Queue.Empty:
+                item = ''
+            # After an error, the items are only taken out of the queue
+            if self.error is None:
+                try:
+                    if item is None or item == 'flush' or \
+                            time.time()-last_sync > self.sync_interval:
+                        self.file.flush()
+                        os.fsync(self.file.fileno())
+                        last_sync = time.time()
+                    if item and item != 'flush':
+                        self.file.write(item)
+                except Exception as error:
+                    self.error = error
+            if item is None:
+                self.queue.task_done()
+                break
+            if item:
+                self.queue.task_done()
+
+
+def is_binary_chain(path):
+    """Tell whether a chain is written in binary format"""
+    with open(path, 'rb') as chain:
+        return chain.read(len(BINARY_CHAIN_MAGIC)) == BINARY_CHAIN_MAGIC
+
+
+def read_binary_chain(path):
+    """
+    Read a chain written by :class:`BinaryChain`
+
+    An incomplete record at the end of the file, written when the run was
+    interrupted, is ignored.
+
+    Returns
+    -------
+    header : dict
+        The `columns` and `scales` of the chain
+    points : numpy array
+        One line per point, with the multiplicity, -log-likelihood and the
+        values of the parameters, as in the text chains
+    comments : list
+        The comments, as tuples of the number of points written before them,
+        and the text
+
+    """
+    with open(path, 'rb') as chain:
+        chain.readline()
+        header = json.loads(chain.readline())
+        content = chain.read()
+    width = len(header['columns'])
+    record_size = 8*width
+    content = content[:len(content)//record_size*record_size]
+    records = np.fromstring(content, '<f8').reshape(-1, width)
+
+    # The comments are found in order: the first record with a negative
+    # multiplicity starts a comment, whose text records are then skipped
+    is_point = np.ones(len(records), bool)
+    comments = []
+    for index in np.where(records[:, 0] < 0)[0]:
+        if not is_point[index]:
+            continue
+        length = int(records[index, 1])
+        number = -(-length // record_size)
+        text = content[(index+1)*record_size:(index+1+number)*record_size]
+        is_point[index:index+1+number] = False
+        if len(text) == number*record_size:
+            comments.append(
+                (np.count_nonzero(is_point[:index]), text[:length]))
+    return header, records[is_point], comments
+
+
+def iterate_chain(path):
+    """
+    Go through a chain, in text or binary format
+
+    Yields the comments as strings, and the points as numpy arrays containing
+    the multiplicity, -log-likelihood and the values of the parameters.
+
+    """
+    if is_binary_chain(path):
+        _, points, comments = read_binary_chain(path)
+        start = 0
+        for position, text in comments:
+            for point in points[start:position]:
+                yield point
+            yield text
+            start = position
+        for point in points[start:]:
+            yield point
+    else:
+        with open(path, 'r') as chain:
+            for line in chain:
+                if line[0] == '#':
+                    yield line
+                elif line.strip():
+                    yield np.array(line.split(), 'float64')
+
+
+def write_chain_line(out, line):
+    """Write a comment or a point returned by :func:`iterate_chain`"""
+    if isinstance(line, str):
+        out.write(line)
+    elif isinstance(out, BinaryChain):
+        out.write_point(line[0], line[1], line[2:])
+    else:
+        out.write(format_point(line[0], line[1], line[2:]))
+
+
+class EvaluationStore(object):
+    """
+    Append-only binary file storing the results of the cosmological module
+
+    When asked with the flag `--store-evaluations`, the Metropolis-Hastings
+    run writes, for every computed cosmology, the derived parameters (and
+    optionally the spectra) to this file in the output folder. The
+    post-processing methods (:mod:`importance_sampling`, :mod:`add_derived`)
+    then look up the points of the chains there before calling the
+    cosmological module.
+
+    Each record is written in one go, while holding a lock on the file, so
+    that several chains can share it. It is made of a header, containing the
+    length of the key and of the data, the key itself, and the pickled
+    data. When reading, an index of the position of every key in the file is
+    built by skipping over the data.
+
+    """
+    name = 'evaluations.bin'
+    header = struct.Struct('<II')
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, self.name)
+        self.index = {}
+        # Position up to which the file was indexed
+        self.indexed = 0
+
+    @staticmethod
+    def key(names, values):
+        """
+        Return the key corresponding to the values of the given parameters
+
+        The values are written with the precision used in the chains, so that
+        a point read from a chain has the same key as when it was computed.
+
+        """
+        return ','.join(['%s=%.6e' % (name, value)
+                         for name, value in zip(names, values)])
+
+    def add(self, key, record):
+        """Append a record (dictionary) corresponding to `key`"""
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with open(self.path, 'ab') as store:
+            fcntl.flock(store.fileno(), fcntl.LOCK_EX)
+            try:
+                store.write(self.header.pack(len(key), len(data))+key+data)
+                store.flush()
+            finally:
+                fcntl.flock(store.fileno(), fcntl.LOCK_UN)
+
+    def get(self, key):
+        """Return the record corresponding to `key`, or None"""
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as store:
+            if key not in self.index:
+                self.update_index(store)
+            if key not in self.index:
+                return None
+            position, length = self.index[key]
+            store.seek(position)
+            return pickle.loads(store.read(length))
+
+    def update_index(self, store):
+        """Index the records written since the last call"""
+        store.seek(self.indexed)
+        while True:
+            header = store.read(self.header.size)
+            # Stop at the end of the file, or at a record being written
+            if len(header) < self.header.size:
+                break
+            key_length, length = self.header.unpack(header)
+            key = store.read(key_length)
+            position = store.tell()
+            store.seek(length, 1)
+            if len(key) < key_length or store.tell() > os.fstat(
+                    store.fileno()).st_size:
+                break
+            self.index[key] = (position, length)
+            self.indexed = store.tell()
+
+
+def get_resumed_chain(restart):
+    """
+    Return the chain resumed by the current process from its checkpoint
+
+    When running with MPI, all the processes are given the chain `restart` of
+    the process of rank 0. The process of rank r resumes instead the chain
+    whose number is the one of `restart` incremented by r, which it wrote
+    with the same run, so that every chain is resumed by one process only.
+
+    """
+    try:
+        from mpi4py import MPI
+        rank = MPI.COMM_WORLD.Get_rank()
+    except ImportError:
+        rank = 0
+    if not rank:
+        return restart
+    match = re.match(r'(.*__)(\d+)(\.(?:txt|bin))$', restart)
+    if match is None:
+        raise ConfigurationError(
+            "The number of the chain %s could not be found, " % restart +
+            "it can not be resumed with MPI.")
+    chain = match.group(1)+str(int(match.group(2))+rank)+match.group(3)
+    if not os.path.isfile(checkpoint_path(chain)):
+        raise ConfigurationError(
+            "The process of rank %d should resume the chain %s, " % (
+                rank, chain) +
+            "which has no checkpoint. Please run with as many processes "
+            "as when the chains were started.")
+    return chain
+
+
+def checkpoint_path(chain_name):
+    """Return the path of the checkpoint of a chain"""
+    return os.path.splitext(chain_name)[0]+'.checkpoint'
+
+
+def write_checkpoint(chain_name, state, comm=None):
+    """
+    Write the state of a chain (dictionary) to its checkpoint
+
+    The file is first written under a temporary name, then renamed, so that
+    an interruption never leaves a corrupted checkpoint. If `comm` is given,
+    all the processes write their checkpoint at the same time, and only
+    rename it once all of them are written, so that the checkpoints of the
+    chains almost always correspond to the same step.
+    """
+    path = checkpoint_path(chain_name)
+    with open(path+'.tmp', 'wb') as checkpoint:
+        pickle.dump(state, checkpoint, pickle.HIGHEST_PROTOCOL)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    if comm is not None:
+        comm.barrier()
+    os.rename(path+'.tmp', path)
+
+
+def read_checkpoint(chain_name):
+    """Read the state of a chain written by :func:`write_checkpoint`"""
+    with open(checkpoint_path(chain_name), 'rb') as checkpoint:
+        return pickle.load(checkpoint)
+
+
+def statistics_path(chain_name):
+    """Return the path of the running statistics of a chain"""
+    return os.path.splitext(chain_name)[0]+'.statistics'
+
+
+def write_statistics(chain_name, statistics):
+    """
+    Write the running statistics of a chain next to it
+
+    They are read by the other chains of the same folder, when running
+    without MPI, see :func:`read_statistics`, as long as the chain holds the
+    lock of :func:`lock_statistics`. As for
+    :func:`write_checkpoint`, the file is written under a temporary name,
+    then renamed.
+    """
+    path = statistics_path(chain_name)
+    with open(path+'.tmp', 'wb') as output:
+        pickle.dump(statistics.get_state(), output, pickle.HIGHEST_PROTOCOL)
+    os.rename(path+'.tmp', path)
+
+
+def lock_statistics(chain_name):
+    """
+    Mark the running statistics of a chain as those of a live run
+
+    A lock file is written next to the statistics, and locked until the
+    returned file is closed by :func:`remove_statistics`, or until the process
+    ends, even when it is killed.
+    """
+    handle = open(statistics_path(chain_name)+'.lock', 'w')
+    lock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return handle
+
+
+def remove_statistics(chain_name, handle=None):
+    """
+    Remove the running statistics of a chain and their lock file
+
+    The lock, returned by :func:`lock_statistics`, is released afterwards.
+    """
+    path = statistics_path(chain_name)
+    for name in (path, path+'.lock'):
+        if os.path.isfile(name):
+            os.remove(name)
+    if handle is not None:
+        handle.close()
+
+
+def _is_locked(path):
+    """Check whether the lock file at `path` is held by a live chain"""
+    try:
+        handle = open(path, 'r')
+    except IOError:
+        return False
+    with handle:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except IOError:
+            return True
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def read_statistics(folder, chain_name):
+    """
+    Read the running statistics of the other chains of the folder
+
+    Only the chains still running, holding the lock of
+    :func:`lock_statistics`, are considered: the statistics left by finished
+    or interrupted runs are ignored.
+
+    Returns
+    -------
+    states : list
+        Output of :meth:`statistics_mp.WeightedStatistics.get_state` for
+        every chain of `folder` but `chain_name`
+
+    """
+    own = os.path.basename(statistics_path(chain_name))
+    states = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.statistics') and name != own:
+            if not _is_locked(os.path.join(folder, name+'.lock')):
+                continue
+            try:
+                with open(os.path.join(folder, name), 'rb') as statistics:
+                    states.append(pickle.load(statistics))
+            except (IOError, EOFError, pickle.UnpicklingError):
+                pass
+    return states
+
+
 class LockError(Exception):
     """
     .. warning::
@@ -506,7 +1177,7 @@ class MyError(Exception):
     """
     def __init__(self, message):
         """Reformat the name of the class for easier reading"""
-        Exception.__init__(self)
+        Exception.__init__(self, message)
         self.message = message
         name = self.__class__.__name__
         self.name = ''
@@ -546,6 +1217,14 @@ class LikelihoodError(MyError):
     pass
 
 
+class OutOfGridError(LikelihoodError):
+    """
+    The power spectrum is needed outside of the grid computed for the current
+    cosmology. The point is rejected, see :func:`sampler.compute_likelihood`.
+    """
+    pass
+
+
 class FiducialModelWritten(MyError):
     """Used to exit the code in case of writing a fiducial file"""
     pass
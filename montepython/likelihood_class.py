@@ -15,6 +15,7 @@ import math
 import warnings
 import re
 import scipy.constants as const
+import scipy.sparse as sparse
 
 import io_mp
 
@@ -23,8 +24,17 @@ class Likelihood(object):
     """
     General class that all likelihoods will inherit from.
 
+    A likelihood whose :meth:`loglkl` only modifies its own attributes, and
+    only reads the cosmological module and `data`, can set the class
+    attribute :attr:`thread_safe` to True: with the `--likelihood-threads`
+    option, :func:`sampler.compute_lkl` then computes it concurrently with
+    the other likelihoods. It can also be set in the parameter file, with
+    `name.thread_safe = True`.
+
     """
 
+    thread_safe = False
+
     def __init__(self, path, data, command_line):
         """
         It copies the content of self.path from the initialization routine of
@@ -67,6 +77,9 @@ class Likelihood(object):
         # Default state
         self.need_update = True
 
+        # Spectra shared with the other likelihoods, see get_cl
+        self.cl_cache = data.cl_cache
+
         # Check if the nuisance parameters are defined
         error_flag = False
         try:
@@ -181,38 +194,22 @@ class Likelihood(object):
         Return the :math:`C_{\ell}` from the cosmological code in
         :math:`\mu {\\rm K}^2`
 
-        """
-        # get C_l^XX from the cosmological code
-        cl = cosmo.lensed_cl(l_max)
-
-        # convert dimensionless C_l's to C_l in muK**2
-        T = cosmo.T_cmb()
-        for key in cl.iterkeys():
-            # All quantities need to be multiplied by this factor, except the
-            # phi-phi term, that is already dimensionless
-            if key not in ['pp', 'ell']:
-                cl[key] *= (T*1.e6)**2
+        The arrays are read-only, as they are shared with the other
+        likelihoods (see :class:`data.ClCache`).
 
-        return cl
+        """
+        return self.cl_cache.get(cosmo, 'lensed_cl', l_max)
 
     def get_unlensed_cl(self, cosmo, l_max=-1):
         """
-        Return the :math:`C_{\ell}` from the cosmological code in
+        Return the unlensed :math:`C_{\ell}` from the cosmological code in
         :math:`\mu {\\rm K}^2`
 
-        """
-        # get C_l^XX from the cosmological code
-        cl = cosmo.raw_cl(l_max)
+        The arrays are read-only, as they are shared with the other
+        likelihoods (see :class:`data.ClCache`).
 
-        # convert dimensionless C_l's to C_l in muK**2
-        T = cosmo.T_cmb()
-        for key in cl.iterkeys():
-            # All quantities need to be multiplied by this factor, except the
-            # phi-phi term, that is already dimensionless
-            if key not in ['pp', 'ell']:
-                cl[key] *= (T*1.e6)**2
-
-        return cl
+        """
+        return self.cl_cache.get(cosmo, 'raw_cl', l_max)
 
     def need_cosmo_arguments(self, data, dictionary):
         """
@@ -318,6 +315,11 @@ class Likelihood(object):
 
     def add_contamination_spectra(self, cl, data):
 
+        # The spectra shared with the other likelihoods are not modified
+        if self.use_nuisance:
+            cl = dict(cl)
+            cl['tt'] = cl['tt'].copy()
+
         # Recover the current value of the nuisance parameter.
         for nuisance in self.use_nuisance:
             nuisance_value = float(
@@ -325,8 +327,9 @@ class Likelihood(object):
                 data.mcmc_parameters[nuisance]['scale'])
 
             # add contamination spectra multiplied by nuisance parameters
-            for l in range(2, self.l_max):
-                exec "cl['tt'][l] += nuisance_value*self.%s_contamination[l]" % nuisance
+            contamination = getattr(self, '%s_contamination' % nuisance)
+            cl['tt'][2:self.l_max] += \
+                nuisance_value*contamination[2:self.l_max]
 
         return cl
 
@@ -391,6 +394,8 @@ class Likelihood_prior(Likelihood):
 ###################################
 class Likelihood_newdat(Likelihood):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         Likelihood.__init__(self, path, data, command_line)
@@ -629,6 +634,19 @@ class Likelihood_newdat(Likelihood):
                         for i in range(1, len(line.split()))]
                     self.window[point, l, :] *= l
 
+        # the bandpowers B = sum_l (l+1/2)/2pi W_l C_l are linear in the
+        # spectra: store once and for all the window functions, multiplied by
+        # (l+1/2)/2pi, in a sparse matrix projecting the spectra TT (TE EE BB),
+        # stacked in a single vector, on the bandpowers
+        self.spectra = ['tt', 'te', 'ee', 'bb'][:num_col-1]
+        l = np.arange(self.window.shape[1])
+        projection = self.window*((l+0.5)/2./math.pi)[:, None]
+        for point in range(self.num_points):
+            projection[point, :self.win_min[point]] = 0.
+            projection[point, self.win_max[point]:] = 0.
+        self.projection = sparse.csr_matrix(
+            projection.transpose(0, 2, 1).reshape(self.num_points, -1))
+
         # eventually, initialise quantitites used in the marginalization over
         # nuisance parameters
         if ((self.has_xfactors) and
@@ -640,6 +658,15 @@ class Likelihood_newdat(Likelihood):
                 self.margeweights[i+self.halfsteps] = np.exp(
                     -(float(i)*3./float(self.halfsteps))**2/2)
             self.margenorm = sum(self.margeweights)
+            # relative errors of the grid of calibrations and beams
+            self.calib_errors = 1.+self.calib_uncertainty*np.arange(
+                -self.halfsteps, self.halfsteps+1)*3/float(self.halfsteps)
+            if self.has_beam_uncertainty:
+                self.beam_errors = 1.+np.outer(
+                    np.arange(-self.halfsteps, self.halfsteps+1) *
+                    3/float(self.halfsteps), self.beam_error)
+            else:
+                self.beam_errors = np.ones((1, self.num_points), 'float64')
 
         # store maximum value of l needed by window functions
         self.l_max = max(self.win_max)
@@ -684,27 +711,10 @@ class Likelihood_newdat(Likelihood):
                 "%d " % (np.shape(cl['tt'])[0]-1) +
                 "while window functions need %d." % self.l_max)
 
-        # compute theoretical bandpowers, store them in theo[points]
-        theo = np.zeros(self.num_points, 'float64')
-
-        for point in range(self.num_points):
-
-            # find bandpowers B_l by convolving C_l's with [(l+1/2)/2pi W_l]
-            for l in range(self.win_min[point], self.win_max[point]):
-
-                theo[point] += cl['tt'][l]*self.window[point, l, 0] *\
-                    (l+0.5)/2./math.pi
-
-                if (self.has_pol):
-                    theo[point] += (
-                        cl['te'][l]*self.window[point, l, 1] +
-                        cl['ee'][l]*self.window[point, l, 2] +
-                        cl['bb'][l]*self.window[point, l, 3]) *\
-                        (l+0.5)/2./math.pi
-
-        # allocate array for differencve between observed and theoretical
-        # bandpowers
-        difference = np.zeros(self.num_points, 'float64')
+        # compute theoretical bandpowers, store them in theo[points], by
+        # convolving C_l's with [(l+1/2)/2pi W_l]
+        theo = self.projection.dot(np.concatenate(
+            [cl[name][:self.l_max+1] for name in self.spectra]))
 
         # depending on the presence of lognormal likelihood, calibration
         # uncertainty and beam uncertainity, use several methods for
@@ -715,71 +725,28 @@ class Likelihood_newdat(Likelihood):
                 ((self.calib_uncertainty > 1.e-4) or
                  self.has_beam_uncertainty)):
 
-            chisq_tmp = np.zeros(2*self.halfsteps+1, 'float64')
-            chisqcalib = np.zeros(2*self.halfsteps+1, 'float64')
-            beam_error = np.zeros(self.num_points, 'float64')
+            # theoretical points corrected for all the beam and calibration
+            # errors of the grid, indexed by (beam, calibration, point)
+            corrected = theo*self.beam_errors[:, None, :] *\
+                self.calib_errors[:, None]
 
-            # loop over various beam errors
-            for ibeam in range(2*self.halfsteps+1):
+            # compute difference between observed and theoretical points,
+            # using B_l, or log(B_l+X_l) for lognormal likelihood
+            difference = self.obs-corrected
+            lognormal = self.has_xfactor
+            difference[..., lognormal] = self.obs[lognormal]-np.log(
+                corrected[..., lognormal]+self.xfactor[lognormal])
 
-                # beam error
-                for point in range(self.num_points):
-                    if (self.has_beam_uncertainty):
-                        beam_error[point] = 1.+self.beam_error[point] *\
-                            (ibeam-self.halfsteps)*3/float(self.halfsteps)
-                    else:
-                        beam_error[point] = 1.
-
-                # loop over various calibraion errors
-                for icalib in range(2*self.halfsteps+1):
-
-                    # calibration error
-                    calib_error = 1+self.calib_uncertainty*(
-                        icalib-self.halfsteps)*3/float(self.halfsteps)
-
-                    # compute difference between observed and theoretical
-                    # points, after correcting the later for errors
-                    for point in range(self.num_points):
-
-                        # for lognormal likelihood, use log(B_l+X_l)
-                        if (self.has_xfactor[point]):
-                            difference[point] = self.obs[point] -\
-                                math.log(
-                                    theo[point]*beam_error[point] *
-                                    calib_error+self.xfactor[point])
-                        # otherwise use B_l
-                        else:
-                            difference[point] = self.obs[point] -\
-                                theo[point]*beam_error[point]*calib_error
-
-                    # find chisq with those corrections
-                    # chisq_tmp[icalib] = np.dot(np.transpose(difference),
-                    # np.dot(self.inv_covmat, difference))
-                    chisq_tmp[icalib] = np.dot(
-                        difference, np.dot(self.inv_covmat, difference))
-
-                minchisq = min(chisq_tmp)
+            # find chisq with those corrections
+            chisq_tmp = np.einsum(
+                'bcp,bcp->bc', np.dot(difference, self.inv_covmat), difference)
 
             # find chisq marginalized over calibration uncertainty (if any)
-                tot = 0
-                for icalib in range(2*self.halfsteps+1):
-                    tot += self.margeweights[icalib]*math.exp(
-                        max(-30., -(chisq_tmp[icalib]-minchisq)/2.))
-
-                chisqcalib[ibeam] = -2*math.log(tot/self.margenorm)+minchisq
+            chisqcalib = self.marginalise(chisq_tmp)
 
             # find chisq marginalized over beam uncertainty (if any)
             if (self.has_beam_uncertainty):
-
-                minchisq = min(chisqcalib)
-
-                tot = 0
-                for ibeam in range(2*self.halfsteps+1):
-                    tot += self.margeweights[ibeam]*math.exp(
-                        max(-30., -(chisqcalib[ibeam]-minchisq)/2.))
-
-                chisq = -2*math.log(tot/self.margenorm)+minchisq
-
+                chisq = self.marginalise(chisqcalib)
             else:
                 chisq = chisqcalib[0]
 
@@ -838,6 +805,20 @@ class Likelihood_newdat(Likelihood):
         self.lkl = -0.5 * chisq
         return self.lkl
 
+    def marginalise(self, chisq):
+        """
+        Marginalise the chi square over the last axis of the grid of errors
+
+        The weights :attr:`margeweights` of the grid are summed with the
+        likelihoods relative to the best point of the grid, floored to
+        exp(-30).
+
+        """
+        minchisq = chisq.min(axis=-1)
+        tot = np.dot(np.exp(np.maximum(
+            -30., -(chisq-minchisq[..., None])/2.)), self.margeweights)
+        return -2*np.log(tot/self.margenorm)+minchisq
+
 
 ###################################
 # CLIK TYPE LIKELIHOOD
@@ -845,6 +826,9 @@ class Likelihood_newdat(Likelihood):
 ###################################
 class Likelihood_clik(Likelihood):
 
+    # The clik library keeps a global state for its error handling
+    thread_safe = False
+
     def __init__(self, path, data, command_line):
 
         Likelihood.__init__(self, path, data, command_line)
@@ -933,106 +917,50 @@ class Likelihood_clik(Likelihood):
             if hasattr(self, '%s_prior_center' % nuisance):
                 self.use_nuisance.append(nuisance)
 
-    def loglkl(self, cosmo, data):
+        # layout of the vector passed to clik: each spectrum up to its l_max,
+        # in the order of clik, then the nuisance parameters. It is found once
+        # and for all, loglkl filling a preallocated vector
+        if self.lensing:
+            names = ['pp', 'tt', 'ee', 'bb', 'te', 'tb', 'eb']
+        else:
+            names = ['tt', 'ee', 'bb', 'te', 'tb', 'eb']
+        try:
+            l_maxs = list(self.clik.get_lmax())
+            lengths = [l_max+1 for l_max in l_maxs]
+        # following lines for compatibility with lensing likelihoods of 2013
+        # and before (then, clik.get_lmax() just returns an integer for
+        # lensing likelihoods, and the vector holds cl['pp'], cl['tt'], their
+        # last multipole being left to zero)
+        except TypeError:
+            l_maxs = [self.l_max, self.l_max]
+            lengths = [self.l_max, self.l_max]
+        # list of (name, first index, length) of the spectra in the vector
+        self.cl_layout = []
+        index = 0
+        for name, l_max, length in zip(names, l_maxs, lengths):
+            if l_max > -1:
+                # class does not compute tb nor eb, left to zero
+                if name not in ['tb', 'eb']:
+                    self.cl_layout.append((name, index, length))
+                index += l_max+1
+        self.nuisance_index = index
+        self.vector = np.zeros(index+len(self.nuisance), 'float64')
 
-        nuisance_parameter_names = data.get_mcmc_parameters(['nuisance'])
+    def loglkl(self, cosmo, data):
 
         # get Cl's from the cosmological code
         cl = self.get_cl(cosmo)
 
-        # testing for lensing
-        if self.lensing:
-            try:
-                length = len(self.clik.get_lmax())
-                tot = np.zeros(
-                    np.sum(self.clik.get_lmax()) + length +
-                    len(self.clik.get_extra_parameter_names()))
-            # following 3 lines for compatibility with lensing likelihoods of 2013 and before
-            # (then, clik.get_lmax() just returns an integer for lensing likelihoods,
-            # and the length is always 2 for cl['pp'], cl['tt'])
-            except:
-                length = 2
-                tot = np.zeros(2*self.l_max+length + len(self.clik.get_extra_parameter_names()))
-        else:
-            length = len(self.clik.get_has_cl())
-            tot = np.zeros(
-                np.sum(self.clik.get_lmax()) + length +
-                len(self.clik.get_extra_parameter_names()))
-
         # fill with Cl's
-        index = 0
-        if not self.lensing:
-            for i in range(length):
-                if (self.clik.get_lmax()[i] > -1):
-                    for j in range(self.clik.get_lmax()[i]+1):
-                        if (i == 0):
-                            tot[index+j] = cl['tt'][j]
-                        if (i == 1):
-                            tot[index+j] = cl['ee'][j]
-                        if (i == 2):
-                            tot[index+j] = cl['bb'][j]
-                        if (i == 3):
-                            tot[index+j] = cl['te'][j]
-                        if (i == 4):
-                            tot[index+j] = 0 #cl['tb'][j] class does not compute tb
-                        if (i == 5):
-                            tot[index+j] = 0 #cl['eb'][j] class does not compute eb
-
-                    index += self.clik.get_lmax()[i]+1
-
-        else:
-            try:
-                for i in range(length):
-                    if (self.clik.get_lmax()[i] > -1):
-                        for j in range(self.clik.get_lmax()[i]+1):
-                            if (i == 0):
-                                tot[index+j] = cl['pp'][j]
-                            if (i == 1):
-                                tot[index+j] = cl['tt'][j]
-                            if (i == 2):
-                                tot[index+j] = cl['ee'][j]
-                            if (i == 3):
-                                tot[index+j] = cl['bb'][j]
-                            if (i == 4):
-                                tot[index+j] = cl['te'][j]
-                            if (i == 5):
-                                tot[index+j] = 0 #cl['tb'][j] class does not compute tb
-                            if (i == 6):
-                                tot[index+j] = 0 #cl['eb'][j] class does not compute eb
-
-                        index += self.clik.get_lmax()[i]+1
-
-            # following 8 lines for compatibility with lensing likelihoods of 2013 and before
-            # (then, clik.get_lmax() just returns an integer for lensing likelihoods,
-            # and the length is always 2 for cl['pp'], cl['tt'])
-            except:
-                for i in range(length):
-                    for j in range(self.l_max):
-                        if (i == 0):
-                            tot[index+j] = cl['pp'][j]
-                        if (i == 1):
-                            tot[index+j] = cl['tt'][j]
-                    index += self.l_max+1
+        tot = self.vector
+        for name, index, length in self.cl_layout:
+            tot[index:index+length] = cl[name][:length]
 
         # fill with nuisance parameters
-        for nuisance in self.clik.get_extra_parameter_names():
-
-            # line added to deal with a bug in planck likelihood release: A_planck called A_Planck in plik_lite
-            if (self.name == 'Planck_highl_lite'):
-                if nuisance == 'A_Planck':
-                    nuisance = 'A_planck'
-
-            if nuisance in nuisance_parameter_names:
-                nuisance_value = data.mcmc_parameters[nuisance]['current'] *\
-                    data.mcmc_parameters[nuisance]['scale']
-            else:
-                raise io_mp.LikelihoodError(
-                    "the likelihood needs a parameter %s. " % nuisance +
-                    "You must pass it through the input file " +
-                    "(as a free nuisance parameter or a fixed parameter)")
-            #print "found one nuisance with name",nuisance
-            tot[index] = nuisance_value
-            index += 1
+        tot[self.nuisance_index:] = [
+            data.mcmc_parameters[nuisance]['current'] *
+            data.mcmc_parameters[nuisance]['scale']
+            for nuisance in self.nuisance]
 
         # compute likelihood
         #print "lkl:",self.clik(tot)
@@ -1050,6 +978,8 @@ class Likelihood_clik(Likelihood):
 ###################################
 class Likelihood_mock_cmb(Likelihood):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         Likelihood.__init__(self, path, data, command_line)
@@ -1070,18 +1000,14 @@ class Likelihood_mock_cmb(Likelihood):
         self.noise_T = np.zeros(self.l_max+1, 'float64')
         self.noise_P = np.zeros(self.l_max+1, 'float64')
 
-        for l in range(self.l_min, self.l_max+1):
-            self.noise_T[l] = 0
-            self.noise_P[l] = 0
-            for channel in range(self.num_channels):
-                self.noise_T[l] += self.sigma_T[channel]**-2 *\
-                    math.exp(
-                        -l*(l+1)*self.theta_fwhm[channel]**2/8/math.log(2))
-                self.noise_P[l] += self.sigma_P[channel]**-2 *\
-                    math.exp(
-                        -l*(l+1)*self.theta_fwhm[channel]**2/8/math.log(2))
-            self.noise_T[l] = 1/self.noise_T[l]
-            self.noise_P[l] = 1/self.noise_P[l]
+        # (inverse of the sum over channels of the inverse noise spectra)
+        l = np.arange(self.l_min, self.l_max+1)
+        beam = np.exp(-np.outer(
+            l*(l+1), self.theta_fwhm[:self.num_channels]**2)/8/math.log(2))
+        self.noise_T[l] = 1/np.dot(
+            beam, self.sigma_T[:self.num_channels]**-2)
+        self.noise_P[l] = 1/np.dot(
+            beam, self.sigma_P[:self.num_channels]**-2)
 
         # impose that the cosmological code computes Cl's up to maximum l
         # needed by the window function
@@ -1273,8 +1199,7 @@ class Likelihood_mock_cmb(Likelihood):
             # (this case is usually not useful/relevant)
             if self.Bmodes and (not self.delensing):
                     cl_lensed = self.get_cl(cosmo)
-                    for l in range(self.lmax+1):
-                        cl[l]['bb']=cl_lensed[l]['bb']
+                    cl['bb'] = cl_lensed['bb']
 
         # if we want lensed Cl's
         else:
@@ -1282,8 +1207,7 @@ class Likelihood_mock_cmb(Likelihood):
             # exception: for delensed B modes we need the unlensed spectrum
             if self.Bmodes and self.delensing:
                 cl_unlensed = self.get_unlensed_cl(cosmo)
-                for l in range(self.lmax+1):
-                        cl[l]['bb']=cl_unlensed[l]['bb']
+                cl['bb'] = cl_unlensed['bb']
 
         # get likelihood
         lkl = self.compute_lkl(cl, cosmo, data)
@@ -1328,7 +1252,8 @@ class Likelihood_mock_cmb(Likelihood):
 
         # compute likelihood
 
-        chi2 = 0
+        if self.Bmodes and self.LensingExtraction:
+            raise io_mp.LikelihoodError("We have implemented a version of the liklihood with B modes, a version with lensing extraction, but not yet a version with both at the same time. You can implement it.")
 
         # cound number of modes.
         # number of modes is different form number of spectra
@@ -1343,86 +1268,78 @@ class Likelihood_mock_cmb(Likelihood):
         if self.LensingExtraction:
             num_modes += 1
 
-        Cov_obs = np.zeros((num_modes, num_modes), 'float64')
-        Cov_the = np.zeros((num_modes, num_modes), 'float64')
-        Cov_mix = np.zeros((num_modes, num_modes), 'float64')
-
-        for l in range(self.l_min, self.l_max+1):
-
-            if self.Bmodes and self.LensingExtraction:
-                raise io_mp.LikelihoodError("We have implemented a version of the liklihood with B modes, a version with lensing extraction, but not yet a version with both at the same time. You can implement it.")
-
-            # case with B modes:
-            elif self.Bmodes:
-                Cov_obs = np.array([
-                    [self.Cl_fid[0, l], self.Cl_fid[2, l], 0],
-                    [self.Cl_fid[2, l], self.Cl_fid[1, l], 0],
-                    [0, 0, self.Cl_fid[3, l]]])
-                # next 5 lines added by S. Clesse for delensing
-                if self.delensing:
-                    Cov_the = np.array([
-                        [cl['tt'][l]+self.noise_T[l], cl['te'][l], 0],
-                        [cl['te'][l], cl['ee'][l]+self.noise_P[l], 0],
-                        [0, 0, cl['bb'][l]+self.noise_P[l]+self.noise_delensing[l]]])
-                else:
-                    Cov_the = np.array([
-                        [cl['tt'][l]+self.noise_T[l], cl['te'][l], 0],
-                        [cl['te'][l], cl['ee'][l]+self.noise_P[l], 0],
-                        [0, 0, cl['bb'][l]+self.noise_P[l]]])
-
-            # case with lensing
-            # note that the likelihood is base on ClDD (deflection spectrum)
-            # rather than Clpp (lensing potential spectrum)
-            # But the Bolztmann code input is Clpp
-            # So we make the conversion using ClDD = l*(l+1.)*Clpp
-            # So we make the conversion using ClTD = sqrt(l*(l+1.))*Cltp
-            elif self.LensingExtraction:
-
-                cldd_fid = self.Cl_fid[self.index_pp, l]
-                cldd = l*(l+1.)*cl['pp'][l]
-                if self.neglect_TD:
-                    cltd_fid = 0.
-                    cltd = 0.
-                else:
-                    cltd_fid = self.Cl_fid[self.index_tp, l]
-                    cltd = math.sqrt(l*(l+1.))*cl['tp'][l]
-
-                Cov_obs = np.array([
-                    [self.Cl_fid[0, l], self.Cl_fid[2, l], 0.*self.Cl_fid[self.index_tp, l]],
-                    [self.Cl_fid[2, l], self.Cl_fid[1, l], 0],
-                    [cltd_fid, 0, cldd_fid]])
-                Cov_the = np.array([
-                    [cl['tt'][l]+self.noise_T[l], cl['te'][l], 0.*math.sqrt(l*(l+1.))*cl['tp'][l]],
-                    [cl['te'][l], cl['ee'][l]+self.noise_P[l], 0],
-                    [cltd, 0, cldd+self.Nldd[l]]])
-
-            # case without B modes nor lensing:
-            else:
-                Cov_obs = np.array([
-                    [self.Cl_fid[0, l], self.Cl_fid[2, l]],
-                    [self.Cl_fid[2, l], self.Cl_fid[1, l]]])
-                Cov_the = np.array([
-                    [cl['tt'][l]+self.noise_T[l], cl['te'][l]],
-                    [cl['te'][l], cl['ee'][l]+self.noise_P[l]]])
-
-            # get determinant of observational and theoretical covariance matrices
-            det_obs = np.linalg.det(Cov_obs)
-            det_the = np.linalg.det(Cov_the)
-
-            # get determinant of mixed matrix (= sum of N theoretical
-            # matrices with, in each of them, the nth column replaced
-            # by that of the observational matrix)
-            det_mix = 0.
-            for i in range(num_modes):
-                Cov_mix = np.copy(Cov_the)
-                Cov_mix[:, i] = Cov_obs[:, i]
-                det_mix += np.linalg.det(Cov_mix)
-
-            chi2 += (2.*l+1.)*self.f_sky *\
-                (det_mix/det_the + math.log(det_the/det_obs) - num_modes)
+        # observational and theoretical covariance matrices of all the
+        # multipoles, stacked along the first axis
+        l = np.arange(self.l_min, self.l_max+1)
+        fid = self.Cl_fid[:, l]
+        cl = dict((key, value[self.l_min:self.l_max+1])
+                  for key, value in cl.iteritems())
+        Cov_obs = np.zeros((len(l), num_modes, num_modes), 'float64')
+        Cov_the = np.zeros((len(l), num_modes, num_modes), 'float64')
+
+        Cov_obs[:, 0, 0] = fid[0]
+        Cov_obs[:, 0, 1] = Cov_obs[:, 1, 0] = fid[2]
+        Cov_obs[:, 1, 1] = fid[1]
+        Cov_the[:, 0, 0] = cl['tt']+self.noise_T[l]
+        Cov_the[:, 0, 1] = Cov_the[:, 1, 0] = cl['te']
+        Cov_the[:, 1, 1] = cl['ee']+self.noise_P[l]
+
+        # case with B modes:
+        if self.Bmodes:
+            Cov_obs[:, 2, 2] = fid[3]
+            Cov_the[:, 2, 2] = cl['bb']+self.noise_P[l]
+            # next 2 lines added by S. Clesse for delensing
+            if self.delensing:
+                Cov_the[:, 2, 2] += self.noise_delensing[l]
+
+        # case with lensing
+        # note that the likelihood is base on ClDD (deflection spectrum)
+        # rather than Clpp (lensing potential spectrum)
+        # But the Bolztmann code input is Clpp
+        # So we make the conversion using ClDD = l*(l+1.)*Clpp
+        # So we make the conversion using ClTD = sqrt(l*(l+1.))*Cltp
+        elif self.LensingExtraction:
+            Cov_obs[:, 2, 2] = fid[self.index_pp]
+            Cov_the[:, 2, 2] = l*(l+1.)*cl['pp']+self.Nldd[l]
+            # the TD correlation only enters the last line
+            if not self.neglect_TD:
+                Cov_obs[:, 2, 0] = fid[self.index_tp]
+                Cov_the[:, 2, 0] = np.sqrt(l*(l+1.))*cl['tp']
+
+        # get determinant of observational and theoretical covariance matrices
+        det_obs = self.determinants(Cov_obs)
+        det_the = self.determinants(Cov_the)
+
+        # get determinant of mixed matrix (= sum of N theoretical
+        # matrices with, in each of them, the nth column replaced
+        # by that of the observational matrix)
+        det_mix = 0.
+        for i in range(num_modes):
+            Cov_mix = np.copy(Cov_the)
+            Cov_mix[:, :, i] = Cov_obs[:, :, i]
+            det_mix += self.determinants(Cov_mix)
+
+        chi2 = np.sum((2.*l+1.)*self.f_sky *
+                      (det_mix/det_the + np.log(det_the/det_obs) - num_modes))
 
         return -chi2/2
 
+    @staticmethod
+    def determinants(Cov):
+        """
+        Determinants of a stack of 2x2 or 3x3 matrices, along the first axis
+
+        They are written explicitly, which is much faster than the LU
+        decompositions of :func:`numpy.linalg.det` for such small matrices.
+
+        """
+        if Cov.shape[1] == 2:
+            return Cov[:, 0, 0]*Cov[:, 1, 1]-Cov[:, 0, 1]*Cov[:, 1, 0]
+        return (
+            Cov[:, 0, 0]*(Cov[:, 1, 1]*Cov[:, 2, 2]-Cov[:, 1, 2]*Cov[:, 2, 1]) -
+            Cov[:, 0, 1]*(Cov[:, 1, 0]*Cov[:, 2, 2]-Cov[:, 1, 2]*Cov[:, 2, 0]) +
+            Cov[:, 0, 2]*(Cov[:, 1, 0]*Cov[:, 2, 1]-Cov[:, 1, 1]*Cov[:, 2, 0]))
+
 
 ###################################
 # MPK TYPE LIKELIHOOD
@@ -1511,6 +1428,23 @@ class Likelihood_mpk(Likelihood):
             self.k_fid_size = line_number-ifid_discard+1
             khmax = k
 
+        # Without GiggleZ, the bands are rescaled by the ratio of the
+        # distances to their fiducial values (see loglkl). This ratio is
+        # accepted up to a factor max_scaling, which sets the range of k where
+        # the power spectrum is needed
+        try:
+            self.max_scaling
+        except:
+            self.max_scaling = 1.2
+        if self.max_scaling < 1:
+            raise io_mp.LikelihoodError(
+                "In likelihood %s, max_scaling must be at least 1, and is "
+                "%g." % (self.name, self.max_scaling))
+        khmin = self.kh[0]
+        if self.use_scaling and not self.use_giggleZ:
+            khmin /= self.max_scaling
+            khmax *= self.max_scaling
+
         if self.use_halofit:
             khmax *= 2
 
@@ -1628,6 +1562,30 @@ class Likelihood_mpk(Likelihood):
                 self.P_fid[i] = float(line.split()[1])
             datafile.close()
 
+        # The power spectrum is computed at once for all the likelihoods
+        if self.use_giggleZ:
+            khmin = min(khmin, self.k_fid[0])
+        self.pk_index = data.power_spectrum.request(
+            self.redshift, khmin, khmax, h_units=True)
+        if self.use_scaling:
+            self.background_index = data.background.request(self.redshift)
+
+        # The bias b of the windowed power spectrum W P_th (in the regions
+        # used) is marginalised analytically: for the data P_obs, of inverse
+        # covariance C, the chi square minimised over b reads
+        #   chi2 = P_obs C P_obs - (P_th W^T C P_obs)^2/(P_th W^T C W P_th).
+        # The data and the windows do not depend on the cosmology, so that
+        # the vector W^T C P_obs and the matrix W^T C W, summed over the
+        # regions, are computed here once and for all.
+        used = np.array(self.used_region, 'bool')
+        window = self.window[used]
+        invcov_P_obs = np.einsum(
+            'rij,rj->ri', self.invcov[used], self.P_obs[used])
+        self.chisq_dat = np.sum(self.P_obs[used]*invcov_P_obs)
+        self.cov_dat = np.einsum('rik,ri->k', window, invcov_P_obs)
+        self.cov_th = np.einsum(
+            'rik,rij,rjl->kl', window, self.invcov[used], window)
+
         return
 
     def add_common_knowledge(self, common_dictionary):
@@ -1662,12 +1620,12 @@ class Likelihood_mpk(Likelihood):
         # WiggleZ specific
         if self.use_scaling:
             # angular diameter distance at this redshift, in Mpc
-            d_angular = cosmo.angular_distance(self.redshift)
+            background = data.background.get(cosmo)
+            d_angular = background.angular_distance[self.background_index]
 
             # radial distance at this redshift, in Mpc, is simply 1/H (itself
-            # in Mpc^-1). Hz is an array, with only one element.
-            r, Hz = cosmo.z_of_r([self.redshift])
-            d_radial = 1/Hz[0]
+            # in Mpc^-1).
+            d_radial = 1/background.hubble[self.background_index]
 
             # scaling factor = (d_angular**2 * d_radial)^(1/3) for the
             # fiducial cosmology used in the data files of the observations
@@ -1678,29 +1636,29 @@ class Likelihood_mpk(Likelihood):
             scaling = pow(
                 (self.d_angular_fid/d_angular)**2 *
                 (self.d_radial_fid/d_radial), 1./3.)
+            if not self.use_giggleZ and not (
+                    1./self.max_scaling <= scaling <= self.max_scaling):
+                raise io_mp.OutOfGridError(
+                    "In likelihood %s, the scaling of k is %g, while the "
+                    "power spectrum was only requested for a scaling "
+                    "between %g and %g. Please increase %s.max_scaling." % (
+                        self.name, scaling, 1./self.max_scaling,
+                        self.max_scaling, self.name))
         else:
             scaling = 1
 
-        # get rescaled values of k in 1/Mpc
-        self.k = self.kh*h*scaling
-
         # get P(k) at right values of k, convert it to (Mpc/h)^3 and rescale it
-        P_lin = np.zeros((self.k_size), 'float64')
 
         # If the flag use_giggleZ is set to True, the power spectrum retrieved
         # from Class will get rescaled by the fiducial power spectrum given by
         # the GiggleZ N-body simulations CITE
         if self.use_giggleZ:
-            P = np.zeros((self.k_fid_size), 'float64')
-            for i in range(self.k_fid_size):
-                P[i] = cosmo.pk(self.k_fid[i]*h, self.redshift)
-                power = 0
-                # The following create a polynome in k, which coefficients are
-                # stored in the .data files of the experiments.
-                for j in range(6):
-                    power += self.giggleZ_fidpoly[j]*self.k_fid[i]**j
-                # rescale P by fiducial model and get it in (Mpc/h)**3
-                P[i] *= pow(10, power)*(h/scaling)**3/self.P_fid[i]
+            P = data.power_spectrum.get(cosmo, self.k_fid*h, self.pk_index)
+            # The following create a polynome in k, which coefficients are
+            # stored in the .data files of the experiments.
+            power = np.polyval(self.giggleZ_fidpoly[5::-1], self.k_fid)
+            # rescale P by fiducial model and get it in (Mpc/h)**3
+            P *= 10**power*(h/scaling)**3/self.P_fid
 
             if self.use_giggleZPP0:
                 # Shot noise parameter addition to GiggleZ model. It should
@@ -1718,65 +1676,14 @@ class Likelihood_mpk(Likelihood):
             # get rescaled values of k in 1/Mpc
             self.k = self.kh*h*scaling
             # get values of P(k) in Mpc**3
-            for i in range(self.k_size):
-                P_lin[i] = cosmo.pk(self.k[i], self.redshift)
+            P_lin = data.power_spectrum.get(cosmo, self.k, self.pk_index)
             # get rescaled values of P(k) in (Mpc/h)**3
             P_lin *= (h/scaling)**3
 
-        W_P_th = np.zeros((self.n_size), 'float64')
-
-        # starting analytic marginalisation over bias
-
-        # Define quantities living in all the regions possible. If only a few
-        # regions are selected in the .data file, many elements from these
-        # arrays will stay at 0.
-        P_data_large = np.zeros(
-            (self.n_size*self.num_regions_used), 'float64')
-        W_P_th_large = np.zeros(
-            (self.n_size*self.num_regions_used), 'float64')
-        cov_dat_large = np.zeros(
-            (self.n_size*self.num_regions_used), 'float64')
-        cov_th_large = np.zeros(
-            (self.n_size*self.num_regions_used), 'float64')
-
-        normV = 0
-
-        # infer P_th from P_lin. It is still in (Mpc/h)**3. TODO why was it
-        # called P_lin in the first place ? Couldn't we use now P_th all the
-        # way ?
-        P_th = P_lin
-
-        # Loop over all the available regions
-        for i_region in range(self.num_regions):
-            # In each region that was selected with the array of flags
-            # self.used_region, define boundaries indices, and fill in the
-            # corresponding windowed power spectrum. All the unused regions
-            # will still be set to zero as from the initialization, which will
-            # not contribute anything in the final sum.
-            if self.used_region[i_region]:
-                imin = i_region*self.n_size
-                imax = (i_region+1)*self.n_size-1
-
-                W_P_th = np.dot(self.window[i_region, :], P_th)
-                for i in range(self.n_size):
-                    P_data_large[imin+i] = self.P_obs[i_region, i]
-                    W_P_th_large[imin+i] = W_P_th[i]
-                    cov_dat_large[imin+i] = np.dot(
-                        self.invcov[i_region, i, :],
-                        self.P_obs[i_region, :])
-                    cov_th_large[imin+i] = np.dot(
-                        self.invcov[i_region, i, :],
-                        W_P_th[:])
-
-        # Explain what it is TODO
-        normV += np.dot(W_P_th_large, cov_th_large)
-        # Sort of bias TODO ?
-        b_out = np.sum(W_P_th_large*cov_dat_large) / \
-            np.sum(W_P_th_large*cov_th_large)
-
-        # Explain this formula better, link to article ?
-        chisq = np.dot(P_data_large, cov_dat_large) - \
-            np.dot(W_P_th_large, cov_dat_large)**2/normV
+        # analytic marginalisation over bias, from the quantities computed at
+        # initialisation
+        chisq = self.chisq_dat - np.dot(self.cov_dat, P_lin)**2 / \
+            np.dot(P_lin, np.dot(self.cov_th, P_lin))
 
         return -chisq/2
 
@@ -1915,18 +1822,18 @@ class Likelihood_clocks(Likelihood):
         self.Hz = total[:, 1]
         self.err = total[:, 2]
 
+        # The Hubble rate is computed at once for all the likelihoods
+        self.indices = data.background.request(self.z)
+
     def loglkl(self, cosmo, data):
 
         # Store the speed of light in km/s
         c_light_km_per_sec = const.c/1000.
-        chi2 = 0
-
-        # Loop over the redshifts
-        for index, z in enumerate(self.z):
-            # Query the cosmo module for the Hubble rate (in 1/Mpc), and
-            # convert it to km/s/Mpc
-            H_cosmo = cosmo.Hubble(z)*c_light_km_per_sec
-            # Add to the tota chi2
-            chi2 += (self.Hz[index]-H_cosmo)**2/self.err[index]**2
+
+        # Recover the Hubble rate (in 1/Mpc) at all the redshifts, and
+        # convert it to km/s/Mpc
+        H_cosmo = data.background.get(cosmo).hubble[self.indices] * \
+            c_light_km_per_sec
+        chi2 = np.sum((self.Hz-H_cosmo)**2/self.err**2)
 
         return -0.5 * chi2
@@ -18,7 +18,9 @@ kB = 1.3806488e-23     #Boltzmann constant
 Ghz_Kelvin = h/kB*1e9  #GHz Kelvin conversion
     
 class BK14(Likelihood_sn):
-    
+
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
         # Unusual construction, since the data files are not distributed
         # alongside BK14 (size problems)
@@ -108,6 +108,11 @@ class CFHTLens_correlation(Likelihood):
             else:
                 raise io_mp.LikelihoodError("File not found:\n %s"%cutvalues_file_path)
 
+        # The power spectrum is computed at once for all the likelihoods. The
+        # smallest wavenumber depends on the cosmology, see k_min
+        self.pk_indices = data.power_spectrum.request(
+            self.z_p, self.k_min, self.k_max_h_by_Mpc, h_units=True)
+
         # Normalize selection functions
         self.p_norm = np.zeros(self.nbin, 'float64')
         for Bin in xrange(self.nbin):
@@ -262,6 +267,18 @@ class CFHTLens_correlation(Likelihood):
 
         return
 
+    def k_min(self, cosmo):
+        """
+        Smallest wavenumber needed, in h/Mpc, for the current cosmology
+
+        It is l/r at the highest redshift, with the comoving distance r of
+        this cosmology, which can exceed c z/H0 (for instance with phantom
+        dark energy). A margin of one per cent covers the rounding errors.
+
+        """
+        r_max = cosmo.z_of_r(np.array([max(self.z_p)]))[0][0]
+        return 0.99*self.l[0]/(r_max*cosmo.h())
+
     def loglkl(self, cosmo, data):
 
         # One wants to obtain here the relation between z and r, this is done
@@ -283,21 +300,12 @@ class CFHTLens_correlation(Likelihood):
                     fun[1:]+fun[:-1])*(self.r[nr+1:]-self.r[nr:-1]))
                 self.g[nr, Bin] *= 2.*self.r[nr]*(1.+self.z_p[nr])
 
-        # Get power spectrum P(k=l/r,z(r)) from cosmological module
+        # Get power spectrum P(k=l/r,z(r)) from the grid computed for all
+        # the likelihoods, set to zero above k_max
         kmax_in_inv_Mpc = self.k_max_h_by_Mpc * cosmo.h()
-        for index_l in xrange(self.nlmax):
-            for index_z in xrange(1, self.nzmax):
-#                if (self.l[index_l]/self.r[index_z] > self.k_max):
-#                    raise io_mp.LikelihoodError(
-#                        "you should increase CFHTLens_correlation.k_max up"
-#                        " to at least %g" % (self.l[index_l]/self.r[index_z]))
-#                self.pk[index_l, index_z] = cosmo.pk(
-#                    self.l[index_l]/self.r[index_z], self.z_p[index_z])
-                k_in_inv_Mpc =  self.l[index_l]/self.r[index_z]
-                if (k_in_inv_Mpc > kmax_in_inv_Mpc):
-                    self.pk[index_l, index_z] = 0.0
-                else:
-                    self.pk[index_l, index_z] = cosmo.pk(k_in_inv_Mpc, self.z_p[index_z])
+        self.pk[:, 1:] = data.power_spectrum.get(
+            cosmo, self.l[:, np.newaxis]/self.r[np.newaxis, 1:],
+            self.pk_indices[np.newaxis, 1:], k_max=kmax_in_inv_Mpc)
 
         # Recover the non_linear scale computed by halofit. If no scale was
         # affected, set the scale to one, and make sure that the nuisance
@@ -45,6 +45,8 @@ from montepython.likelihood_class import Likelihood_sn
 
 class JLA(Likelihood_sn):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         # Unusual construction, since the data files are not distributed
@@ -71,6 +73,9 @@ class JLA(Likelihood_sn):
         # Reading light-curve parameters from self.data_file (jla_lcparams.txt)
         self.light_curve_params = self.read_light_curve_parameters()
 
+        # The distances are computed at once for all the likelihoods
+        self.indices = data.background.request(self.light_curve_params.zcmb)
+
     def loglkl(self, cosmo, data):
         """
         Compute negative log-likelihood (eq.15 Betoule et al. 2014)
@@ -79,13 +84,10 @@ class JLA(Likelihood_sn):
         # Recover the distance moduli from CLASS (a size N vector of double
         # containing the predicted distance modulus for each SN in the JLA
         # sample, given the redshift of the supernova.)
-        redshifts = self.light_curve_params.zcmb
-        size = redshifts.size
+        size = self.light_curve_params.zcmb.size
 
-        moduli = np.empty((size, ))
-        for index, row in self.light_curve_params.iterrows():
-            z_cmb = row['zcmb']
-            moduli[index] = cosmo.luminosity_distance(z_cmb)
+        moduli = data.background.get(cosmo).luminosity_distance[
+            self.indices]
         moduli = 5 * np.log10(moduli) + 25
 
         # Convenience variables: store the nuisance parameters in short named
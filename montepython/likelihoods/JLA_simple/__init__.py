@@ -17,6 +17,8 @@ from montepython.likelihood_class import Likelihood_sn
 
 class JLA_simple(Likelihood_sn):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         # This reads the configuration file as well
@@ -36,6 +38,9 @@ class JLA_simple(Likelihood_sn):
         # Read the simplified light-curve self.data_file
         self.light_curve_params = self.read_light_curve_parameters()
 
+        # The distances are computed at once for all the likelihoods
+        self.indices = data.background.request(self.light_curve_params.z)
+
         # The covariance matrix can be already inverted, once and for all
         # (cholesky)
         self.C00 = la.cholesky(self.C00, lower=True, overwrite_a=True)
@@ -45,11 +50,8 @@ class JLA_simple(Likelihood_sn):
         # containing the predicted distance modulus for each SN in the JLA
         # sample, given the redshift of the supernova.)
         sn = self.light_curve_params
-        size = sn.z.size
-
-        moduli = np.empty((size, ))
-        for index, z in enumerate(sn.z):
-            moduli[index] = cosmo.luminosity_distance(z)
+        moduli = data.background.get(cosmo).luminosity_distance[
+            self.indices]
         moduli = 5 * np.log10(moduli) + 25
 
         # Convenience variables: store the nuisance parameters in short named
@@ -1,5 +1,6 @@
 import os
 import numpy as np
+import montepython.io_mp as io_mp
 from montepython.likelihood_class import Likelihood
 
 
@@ -29,37 +30,35 @@ class bao(Likelihood):
         # number of data points
         self.num_points = np.shape(self.z)[0]
 
+        # the distances are computed at once for all the likelihoods
+        self.indices = data.background.request(self.z)
+
         # end of initialization
 
     # compute likelihood
 
     def loglkl(self, cosmo, data):
 
-        chi2 = 0.
-
-        # for each point, compute angular distance da, radial distance dr,
-        # volume distance dv, sound horizon at baryon drag rs_d,
-        # theoretical prediction and chi2 contribution
-        for i in range(self.num_points):
-
-            da = cosmo.angular_distance(self.z[i])
-            dr = self.z[i] / cosmo.Hubble(self.z[i])
-            dv = pow(da * da * (1 + self.z[i]) * (1 + self.z[i]) * dr, 1. / 3.)
-
-            if (self.type[i] == 3):
-                rs = cosmo.rs_drag() * self.rs_rescale
-                theo = dv / rs
-
-            elif (self.type[i] == 4):
-                theo = dv
-
-            else:
-                raise io_mp.LikelihoodError(
-                    "In likelihood %s. " % self.name +
-                    "BAO data type %s " % self.type[i] +
-                    "in %d-th line not understood" % i)
-
-            chi2 += ((theo - self.data[i]) / self.error[i]) ** 2
+        # for all points, recover angular distance da, radial distance dr,
+        # volume distance dv, sound horizon at baryon drag rs_d from the
+        # background table
+        background = data.background.get(cosmo)
+        da = background.angular_distance[self.indices]
+        dr = self.z / background.hubble[self.indices]
+        dv = (da * da * (1 + self.z) * (1 + self.z) * dr) ** (1. / 3.)
+        rs = background.rs_drag * self.rs_rescale
+
+        unknown = np.flatnonzero((self.type != 3) & (self.type != 4))
+        if unknown.size:
+            i = unknown[0]
+            raise io_mp.LikelihoodError(
+                "In likelihood %s. " % self.name +
+                "BAO data type %s " % self.type[i] +
+                "in %d-th line not understood" % i)
+
+        # theoretical prediction and chi2
+        theo = np.where(self.type == 3, dv / rs, dv)
+        chi2 = np.sum(((theo - self.data) / self.error) ** 2)
 
         # return ln(L)
         lkl = - 0.5 * chi2
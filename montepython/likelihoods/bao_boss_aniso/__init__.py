@@ -39,17 +39,21 @@ class bao_boss_aniso(Likelihood):
         # use the faster interp.RectBivariateSpline interpolation scheme
         self.prob_interp = interp.RectBivariateSpline(x, y, Z, kx=3, ky=3, s=0)
 
+        # the distances are computed at once for all the likelihoods
+        self.index = data.background.request(self.z)
+
         # end of initialization
 
     # compute likelihood
 
     def loglkl(self, cosmo, data):
 
-        Da = cosmo.angular_distance(self.z)
-        H = cosmo.Hubble(self.z) * conts.c / 1000.0
+        background = data.background.get(cosmo)
+        Da = background.angular_distance[self.index]
+        H = background.hubble[self.index] * conts.c / 1000.0
         #dr = self.z / H
         #dv = pow(da * da * (1 + self.z) * (1 + self.z) * dr, 1. / 3.)
-        rs = cosmo.rs_drag() * self.rs_rescale
+        rs = background.rs_drag * self.rs_rescale
 
         alpha_perp = Da / rs / (self.Dafid / self.rsfid)
         alpha_para = (self.Hfid * self.rsfid) / (H * rs)
@@ -23,6 +23,8 @@ import warnings
 
 class euclid_lensing(Likelihood):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         Likelihood.__init__(self, path, data, command_line)
@@ -79,6 +81,10 @@ class euclid_lensing(Likelihood):
         # Fill array of discrete z values
         self.z = np.linspace(0, self.zmax, num=self.nzmax)
 
+        # The power spectrum is computed at once for all the likelihoods
+        self.pk_indices = data.power_spectrum.request(
+            self.z, self.k_min_h_by_Mpc, self.k_max_h_by_Mpc, h_units=True)
+
         # Fill distribution for each bin (convolving with photo_z distribution)
         self.eta_z = np.zeros((self.nzmax, self.nbin), 'float64')
         gal = self.galaxy_distribution(self.z, True)
@@ -214,22 +220,12 @@ class euclid_lensing(Likelihood):
         kmin_in_inv_Mpc = self.k_min_h_by_Mpc * cosmo.h()
         kmax_in_inv_Mpc = self.k_max_h_by_Mpc * cosmo.h()
         pk = np.zeros((self.nlmax, self.nzmax), 'float64')
-        for index_l in xrange(self.nlmax):
-            for index_z in xrange(1, self.nzmax):
-
-        # These lines would return an error when you ask for P(k,z) out of computed range
-        #        if (self.l[index_l]/self.r[index_z] > self.k_max):
-        #            raise io_mp.LikelihoodError(
-        #                "you should increase euclid_lensing.k_max up to at least %g" % (self.l[index_l]/self.r[index_z]))
-        #        pk[index_l, index_z] = cosmo.pk(
-        #            self.l[index_l]/self.r[index_z], self.z[index_z])
-
-        # These lines set P(k,z) to zero out of [k_min, k_max] range
-                k_in_inv_Mpc =  self.l[index_l]/self.r[index_z]
-                if (k_in_inv_Mpc < kmin_in_inv_Mpc) or (k_in_inv_Mpc > kmax_in_inv_Mpc):
-                    pk[index_l, index_z] = 0.
-                else:
-                    pk[index_l, index_z] = cosmo.pk(self.l[index_l]/self.r[index_z], self.z[index_z])
+
+        # P(k,z) is set to zero out of [k_min, k_max] range
+        pk[:, 1:] = data.power_spectrum.get(
+            cosmo, self.l[:, np.newaxis]/self.r[np.newaxis, 1:],
+            self.pk_indices[np.newaxis, 1:],
+            kmin_in_inv_Mpc, kmax_in_inv_Mpc)
 
         # Recover the non_linear scale computed by halofit. If no scale was
         # affected, set the scale to one, and make sure that the nuisance
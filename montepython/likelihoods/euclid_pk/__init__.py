@@ -7,6 +7,8 @@ from math import exp, log, pi, log10
 
 class euclid_pk(Likelihood):
 
+    thread_safe = True
+
     def __init__(self, path, data, command_line):
 
         Likelihood.__init__(self, path, data, command_line)
@@ -55,6 +55,9 @@ class fake_desi(Likelihood):
             # number of data points
             self.num_points = np.shape(self.z)[0]
 
+            # the distances are computed at once for all the likelihoods
+            self.indices = data.background.request(self.z)
+
         # end of initialization
 
     # compute likelihood
@@ -89,44 +92,41 @@ class fake_desi(Likelihood):
             else:
                 raise io_mp.LikelihoodError("Could not find file ",self.sensitivity)
 
-        chi2 = 0.
-
-        # for each point, compute angular distance da, radial distance dr,
-        # volume distance dv, sound horizon at baryon drag rs_d,
-        # theoretical prediction and chi2 contribution
-        for i in range(self.num_points):
-
-            da = cosmo.angular_distance(self.z[i])
-            dr = self.z[i] / cosmo.Hubble(self.z[i])
-            dv = pow(da * da * (1 + self.z[i]) * (1 + self.z[i]) * dr, 1. / 3.)
+        # for all points, recover angular distance da, Hubble rate H, and
+        # sound horizon at baryon drag rs_d from the background table (the
+        # redshifts of the fiducial model are only known at this point)
+        if self.fid_values_exist is True:
+            background = data.background.get(cosmo)
+            da = background.angular_distance[self.indices]
+            H = background.hubble[self.indices]
+            rs = background.rs_drag
+        else:
+            da = np.array([cosmo.angular_distance(z) for z in self.z])
+            H = np.array([cosmo.Hubble(z) for z in self.z])
             rs = cosmo.rs_drag()
 
-            if self.type[i] == 3:
-                theo = dv / rs
-
-            elif self.type[i] == 4:
-                theo = dv
-
-            elif self.type[i] == 5:
-                theo = da / rs
-
-            elif self.type[i] == 6:
-                theo = 1. / cosmo.Hubble(self.z[i]) / rs
-
-            elif self.type[i] == 7:
-                theo = rs / dv
-            else:
+        # radial distance dr, volume distance dv and theoretical prediction
+        dr = self.z / H
+        dv = (da * da * (1 + self.z) * (1 + self.z) * dr) ** (1. / 3.)
+        predictions = {3: dv / rs, 4: dv, 5: da / rs, 6: 1. / H / rs,
+                       7: rs / dv}
+        theo = np.empty(self.num_points, 'float64')
+        for i in range(self.num_points):
+            try:
+                theo[i] = predictions[self.type[i]][i]
+            except KeyError:
                 raise io_mp.LikelihoodError(
                     "In likelihood %s. " % self.name +
                     "BAO data type %s " % self.type[i] +
                     "in %d-th line not understood" % i)
 
-            if self.fid_values_exist is True:
-                chi2 += ((theo - self.data[i]) / self.error[i]) ** 2
-            else:
-                sigma = theo * self.relative_error[i]
+        if self.fid_values_exist is True:
+            chi2 = np.sum(((theo - self.data) / self.error) ** 2)
+        else:
+            for i in range(self.num_points):
+                sigma = theo[i] * self.relative_error[i]
                 fid_file.write(self.nickname)
-                fid_file.write("   %.8g  %.8g  %.8g %5d \n" % (self.z[i], theo, sigma, self.type[i]))
+                fid_file.write("   %.8g  %.8g  %.8g %5d \n" % (self.z[i], theo[i], sigma, self.type[i]))
 
         # Exit after writing fiducial file
         # (return an imaginary number to let the sampler know that fiducial models were just created)
@@ -25,6 +25,9 @@ class sn(Likelihood):
         # number of data points
         self.num_points = np.shape(self.z)[0]
 
+        # the distances are computed at once for all the likelihoods
+        self.indices = data.background.request(self.z)
+
         # define correlation m,atrix
         covmat = np.zeros((self.num_points, self.num_points), 'float64')
 
@@ -55,15 +58,11 @@ class sn(Likelihood):
 
     def loglkl(self, cosmo, data):
 
-        # define array for difference between theory and observations
-        difference = np.ndarray(self.num_points, 'float64')
-
-        # for each point, compute luminosity distance d_L=(1+z)**2d_A and infer
-        # theoretical prediction and difference with observation
-        for i in range(self.num_points):
-            d = cosmo.angular_distance(self.z[i])
-            difference[i] = 5 * np.log((1 + self.z[i]) ** 2 * d) / np.log(
-                10) + 25 - self.moduli[i]
+        # for all points, compute luminosity distance d_L=(1+z)**2d_A and
+        # infer theoretical prediction and difference with observation
+        d = data.background.get(cosmo).angular_distance[self.indices]
+        difference = 5 * np.log((1 + self.z) ** 2 * d) / np.log(
+            10) + 25 - self.moduli
 
         # chisquare before analytic marginalization
         AT = np.dot(difference, np.dot(self.inv_covmat, difference))
@@ -1,6 +1,6 @@
 import os
 import numpy as np
-from math import log, sqrt, pi
+from math import sqrt, pi
 from montepython.likelihood_class import Likelihood
 
 
@@ -33,28 +33,31 @@ class timedelay(Likelihood):
         # number of data points
         self.num_points = np.shape(self.zd)[0]
 
+        # the distances are computed at once for all the likelihoods
+        self.indices_d = data.background.request(self.zd)
+        self.indices_s = data.background.request(self.zs)
+
         # end of initialization
 
     # compute likelihood
 
     def loglkl(self, cosmo, data):
 
-        lkl = 0.
-
-        # for each point, compute angular distance da, radial distance dr,
-        # volume distance dv, sound horizon at baryon drag rs_d,
-        # theoretical prediction and chi2 contribution
-        for i in range(self.num_points):
-            Dd = cosmo.angular_distance(self.zd[i])
-            Ds = cosmo.angular_distance(self.zs[i])
-            Dds = ((1. + self.zs[i]) * Ds - (1 + self.zd[i]) * Dd) / (
-                1. + self.zs[i])
-            Dt = (1 + self.zd[i]) * Dd * Ds / Dds
-
-            if (Dt > self.lambda_d[i]):
-                lkl = lkl - (log(Dt - self.lambda_d[i]) - self.mu_d[i]) ** 2 / 2. / self.sigma_d[
-                    i] ** 2 - log(sqrt(2. * pi) * (Dt - self.lambda_d[i]) * self.sigma_d[i])
-            else:
-                lkl = data.boundary_loglike
+        # for all points, compute angular distances to the deflector Dd, to
+        # the source Ds, between them Dds, time delay distance Dt and
+        # likelihood contribution
+        background = data.background.get(cosmo)
+        Dd = background.angular_distance[self.indices_d]
+        Ds = background.angular_distance[self.indices_s]
+        Dds = ((1. + self.zs) * Ds - (1 + self.zd) * Dd) / (1. + self.zs)
+        Dt = (1 + self.zd) * Dd * Ds / Dds
+
+        if (Dt <= self.lambda_d).any():
+            return data.boundary_loglike
+
+        lkl = np.sum(
+            - (np.log(Dt - self.lambda_d) - self.mu_d) ** 2 / 2. /
+            self.sigma_d ** 2 -
+            np.log(sqrt(2. * pi) * (Dt - self.lambda_d) * self.sigma_d))
 
         return lkl
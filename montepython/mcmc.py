@@ -12,6 +12,9 @@ every step:
 * :func:`get_new_position` returns a new point in the parameter space,
   depending on the proposal density.
 
+With the option `--speculative`, the next proposals are evaluated in advance
+by a pool of worker processes, with :func:`speculate`.
+
 The :func:`chain` in turn calls several helper routines, defined in
 :mod:`sampler`. These are called just once:
 
@@ -33,14 +36,15 @@ cosmological class. They will thus not be described for every function.
 import os
 import sys
 import math
-import random as rd
 import numpy as np
 import warnings
 import scipy.linalg as la
+from multiprocessing import Pool
 from pprint import pprint
 
 import io_mp
 import sampler
+import statistics_mp
 
 
 def get_new_position(data, eigv, U, k, Cholesky, Rotation):
@@ -91,33 +95,61 @@ def get_new_position(data, eigv, U, k, Cholesky, Rotation):
 
     """
 
-    parameter_names = data.get_mcmc_parameters(['varying'])
-    vector_new = np.zeros(len(parameter_names), 'float64')
-    sigmas = np.zeros(len(parameter_names), 'float64')
+    store = data.parameter_store
+    vector_new = draw_position(data, eigv, U, k, Cholesky, Rotation)
+
+    # Check for boundaries problems. At this point, if a boundary condition is
+    # not fullfilled, return False
+    if not store.in_bounds(vector_new):
+        return False
+
+    # Check for a slow step (the first time, all the current values are
+    # undefined, and the full computation is triggered)
+    data.check_for_slow_step(vector_new)
+
+    # If it is not the case, proceed with normal computation. The value of
+    # new_vector is then put into the 'current' point in parameter space.
+    store.set_current(vector_new)
+
+    # Propagate the information towards the cosmo arguments
+    data.update_cosmo_arguments()
+
+    return True
+
+
+def draw_position(data, eigv, U, k, Cholesky, Rotation):
+    """
+    Draw a new point from the proposal density around the last accepted one
+
+    The arguments are the same as for :func:`get_new_position`, which checks
+    the boundaries and sets the new point as the current one.
+
+    Returns
+    -------
+    vector_new : numpy array
+        Values of the varying parameters
+
+    """
+    start = data.profiler.start()
+    store = data.parameter_store
+    sigmas = np.zeros(len(store.varying_indices), 'float64')
 
     # Write the vector of last accepted points, or if it does not exist
     # (initialization routine), take the mean value
-    vector = np.zeros(len(parameter_names), 'float64')
-    try:
-        for elem in parameter_names:
-            vector[parameter_names.index(elem)] = \
-                data.mcmc_parameters[elem]['last_accepted']
-    except KeyError:
-        for elem in parameter_names:
-            vector[parameter_names.index(elem)] = \
-                data.mcmc_parameters[elem]['initial'][0]
+    vector = store.get_last_accepted()
 
-    # Initialize random seed
-    rd.seed()
+    # The standard normal deviates are drawn from the seeded generator of the
+    # chain
+    random_numbers = data.random_numbers
 
     # Choice here between sequential and global change of direction
     if data.jumping == 'global':
-        for i in range(len(vector)):
-            sigmas[i] = (math.sqrt(1/eigv[i]/len(vector))) * \
-                rd.gauss(0, 1)*data.jumping_factor
+        sigmas = np.sqrt(1/eigv/len(vector)) * \
+            random_numbers.normal(len(vector))*data.jumping_factor
     elif data.jumping == 'sequential':
         i = k % len(vector)
-        sigmas[i] = (math.sqrt(1/eigv[i]))*rd.gauss(0, 1)*data.jumping_factor
+        sigmas[i] = (math.sqrt(1/eigv[i])) * \
+            random_numbers.normal(1)[0]*data.jumping_factor
     elif data.jumping == 'fast':
         #i = k % len(vector)
         j = k % len(data.over_sampling_indices)
@@ -138,9 +170,8 @@ def get_new_position(data, eigv, U, k, Cholesky, Rotation):
                 # All the varied parameters are given a random variation with a
                 # sigma of 1. This will translate in a jump for all the
                 # parameters (as long as the Cholesky matrix is non diagonal)
-                for j in range(Range):
-                    sigmas[j+Previous] = (math.sqrt(1./Range)) * \
-                        rd.gauss(0, 1)*data.jumping_factor
+                sigmas[Previous:Previous+Range] = (math.sqrt(1./Range)) * \
+                    random_numbers.normal(Range)*data.jumping_factor
                 break
             else:
                 continue
@@ -154,43 +185,193 @@ def get_new_position(data, eigv, U, k, Cholesky, Rotation):
     else:
         vector_new = vector + np.dot(Cholesky, sigmas)
 
-    # Check for boundaries problems
-    flag = 0
-    for i, elem in enumerate(parameter_names):
-        value = data.mcmc_parameters[elem]['initial']
-        if((str(value[1]) != str(-1) and value[1] is not None) and
-                (vector_new[i] < value[1])):
-            flag += 1  # if a boundary value is reached, increment
-        elif((str(value[2]) != str(-1) and value[2] is not None) and
-                vector_new[i] > value[2]):
-            flag += 1  # same
-
-    # At this point, if a boundary condition is not fullfilled, ie, if flag is
-    # different from zero, return False
-    if flag != 0:
-        return False
+    data.profiler.stop('proposal', start)
+    return vector_new
 
-    # Check for a slow step (only after the first time, so we put the test in a
-    # try: statement: the first time, the exception KeyError will be raised)
-    try:
-        data.check_for_slow_step(vector_new)
-    except KeyError:
-        pass
 
-    # If it is not the case, proceed with normal computation. The value of
-    # new_vector is then put into the 'current' point in parameter space.
-    for index, elem in enumerate(parameter_names):
-        data.mcmc_parameters[elem]['current'] = vector_new[index]
+def compute_cholesky(data, C):
+    """
+    Return the Cholesky decomposition of `C`, ordered by blocks
 
-    # Propagate the information towards the cosmo arguments
-    data.update_cosmo_arguments()
+    The decomposition is done with the parameters ordered as the blocks of the
+    fast jumping method (see :attr:`data.Data.block_order`), and its rows are
+    brought back to the order of the varying parameters. Its columns, that
+    correspond to the jumps of every block, stay ordered by blocks, so that
+    varying one block only moves the parameters of this block and of the
+    following ones.
 
-    return True
+    Parameters
+    ----------
+    data : :class:`data.Data`
+        Initialized instance
+    C : numpy array
+        Covariance matrix, in the order of the varying parameters
+
+    """
+    order = data.block_order
+    Cholesky = np.empty_like(C)
+    Cholesky[order] = la.cholesky(C[np.ix_(order, order)]).T
+    return Cholesky
+
+
+def speculate(pool, data, eigv, U, k, Cholesky, Rotation, number):
+    """
+    Draw the next proposals assuming that they are all rejected
+
+    All of them are drawn around the last accepted point, as the steps `k`,
+    `k+1`... of a chain staying at its position, and submitted to the pool
+    of worker processes (see :func:`sampler.evaluate_position`).
+
+    Returns
+    -------
+    pending : list
+        For each step, the proposed vector and the asynchronous result of its
+        evaluation, or None if it lies outside of the boundaries
+
+    """
+    store = data.parameter_store
+    pending = []
+    for index in range(number):
+        vector = draw_position(data, eigv, U, k+index, Cholesky, Rotation)
+        if store.in_bounds(vector):
+            pending.append(
+                (vector, pool.apply_async(sampler.evaluate_position, (vector,))))
+        else:
+            pending.append((vector, None))
+    return pending
 
 
 ######################
 # MCMC CHAIN
 ######################
+def drag(cosmo, drag_cosmo, drag_key, data, loglike, accepted, Cholesky,
+         number):
+    """
+    Drag the fast parameters along a slow proposal
+
+    Implements the dragging of Neal 2005 (`Taking bigger Metropolis steps by
+    dragging fast variables <http://arxiv.org/abs/math/0502099>`_), as in
+    Lewis 2013. The slow proposal, already set as the current point by
+    :func:`get_new_position`, is computed with the second instance of the
+    cosmological module, `drag_cosmo`, while `cosmo` still holds the last
+    accepted cosmology. The fast parameters are then updated `number` times,
+    with the same jumps at both ends, and a Metropolis acceptance on the
+    log-likelihood interpolated between the two ends. Every update jumps one
+    block of fast parameters, drawn at random, so that the sequence of
+    updates is the same in both directions, as required for detailed
+    balance.
+
+    The values of the likelihoods are kept for both ends, and at each end,
+    only the likelihoods whose nuisance parameters changed are computed
+    again, with the instance of the cosmological module holding this end.
+    The end point is finally set as the current one from the kept values,
+    without computing it again.
+
+    Parameters
+    ----------
+    drag_key : tuple
+        Key of the cosmology held by `drag_cosmo` (see
+        :attr:`data.CosmologyCache.computed_key`)
+    loglike : float
+        Log-likelihood of the last accepted point
+    accepted : dict
+        Value of every likelihood at the last accepted point, or None if not
+        known, in which case they are all computed again at the first update
+    Cholesky : numpy array
+        Cholesky decomposition of the covariance matrix, see
+        :func:`compute_cholesky`
+    number : int
+        Number of updates of the fast parameters
+
+    Returns
+    -------
+    newloglike : float
+        Log-likelihood of the end point, which is the current point
+    log_ratio : float
+        Log of the acceptance ratio of the dragged proposal
+    drag_key : tuple
+        Key of the cosmology now held by `drag_cosmo`
+
+    """
+    store = data.parameter_store
+    cache = data.cosmo_cache
+    random_numbers = data.random_numbers
+    instances = [cosmo, drag_cosmo]
+    keys = [cache.computed_key, drag_key]
+
+    # The end point was set as the current one by get_new_position, and is
+    # computed entirely, as its cosmology changed
+    ends = [store.get_last_accepted(),
+            store.current[store.varying_indices].copy()]
+    cache.computed_key = keys[1]
+    values = [loglike, sampler.compute_lkl(drag_cosmo, data)]
+    keys[1] = cache.computed_key
+    if values[1] == data.boundary_loglike:
+        cache.computed_key = keys[0]
+        return values[1], 0., keys[1]
+    # The derived parameters only depend on the cosmology of the end point
+    derived = store.current[store.derived_indices].copy()
+    backups = [accepted, dict((likelihood.name, likelihood.backup_value)
+                              for likelihood in data.lkl.itervalues())]
+
+    def evaluate(side, vector):
+        """
+        Compute the likelihood at one end, with its own instance
+
+        Returns the log-likelihood and the value of every likelihood.
+
+        """
+        changed = vector != ends[side]
+        data.need_cosmo_update = False
+        for likelihood in data.lkl.itervalues():
+            if backups[side] is None:
+                likelihood.need_update = True
+            else:
+                likelihood.need_update = bool(
+                    changed[store.positions(likelihood.nuisance)].any())
+                likelihood.backup_value = backups[side][likelihood.name]
+        store.set_current(vector)
+        data.update_cosmo_arguments()
+        cache.computed_key = keys[side]
+        value = sampler.compute_lkl(instances[side], data)
+        keys[side] = cache.computed_key
+        return value, dict((likelihood.name, likelihood.backup_value)
+                           for likelihood in data.lkl.itervalues())
+
+    # The ratio is the mean difference between the ends along the path
+    total = values[1]-values[0]
+    blocks = data.block_parameters
+    for index in range(number):
+        weight = (index+1.)/(number+1)
+        block = 1+int(random_numbers.uniform()*(len(blocks)-1))
+        sigmas = np.zeros(len(ends[0]), 'float64')
+        size = blocks[block]-blocks[block-1]
+        sigmas[blocks[block-1]:blocks[block]] = math.sqrt(1./size) * \
+            random_numbers.normal(size)*data.jumping_factor
+        jump = np.dot(Cholesky, sigmas)
+        trials = [end+jump for end in ends]
+        if all([store.in_bounds(trial) for trial in trials]):
+            results = [evaluate(side, trials[side]) for side in (0, 1)]
+            trial_values = [value for value, _ in results]
+            if data.boundary_loglike not in trial_values:
+                ratio = (1-weight)*(trial_values[0]-values[0]) + \
+                    weight*(trial_values[1]-values[1])
+                if ratio >= 0 or random_numbers.uniform() < np.exp(ratio):
+                    ends, values = trials, trial_values
+                    backups = [lkl_values for _, lkl_values in results]
+        total += values[1]-values[0]
+
+    # Leave the end point as the current one, with the last accepted
+    # cosmology held by the main instance
+    store.set_current(ends[1])
+    store.set_current(derived, store.derived_names)
+    data.update_cosmo_arguments()
+    for likelihood in data.lkl.itervalues():
+        likelihood.backup_value = backups[1][likelihood.name]
+    cache.computed_key = keys[0]
+    return values[1], total/(number+1), keys[1]
+
+
 def chain(cosmo, data, command_line):
     """
     Run a Markov chain of fixed length with a Metropolis Hastings algorithm.
@@ -208,8 +389,46 @@ def chain(cosmo, data, command_line):
 
     Every time the code accepts :code:`data.write_step` number of points
     (quantity defined in the input parameter file), it will write the result to
-    disk (flushing the buffer by forcing to exit the output file, and reopen it
-    again.
+    disk (flushing the buffer, without closing the output file, which keeps
+    its lock).
+
+    With the method `DA` (delayed acceptance), the proposals changing the
+    cosmological parameters are first screened with a cheap approximation of
+    the log-likelihood (see :class:`statistics_mp.QuadraticApproximation`),
+    built from the proposal covariance matrix, and centered on the starting
+    point, or on the mean of the chains after every update of the proposal.
+    Only the proposals surviving this first stage are computed, and accepted
+    with a corrected probability, which keeps the chain sampling exactly the
+    posterior (Christen & Fox 2005, `Markov chain Monte Carlo using an
+    approximation <https://doi.org/10.1198/106186005X76983>`_).
+
+    With the option `--speculative`, the next proposals are drawn in advance,
+    assuming that they will all be rejected, and evaluated at the same time by
+    a pool of worker processes, each with its own instance of the cosmological
+    module. The results are then consumed in order, and the remaining ones are
+    discarded as soon as a point is accepted. The chain is thus statistically
+    identical to the serial one, while a single chain can use several cores:
+    with an acceptance rate of about 0.25, four workers bring roughly a factor
+    two.
+
+    With the option `--checkpoint`, the complete state of the chain (position,
+    multiplicity, counters, proposal density, running statistics and state of
+    the random number generator) is regularly written next to the chain, see
+    :func:`io_mp.write_checkpoint`. Restarting with `-r` from a chain having a
+    checkpoint resumes it exactly where the checkpoint was written, appending
+    to the same file, until the number of steps initially asked.
+
+    With the option `--drag`, and the fast jumping method, every proposal
+    of the cosmological parameters drags the fast parameters along, see
+    :func:`drag`. A second instance of the cosmological module holds the
+    proposed cosmology, and is swapped with the main one when the proposal
+    is accepted.
+
+    With the option `--tune-blocks`, and the fast jumping method, the time
+    spent in the cosmological module and in every likelihood is measured
+    during the first steps. The blocks of nuisance parameters are then
+    ordered, and their over-sampling chosen, from these costs (see
+    :meth:`data.Data.tune_blocks`), and the result is logged to log.param.
 
     .. note::
 
@@ -224,6 +443,45 @@ def chain(cosmo, data, command_line):
     ## Initialisation
     loglike = 0
 
+    # Store the results of the cosmological module for post-processing, if
+    # asked
+    if command_line.store_evaluations:
+        data.evaluation_store = io_mp.EvaluationStore(command_line.folder)
+
+    # The costs of the different likelihoods are measured to tune the blocks
+    # of the fast jumping method
+    tuning = command_line.tune_blocks > 0 and command_line.jumping == 'fast'
+    if command_line.tune_blocks and not tuning:
+        warnings.warn(
+            "The blocks can only be tuned with the fast jumping method. The "
+            "option --tune-blocks will be ignored.")
+    if tuning:
+        data.profiler.enabled = True
+
+    # Dragging of the fast parameters along the slow proposals
+    dragging = command_line.drag > 0 and command_line.jumping == 'fast'
+    if command_line.drag and not dragging:
+        warnings.warn(
+            "The fast parameters can only be dragged with the fast jumping "
+            "method. The option --drag will be ignored.")
+    elif dragging and len(data.block_parameters) < 2:
+        warnings.warn(
+            "There are no varying nuisance parameters to drag. The option "
+            "--drag will be ignored.")
+        dragging = False
+    if dragging:
+        if command_line.method == 'DA' or command_line.speculative > 1:
+            raise io_mp.ConfigurationError(
+                "The dragging of the fast parameters can not be used with "
+                "the delayed-acceptance method or the speculative "
+                "evaluation of the proposals.")
+        extra_cosmo = drag_cosmo = type(cosmo)()
+        drag_key = None
+    dragged = False
+    # Value of every likelihood at the last accepted point, used by the
+    # dragging (unknown when resuming from a checkpoint)
+    accepted = None
+
     # In case command_line.silent has been asked, outputs should only contain
     # data.out. Otherwise, it will also contain sys.stdout
     outputs = [data.out]
@@ -240,6 +498,7 @@ def chain(cosmo, data, command_line):
             command_line.quiet = True
     except ImportError:
         # set all chains to master if no MPI
+        comm = None
         rank = 0
 
     # Recover the covariance matrix according to the input, if the varying set
@@ -270,40 +529,101 @@ def chain(cosmo, data, command_line):
     Cholesky = None
     Rotation = None
     if command_line.jumping == 'fast':
-        Cholesky = la.cholesky(C).T
+        Cholesky = compute_cholesky(data, C)
         Rotation = np.identity(len(sigma_eig))
 
-    # If the update mode was selected, the previous (or original) matrix should be stored
+    # If the update mode was selected, the previous (or original) matrix should
+    # be stored
     if command_line.update:
         previous = (sigma_eig, U, C, Cholesky)
 
-    # If restart wanted, pick initial value for arguments
-    if command_line.restart is not None:
-        sampler.read_args_from_chain(data, command_line.restart)
-
-    # If restart from best fit file, read first point (overwrite settings of
-    # read_args_from_chain)
-    if command_line.bf is not None:
-        sampler.read_args_from_bestfit(data, command_line.bf)
-
-    # Pick a position (from last accepted point if restart, from the mean value
-    # else), with a 100 tries.
-    for i in range(100):
-        if get_new_position(data, sigma_eig, U, i,
-                            Cholesky, Rotation) is True:
-            break
-        if i == 99:
-            raise io_mp.ConfigurationError(
-                "You should probably check your prior boundaries... because " +
-                "no valid starting position was found after 100 tries")
+    # The running statistics of the accepted points are kept to compute the
+    # new proposal density, or to monitor the convergence (see
+    # :mod:`statistics_mp`)
+    keep_statistics = command_line.update or command_line.converge
+    if keep_statistics:
+        parameter_names = data.get_mcmc_parameters(['varying'])
+        statistics = statistics_mp.WeightedStatistics(
+            len(parameter_names), subchains=3)
+    if command_line.converge and (comm is None or comm.Get_size() < 2):
+        warnings.warn(
+            "The convergence can only be monitored when running several "
+            "chains with MPI. The option --converge will be ignored.")
+
+    # If the restart chain has a checkpoint, its whole state is recovered, and
+    # the chain is resumed instead of starting again from its last point
+    store = data.parameter_store
+    resume = None
+    if command_line.restart is not None and os.path.isfile(
+            io_mp.checkpoint_path(command_line.restart)):
+        resume = io_mp.read_checkpoint(command_line.restart)
+        names = [store.names[i] for i in store.output_indices]
+        store.set_current(resume['current'][store.output_indices], names)
+        store.set_last_accepted(
+            resume['last_accepted'][store.output_indices], names)
+        data.update_cosmo_arguments()
+        for likelihood in data.lkl.itervalues():
+            likelihood.backup_value = resume['backup_values'][likelihood.name]
+        data.random_numbers = resume['random_numbers']
+        loglike, max_loglike = resume['loglike'], resume['max_loglike']
+        command_line.N = resume['steps']
+        (data.block_order, data.block_parameters, data.over_sampling,
+         data.over_sampling_indices) = resume['blocks']
 
-    # Compute the starting Likelihood
-    loglike = sampler.compute_lkl(cosmo, data)
+    else:
+        # If restart wanted, pick initial value for arguments
+        if command_line.restart is not None:
+            sampler.read_args_from_chain(data, command_line.restart)
+
+        # If restart from best fit file, read first point (overwrite settings
+        # of read_args_from_chain)
+        if command_line.bf is not None:
+            sampler.read_args_from_bestfit(data, command_line.bf)
+
+        # Pick a position (from last accepted point if restart, from the mean
+        # value else), with a 100 tries.
+        for i in range(100):
+            if get_new_position(data, sigma_eig, U, i,
+                                Cholesky, Rotation) is True:
+                break
+            if i == 99:
+                raise io_mp.ConfigurationError(
+                    "You should probably check your prior boundaries... " +
+                    "because no valid starting position was found after " +
+                    "100 tries")
 
-    # Choose this step as the last accepted value
-    # (accept_step), and modify accordingly the max_loglike
-    sampler.accept_step(data)
-    max_loglike = loglike
+        # Compute the starting Likelihood
+        loglike = sampler.compute_lkl(cosmo, data)
+
+        # Choose this step as the last accepted value
+        # (accept_step), and modify accordingly the max_loglike
+        sampler.accept_step(data)
+        max_loglike = loglike
+        if dragging:
+            accepted = dict((likelihood.name, likelihood.backup_value)
+                            for likelihood in data.lkl.itervalues())
+
+    # In delayed-acceptance mode, the approximate log-likelihood is centered
+    # on the starting point, until the first update of the proposal
+    delayed = command_line.method == 'DA'
+    if delayed:
+        surrogate = statistics_mp.QuadraticApproximation(
+            store.get_last_accepted(), C)
+        surrogate_loglike = surrogate(store.get_last_accepted())
+        screened = 0
+
+    # In speculative mode, start the worker processes, that inherit the
+    # initialised data instance
+    speculative = command_line.speculative > 1 and data.jumping_factor != 0
+    if speculative:
+        if delayed:
+            raise io_mp.ConfigurationError(
+                "The speculative evaluation of the proposals can not be used "
+                "with the delayed-acceptance method.")
+        pool = Pool(command_line.speculative, sampler.initialise_worker,
+                    (data, type(cosmo)))
+        pending = []
+        discarded = 0
 
     # If the jumping factor is 0, the likelihood associated with this point is
     # displayed, and the code exits.
@@ -331,105 +651,305 @@ def chain(cosmo, data, command_line):
     command_line.quiet = True
 
     k = 1
+
+    # Recover the state of the sampler from the checkpoint
+    if resume is not None:
+        k, N, acc, rej = resume['k'], resume['N'], resume['acc'], resume['rej']
+        sigma_eig, U, C, Cholesky, Rotation = resume['proposal']
+        if command_line.update:
+            previous = resume['previous']
+        if keep_statistics:
+            statistics = resume['statistics']
+        if delayed:
+            surrogate, surrogate_loglike, screened = resume['surrogate']
+        if speculative:
+            discarded = resume['discarded']
+        if tuning and k > command_line.tune_blocks:
+            tuning = False
+            data.profiler.enabled = command_line.profile is not None
+        if not command_line.silent:
+            print 'Resuming the chain at step %d' % k
+    next_checkpoint = k+command_line.checkpoint
+
+    # With MPI, the chains exchange their statistics at given steps, with
+    # collective operations that every chain must call at the same time. All
+    # the chains then write their checkpoints at the same step, and must be
+    # resumed from the same step.
+    synchronised = keep_statistics and comm is not None and \
+        comm.Get_size() > 1
+    if synchronised and len(set(comm.allgather(k))) > 1:
+        raise io_mp.ConfigurationError(
+            "The chains were not all checkpointed at the same step, and can "
+            "not be resumed together with --update or --converge. Please "
+            "restart them from their last points, after having removed their "
+            ".checkpoint files.")
+
+    # Otherwise, the chains of the folder updating their proposal exchange
+    # their statistics through files, only read while the chain holds a lock
+    statistics_lock = None
+    if command_line.update and not synchronised:
+        statistics_lock = io_mp.lock_statistics(data.out_name)
+
     # Main loop, that goes on while the maximum number of failure is not
     # reached, and while the expected amount of steps (N) is not taken.
     while k <= command_line.N:
 
+        # Regularly write the complete state of the chain, after having forced
+        # the points already accepted to the disk. In speculative mode, this
+        # is done when no proposal is pending, as they already used random
+        # numbers, except for synchronised chains, which discard them.
+        if (command_line.checkpoint and k >= next_checkpoint and
+                (synchronised or not (speculative and pending))):
+            if speculative and pending:
+                discarded += len(pending)
+                pending = []
+            data.out.flush()
+            os.fsync(data.out.fileno())
+            state = {
+                'steps': command_line.N, 'k': k, 'N': N, 'acc': acc,
+                'rej': rej, 'loglike': loglike, 'max_loglike': max_loglike,
+                'proposal': (sigma_eig, U, C, Cholesky, Rotation),
+                'current': store.current,
+                'last_accepted': store.last_accepted,
+                'backup_values': dict(
+                    (likelihood.name, likelihood.backup_value)
+                    for likelihood in data.lkl.itervalues()),
+                'random_numbers': data.random_numbers,
+                'blocks': (data.block_order, data.block_parameters,
+                           data.over_sampling, data.over_sampling_indices),
+                'chain_size': os.fstat(data.out.fileno()).st_size}
+            if command_line.update:
+                state['previous'] = previous
+            if keep_statistics:
+                state['statistics'] = statistics
+            if delayed:
+                state['surrogate'] = (surrogate, surrogate_loglike, screened)
+            if speculative:
+                state['discarded'] = discarded
+            io_mp.write_checkpoint(
+                data.out_name, state, comm if synchronised else None)
+            next_checkpoint = k+command_line.checkpoint
+
+        # Once the costs have been measured, order the blocks and choose
+        # their over-sampling
+        if tuning and k > command_line.tune_blocks:
+            tuning = False
+            timings = data.profiler.timings
+            if 'cosmo.compute' not in timings:
+                warnings.warn(
+                    "The cost of the cosmological module was not measured "
+                    "(with --speculative, it is computed in the worker "
+                    "processes). The blocks will not be tuned.")
+            else:
+                cosmo_cost = sum([data.profiler.mean(stage) for stage in (
+                    'cosmo.set', 'cosmo.compute', 'cosmo.struct_cleanup')])
+                likelihood_costs = dict(
+                    (name, data.profiler.mean('loglkl '+name))
+                    for name in data.lkl)
+                data.tune_blocks(cosmo_cost, likelihood_costs)
+                Cholesky = compute_cholesky(data, C)
+                if command_line.update:
+                    previous = (sigma_eig, U, C, Cholesky)
+                if speculative:
+                    discarded += len(pending)
+                    pending = []
+                io_mp.log_block_tuning(data, command_line)
+                if not command_line.silent:
+                    print 'Step %d: over-sampling of the blocks set to %s' % (
+                        k, data.over_sampling)
+            data.profiler.enabled = command_line.profile is not None
+
         # If the number of steps reaches the number set in the update method,
         # then the proposal distribution should be adapted.
-        if command_line.update:
-
-            # master chain behavior
-            if not rank:
-                # Add the folder to the list of files to analyze, and switch on the
-                # options for computing only the covmat
-                from parser_mp import parse
-                info_command_line = parse(
-                    'info %s --minimal --noplot --keep-fraction 0.5 --keep-non-markovian --want-covmat' % command_line.folder)
-                info_command_line.update = command_line.update
-                # the +10 below is here to ensure that the first master update will take place before the first slave updates,
-                # but this is a detail, the code is robust against situations where updating is not possible, so +10 could be omitted
-                if not (k+10) % command_line.update and k > 10:
-                    # Try to launch an analyze
-                    try:
-                        from analyze import analyze
-                        R_minus_one = analyze(info_command_line)
-                    except:
-                        if not command_line.silent:
-                            print 'Step ',k,' chain ', rank,': Failed to calculate covariant matrix'
-                        pass
-
-                if not (k-1) % command_line.update:
-                    try:
-                        # Read the covmat
-                        sigma_eig, U, C = sampler.get_covariance_matrix(
-                            cosmo, data, command_line)
-                        if command_line.jumping == 'fast':
-                            Cholesky = la.cholesky(C).T
-                        # Test here whether the covariance matrix has really changed
-                        # We should in principle test all terms, but testing the first one should suffice
-                        if not C[0,0] == previous[2][0,0]:
-                            previous = (sigma_eig, U, C, Cholesky)
-                            if k == 1:
-                                if not command_line.silent:
-                                    if not input_covmat == None:
-                                        warnings.warn(
-                                            'Appending to an existing folder: using %s instead of %s. '
-                                            'If new input covmat is desired, please delete previous covmat.'
-                                            % (command_line.cov, input_covmat))
-                                    else:
-                                        warnings.warn(
-                                            'Appending to an existing folder: using %s. '
-                                            'If no starting covmat is desired, please delete previous covmat.'
-                                            % command_line.cov)
-                            else:
-                                data.out.write('# After %d accepted steps: update proposal with max(R-1) = %f \n' % (int(acc), max(R_minus_one)))
-                                if not command_line.silent:
-                                    print 'After %d accepted steps: update proposal with max(R-1) = %f \n' % (int(acc), max(R_minus_one))
-                                try:
-                                    if stop-after-update:
-                                        k = command_line.N
-                                        print 'Covariant matrix updated - stopping run'
-                                except:
-                                    pass
-
-                    except:
-                        pass
-
-                    command_line.quiet = True
-
-            # slave chain behavior
+        if command_line.update and not (k-1) % command_line.update:
+            # The proposals already drawn used the previous proposal density
+            if speculative:
+                discarded += len(pending)
+                pending = []
+            # At the first step, use the covariance matrix stored in the
+            # folder by a previous run, if any
+            if k == 1:
+                try:
+                    sigma_eig, U, C = sampler.get_covariance_matrix(
+                        cosmo, data, command_line)
+                    if command_line.jumping == 'fast':
+                        Cholesky = compute_cholesky(data, C)
+                    # Test here whether the covariance matrix has really
+                    # changed We should in principle test all terms, but
+                    # testing the first one should suffice
+                    if not C[0, 0] == previous[2][0, 0] and \
+                            not command_line.silent and not rank:
+                        if not input_covmat == None:
+                            warnings.warn(
+                                'Appending to an existing folder: using %s '
+                                'instead of %s. If new input covmat is '
+                                'desired, please delete previous covmat.'
+                                % (command_line.cov, input_covmat))
+                        else:
+                            warnings.warn(
+                                'Appending to an existing folder: using %s. '
+                                'If no starting covmat is desired, please '
+                                'delete previous covmat.' % command_line.cov)
+                    previous = (sigma_eig, U, C, Cholesky)
+                    if delayed:
+                        surrogate = statistics_mp.QuadraticApproximation(
+                            store.get_last_accepted(), C)
+                        surrogate_loglike = surrogate(
+                            store.get_last_accepted())
+                except:
+                    pass
             else:
-                if not (k-1) % command_line.update:
+                # Put together the running statistics of the second half of
+                # all the chains. With MPI, this is a collective operation,
+                # done at the same step by all the processes. Otherwise, the
+                # chains of the same folder exchange their statistics through
+                # files.
+                recent = statistics.recent(0.5)
+                statistics.mark()
+                if comm is not None and comm.Get_size() > 1:
+                    chains = statistics_mp.gather(recent, comm)
+                else:
+                    io_mp.write_statistics(data.out_name, recent)
+                    chains = [recent] + [
+                        statistics_mp.WeightedStatistics.from_state(state)
+                        for state in io_mp.read_statistics(
+                            command_line.folder, data.out_name)
+                        if len(state[2]) == len(parameter_names)]
+                # With a single chain, the convergence is estimated from
+                # three subchains
+                R_minus_one = statistics_mp.gelman_rubin(chains)
+                if R_minus_one is None:
+                    R_minus_one = statistics_mp.gelman_rubin(recent.subchains)
+                total = statistics_mp.combine(chains)
+                # Do not update when the convergence is too bad or too good
+                if R_minus_one is not None and (
+                        np.amax(R_minus_one) > 3. or
+                        np.amax(R_minus_one) < 0.4):
+                    if not command_line.silent and not rank:
+                        print 'Step ', k, ': Not updating the proposal'
+                elif total.points > len(total.mean):
                     try:
-                        sigma_eig, U, C = sampler.get_covariance_matrix(
-                            cosmo, data, command_line)
+                        C_new = total.covariance()
+                        sigma_eig_new, U_new = np.linalg.eig(
+                            np.linalg.inv(C_new))
                         if command_line.jumping == 'fast':
-                            Cholesky = la.cholesky(C).T
-                        # Test here whether the covariance matrix has really changed
-                        # We should in principle test all terms, but testing the first one should suffice
-                        if not C[0,0] == previous[2][0,0] and not k == 1:
-                            data.out.write('# After %d accepted steps: update proposal \n' % int(acc))
-                            if not command_line.silent:
-                                print 'After %d accepted steps: update proposal \n' % int(acc)
-                            try:
-                                if stop_after_update:
-                                    k = command_line.N
-                                    print 'Covariant matrix updated - stopping run'
-                            except:
-                                pass
-                        previous = (sigma_eig, U, C, Cholesky)
-
-                    except:
-                        pass
+                            Cholesky = compute_cholesky(data, C_new)
+                        sigma_eig, U, C = sigma_eig_new, U_new, C_new
+                        if delayed:
+                            surrogate = statistics_mp.QuadraticApproximation(
+                                total.mean, C)
+                            surrogate_loglike = surrogate(
+                                store.get_last_accepted())
+                    except (np.linalg.LinAlgError, ValueError):
+                        if not command_line.silent:
+                            print 'Step ', k, ' chain ', rank,
+                            print ': Failed to calculate covariant matrix'
+                    else:
+                        if R_minus_one is not None:
+                            message = (
+                                'After %d accepted steps: update proposal '
+                                'with max(R-1) = %f \n' % (
+                                    int(acc), max(R_minus_one)))
+                        else:
+                            message = (
+                                'After %d accepted steps: update proposal \n'
+                                % int(acc))
+                        data.out.write('# ' + message)
+                        if not command_line.silent:
+                            print message
+                        # Store the new covariance matrix in the folder, for
+                        # further runs
+                        if not rank:
+                            scales = np.diag(
+                                [data.mcmc_parameters[name]['scale']
+                                 for name in parameter_names])
+                            io_mp.write_covariance_matrix(
+                                np.dot(scales, np.dot(C, scales)),
+                                parameter_names, command_line.cov)
+                        if command_line.stop_after_update:
+                            k = command_line.N
+                            print 'Covariant matrix updated - stopping run'
+
+        # Monitor the convergence of all the chains, and stop them all at the
+        # same step once the Gelman-Rubin criterion is below the threshold. It
+        # is only computed once every chain is out of its burn-in.
+        if (command_line.converge and k > 1 and
+                not (k-1) % command_line.converge_step):
+            R_minus_one = statistics_mp.gelman_rubin(
+                statistics_mp.gather(statistics, comm), require_all=True)
+            if R_minus_one is not None:
+                data.out.write('# After %d accepted steps: R-1 = %s\n' % (
+                    int(acc), ' '.join(['%.6f' % R for R in R_minus_one])))
+                if np.amax(R_minus_one) < command_line.converge:
+                    k = command_line.N
+                    if not command_line.silent and not rank:
+                        print 'Convergence reached, with max(R-1) = %f' % (
+                            np.amax(R_minus_one)) + ' - stopping all chains'
+
+        # In delayed-acceptance mode, keep the last computed point, to restore
+        # it if the proposal is screened out without computation
+        if delayed:
+            computed_vector = store.current[store.varying_indices].copy()
+
+        # In speculative mode, recover the result of the next proposal, drawn
+        # and evaluated in advance. Proposals outside of the boundaries are
+        # rejected, as below.
+        correction = 0
+        if speculative:
+            if not pending:
+                pending = speculate(
+                    pool, data, sigma_eig, U, k, Cholesky, Rotation,
+                    min(command_line.speculative, command_line.N-k+1))
+            vector, result = pending.pop(0)
+            if result is None:
+                rej += 1
+                N += 1
+                k += 1
+                continue
+            newloglike, derived, values = result.get()
+            # The values of the likelihoods at the current point are used by
+            # the next steps changing only some nuisance parameters, and
+            # stored in the checkpoints
+            store.set_current(vector)
+            store.set_current(derived, store.derived_names)
+            for likelihood in data.lkl.itervalues():
+                likelihood.backup_value = values[likelihood.name]
 
         # Pick a new position ('current' flag in mcmc_parameters), and compute
         # its likelihood. If get_new_position returns True, it means it did not
         # encounter any boundary problem. Otherwise, just increase the
         # multiplicity of the point and start the loop again
-        if get_new_position(
+        elif get_new_position(
                 data, sigma_eig, U, k, Cholesky, Rotation) is True:
-            newloglike = sampler.compute_lkl(cosmo, data)
+            # First stage of the delayed acceptance, for the proposals
+            # changing the cosmology (the others are cheap to compute): the
+            # proposal is accepted with the probability given by the
+            # approximate log-likelihood, and only then computed.
+            vector = store.current[store.varying_indices]
+            if delayed and (
+                    vector[store.cosmo_positions] !=
+                    store.get_last_accepted()[store.cosmo_positions]).any():
+                correction = surrogate(vector)-surrogate_loglike
+                if correction < 0 and \
+                        data.random_numbers.uniform() >= np.exp(correction):
+                    store.set_current(computed_vector)
+                    data.update_cosmo_arguments()
+                    screened += 1
+                    rej += 1
+                    N += 1
+                    k += 1
+                    continue
+            # A slow proposal drags the fast parameters along, and is accepted
+            # with the ratio of the dragging, through the correction
+            dragged = dragging and data.over_sampling_indices[
+                k % len(data.over_sampling_indices)] < data.block_parameters[0]
+            if dragged:
+                newloglike, log_ratio, drag_key = drag(
+                    cosmo, drag_cosmo, drag_key, data, loglike, accepted,
+                    Cholesky, command_line.drag)
+                correction = newloglike-loglike-log_ratio
+            else:
+                newloglike = sampler.compute_lkl(cosmo, data)
         else:  # reject step
             rej += 1
             N += 1
@@ -437,44 +957,76 @@ def chain(cosmo, data, command_line):
             continue
 
         # Harmless trick to avoid exponentiating large numbers. This decides
-        # whether or not the system should move.
+        # whether or not the system should move. In delayed-acceptance mode,
+        # the ratio is divided by the one of the first stage.
         if (newloglike != data.boundary_loglike):
-            if (newloglike >= loglike):
+            if (newloglike-correction >= loglike):
                 alpha = 1.
             else:
-                alpha = np.exp(newloglike-loglike)
+                alpha = np.exp(newloglike-correction-loglike)
         else:
             alpha = -1
 
-        if ((alpha == 1.) or (rd.uniform(0, 1) < alpha)):  # accept step
+        if ((alpha == 1.) or
+                (data.random_numbers.uniform() < alpha)):  # accept step
 
             # Print out the last accepted step (WARNING: this is NOT the one we
             # just computed ('current' flag), but really the previous one.)
             # with its proper multiplicity (number of times the system stayed
             # there).
+            start = data.profiler.start()
             io_mp.print_vector(outputs, N, loglike, data)
+            data.profiler.stop('output', start)
+            if keep_statistics:
+                statistics.add(
+                    data.parameter_store.get_last_accepted(), N, -loglike)
 
             # Report the 'current' point to the 'last_accepted'
             sampler.accept_step(data)
             loglike = newloglike
+            # The accepted cosmology is held by the second instance
+            if dragged:
+                cosmo, drag_cosmo = drag_cosmo, cosmo
+                data.cosmo_cache.computed_key, drag_key = (
+                    drag_key, data.cosmo_cache.computed_key)
+            if dragging:
+                accepted = dict((likelihood.name, likelihood.backup_value)
+                                for likelihood in data.lkl.itervalues())
+            if delayed:
+                surrogate_loglike = surrogate(store.get_last_accepted())
             if loglike > max_loglike:
                 max_loglike = loglike
             acc += 1.0
             N = 1  # Reset the multiplicity
 
+            # The other proposals were drawn around the previous point
+            if speculative:
+                discarded += len(pending)
+                pending = []
+
         else:  # reject step
             rej += 1.0
             N += 1  # Increase multiplicity of last accepted point
 
-        # Regularly (option to set in parameter file), close and reopen the
-        # buffer to force to write on file.
+        # Regularly (option to set in parameter file), force the buffer to
+        # be written on file.
         if acc % data.write_step == 0:
+            start = data.profiler.start()
             io_mp.refresh_file(data)
-            # Update the outputs list
-            outputs[0] = data.out
+            data.profiler.stop('output', start)
+
+        # Regularly write the summary of the timings, if asked
+        if command_line.profile and not k % command_line.profile:
+            io_mp.write_profile(data)
         k += 1  # One iteration done
     # END OF WHILE LOOP
 
+    if speculative:
+        pool.close()
+        pool.join()
+    if dragging and extra_cosmo.state:
+        extra_cosmo.struct_cleanup()
+
     # If at this moment, the multiplicity is higher than 1, it means the
     # current point is not yet accepted, but it also mean that we did not print
     # out the last_accepted one yet. So we do.
@@ -485,6 +1037,22 @@ def chain(cosmo, data, command_line):
     rate = acc / (acc + rej)
     sys.stdout.write('\n#  {0} steps done, acceptance rate: {1}\n'.
                      format(command_line.N, rate))
+    if not command_line.silent:
+        if data.cosmo_cache.size > 0:
+            sys.stdout.write('#  cosmological models found in cache: {0} '
+                             '(missed: {1})\n'.format(
+                                 data.cosmo_cache.hits,
+                                 data.cosmo_cache.misses))
+        if speculative:
+            sys.stdout.write('#  speculative evaluations discarded: '
+                             '{0}\n'.format(discarded))
+        if delayed:
+            sys.stdout.write('#  proposals rejected without computation: '
+                             '{0}\n'.format(screened))
+    if command_line.profile is not None:
+        io_mp.write_profile(data)
+        if not command_line.silent:
+            sys.stdout.write(data.profiler.summary(data.cosmo_cache))
 
     # In case the acceptance rate is too low, or too high, print a warning
     if rate < 0.05:
@@ -498,10 +1066,18 @@ def chain(cosmo, data, command_line):
                       "covariance matrix to decrease the acceptance rate to a "
                       "value between 0.2 and 0.4 (roughly).")
 
+    # The chain is complete, its checkpoint and its statistics are not needed
+    # any more
+    if os.path.isfile(io_mp.checkpoint_path(data.out_name)):
+        os.remove(io_mp.checkpoint_path(data.out_name))
+    if statistics_lock is not None:
+        io_mp.remove_statistics(data.out_name, statistics_lock)
+
     # For a restart, erase the starting point to keep only the new, longer
-    # chain.
-    if command_line.restart is not None:
+    # chain. A resumed chain was extended in place.
+    if command_line.restart is not None and resume is None:
         os.remove(command_line.restart)
+        io_mp.remove_statistics(command_line.restart)
         sys.stdout.write('    deleting starting point of the chain {0}\n'.
                          format(command_line.restart))
 
@@ -262,8 +262,8 @@ def run(cosmo, data, command_line):
 
         """
         # Updates values: cube --> data
-        for i, name in zip(range(ndim), NS_param_names):
-            data.mcmc_parameters[name]['current'] = cube[i]
+        data.parameter_store.set_current(
+            [cube[i] for i in range(ndim)], NS_param_names[:ndim])
         # Propagate the information towards the cosmo arguments
         data.update_cosmo_arguments()
         lkl = sampler.compute_lkl(cosmo, data)
@@ -379,14 +379,31 @@ def create_parser():
             <++>sampling method<++>, by default 'MH' for Metropolis-Hastings,
             can be set to 'NS' for Nested Sampling (using Multinest wrapper
             PyMultiNest), 'CH' for Cosmo Hammer (using the Cosmo Hammer wrapper
-            to emcee algorithm), and finally 'IS' for importance sampling.
+            to emcee algorithm), 'IS' for importance sampling, and finally
+            'DA' for a delayed-acceptance Metropolis-Hastings, where the
+            proposals are first screened with a Gaussian approximation of the
+            likelihood, built from the proposal covariance matrix, before
+            being computed. It is worth using with a good covariance matrix
+            and with `--update`.
 
             Note that when running with Importance sampling, you need to
             specify a folder to start from.<++>
         <**>--update<**> : int
             <++>update frequency for Metropolis Hastings.<++>
             If greater than zero, number of steps after which the proposal covariance
-            matrix is updated automatically (*OPT*).<++>
+            matrix is updated automatically (*OPT*).
+
+            The covariance matrix is computed from the running statistics of
+            the accepted points of all the chains, after removal of the
+            burn-in, and written to the output folder. As with `info
+            --keep-fraction 0.5`, only the last half of every chain is used,
+            counted from the previous updates. The chains of an MPI run are
+            gathered with MPI, while separate runs in the same folder read the
+            statistics that every chain writes next to it, in a .statistics
+            file, removed when the chain ends. Those of the chains not
+            running any more are ignored. The proposal is not updated when R-1
+            is above 3 or below 0.4 for some parameter, R-1 being computed
+            from three subchains for a single chain.<++>
         <**>-f<**> : float
             <++>jumping factor<++> (>= 0, default to 2.4) (*OPT*).
 
@@ -427,13 +444,40 @@ def create_parser():
             stage (*OPT*).
 
             At the beginning of the run, the previous chain will be deleted,
-            and its content transfered to the beginning of the new chain.<++>
+            and its content transfered to the beginning of the new chain.
+
+            If the chain was run with `--checkpoint`, and was interrupted, it
+            is instead resumed exactly from its last checkpoint: the new
+            points are appended to the same file, until the number of steps
+            initially asked is reached. With MPI, give the chain of the
+            process of rank 0: the process of rank r resumes the chain whose
+            number is larger by r.<++>
         <**>-b<**> : str
             <++>start a new chain from the bestfit file<++> computed with
             analyze.  (*OPT*)<++>
         <**>--fisher<**> : None
             <++>Calculates the inverse of the fisher matrix<++> to use as
-            proposal distribution<++>
+            proposal distribution.
+
+            The points needed by the finite differences are evaluated only
+            once, shared between the chains when running with MPI, or
+            between the processes set by `--fisher-processes` otherwise. They
+            are written to the file `fisher_points.txt` of the output folder,
+            so that an interrupted computation can be resumed, along with a
+            fingerprint of the configuration (the `log.param` and the
+            fiducial files of the likelihoods): the file is ignored if the
+            configuration changed in between. It is removed once the Fisher
+            matrix is written.<++>
+        <**>--fisher-processes<**> : int
+            <++>number of processes computing the Fisher matrix<++>
+            (*OPT*).
+
+            Each of them has its own instance of the cosmological module, so
+            that, if this module is itself parallelised with OpenMP, the
+            product of this number with `OMP_NUM_THREADS` should not exceed
+            the number of cores. Defaults to the number of cores divided by
+            `OMP_NUM_THREADS`, or to 1 if this variable is not set. Ignored
+            when running with MPI.<++>
         <**>--silent<**> : None
             <++>silence the standard output<++> (useful when running on
             clusters)<++>
@@ -457,6 +501,124 @@ def create_parser():
         <**>--display-each-chi2<**> : bool
             <++>Shows the effective chi2 from each likelihood and the total.<++>
             Useful e.g. if you run at the bestfit point with -f 0 (flag)<++>
+        <**>--converge<**> : float
+            <++>stop all the chains once converged<++>, i.e. when the
+            Gelman-Rubin criterion R-1 is below this value for all the
+            parameters (*OPT*).
+
+            Only relevant when running several chains with MPI. The criterion
+            is computed on the fly from the running statistics of the chains,
+            and written in the chains.<++>
+        <**>--converge-step<**> : int
+            <++>number of steps between two convergence checks<++> with
+            the option `--converge` (default to 100) (*OPT*).<++>
+        <**>--cosmo-cache<**> : int
+            <++>number of cosmological models kept in memory<++> (default to
+            0, no cache) (*OPT*).
+
+            For each of them, the last values of the likelihoods and the
+            derived parameters are stored, so that the cosmological module is
+            not called again when coming back to a known point.<++>
+        <**>--speculative<**> : int
+            <++>number of worker processes evaluating the next proposals<++>
+            in advance (*OPT*).
+
+            The chain draws the next proposals assuming that they are
+            rejected, and evaluates them at the same time, each worker having
+            its own instance of the cosmological module. The results are used
+            in order, and the ones after an accepted point are discarded, so
+            that the chain is statistically identical to the serial one.
+            Works best with the `global` jumping method, since consecutive
+            fast steps do not share the cosmological module any more.<++>
+        <**>--store-evaluations<**> : None
+            <++>store the results of the cosmological module<++> for every
+            computed point, in the file `evaluations.bin` of the output folder
+            (*OPT*).
+
+            Importance Sampling (`-m IS`) and the addition of derived
+            parameters (`-m Der`) look up this file before calling the
+            cosmological module again.<++>
+        <**>--store-derived<**> : str
+            <++>additional derived parameters to store<++> with
+            `--store-evaluations`, so that they can later be added to the
+            chains without computation (*OPT*).<++>
+        <**>--store-spectra<**> : None
+            <++>also store the lensed and unlensed spectra<++> with
+            `--store-evaluations`, so that importance sampling with CMB
+            likelihoods can be done without computation (*OPT*).<++>
+        <**>--profile<**> : int
+            <++>time the different stages of the computation<++> (*OPT*).
+
+            The time spent in the cosmological module (`set`, `compute`,
+            `struct_cleanup`), in every likelihood, in the extraction of the
+            derived parameters, in the proposal and in the writing of the
+            chain is recorded. A summary, with the mean and percentiles of
+            the cost of a call, the fraction of steps that did not need the
+            cosmological module and the hit rate of the cache, is written
+            next to the chain, with the extension `.profile`, at the end of
+            the run, and every given number of steps if specified.<++>
+        <**>--checkpoint<**> : int
+            <++>number of steps between two checkpoints<++> of the chain
+            (*OPT*).
+
+            The complete state of the sampler is written to a `.checkpoint`
+            file next to the chain, allowing to resume it exactly with `-r`
+            after an interruption. It is removed when the chain is
+            complete.<++>
+        <**>--chain-format<**> : str
+            <++>format of the chains<++>, `text` or `binary` (*OPT*).
+
+            Overrides `data.chain_format` from the parameter file, `text` by
+            default. Binary chains store the points without loss of
+            precision, are written by a background thread, and are read
+            transparently by the analysis, importance sampling, addition of
+            derived parameters, and restarts.<++>
+        <**>--drag<**> : int
+            <++>number of updates of the fast parameters dragged along every
+            slow proposal<++> (*OPT*).
+
+            With the fast jumping method, every proposal of the cosmological
+            parameters is computed with a second instance of the
+            cosmological module, and the fast parameters are updated the
+            given number of times along a path interpolating between the old
+            and the new cosmology, before the proposal is accepted or
+            rejected (Neal 2005, `arXiv:math/0502099
+            <http://arxiv.org/abs/math/0502099>`_). This decorrelates the
+            fast parameters from the slow ones, at the cost of computing
+            twice, for every update, the likelihoods depending on the
+            updated block of fast parameters.<++>
+        <**>--tune-blocks<**> : int
+            <++>number of steps used to measure the cost of the
+            likelihoods<++> and tune the blocks of the fast jumping method
+            (*OPT*).
+
+            After these steps, the blocks of nuisance parameters are ordered
+            from the slowest likelihood to the fastest, and their
+            over-sampling is chosen so that the time spent on every block is
+            similar to the time spent on the cosmological parameters, see
+            Lewis 2013 (`arXiv:1304.4473 <http://arxiv.org/abs/1304.4473>`_).
+            The result is logged to log.param, and replaces the over-sampling
+            of the parameter file. Only used with `-j fast`.<++>
+        <**>--likelihood-threads<**> : int
+            <++>number of threads computing the likelihoods<++> (*OPT*).
+
+            When more than one, the likelihoods declared thread safe (see
+            :class:`likelihood_class.Likelihood`) are computed concurrently in
+            a pool of threads, the others in the main one. Their values are
+            added in the usual order, so that the result is identical to the
+            one of a serial computation. This pays off when several
+            likelihoods spend their time in numpy, scipy or compiled
+            libraries, that release the GIL. Defaults to 0, for a serial
+            computation.<++>
+        <**>--seed<**> : int
+            <++>seed of the random number generator<++> of the chain (*OPT*).
+
+            If not specified, a seed is drawn from the system entropy. In both
+            cases, it is written at the top of the chain, and in the
+            `log.param`. The number of the chain minus one is added to a given
+            seed, so that the chains of an MPI run, or of several runs in the
+            same folder, are different, and each of them can be
+            reproduced.<++>
 
         For Nested Sampling and Cosmo Hammer arguments, see
         :mod:`nested_sampling` and :mod:`cosmo_hammer`.
@@ -605,7 +767,7 @@ def create_parser():
     # -- sampling method (OPTIONAL)
     runparser.add_argument('-m', '--method', help=helpdict['m'],
                            dest='method', default='MH',
-                           choices=['MH', 'NS', 'CH', 'IS', 'Der'])
+                           choices=['MH', 'DA', 'NS', 'CH', 'IS', 'Der'])
     # -- update Metropolis Hastings (OPTIONAL)
     runparser.add_argument('--update', help=helpdict['update'], type=int,
                            default=0)
@@ -615,6 +777,10 @@ def create_parser():
     # -- fisher (EXPERIMENTAL)
     runparser.add_argument('--fisher', help=helpdict['fisher'],
                            action='store_true')
+    # -- number of processes computing the fisher matrix (OPTIONAL)
+    runparser.add_argument('--fisher-processes',
+                           help=helpdict['fisher-processes'], type=int,
+                           dest='fisher_processes', default=None)
     # -- configuration file (OPTIONAL)
     runparser.add_argument('--conf', help=helpdict['conf'],
                            type=str, dest='config_file',
@@ -627,6 +793,50 @@ def create_parser():
     # display option
     runparser.add_argument('--display-each-chi2', help=helpdict['display-each-chi2'],
                            dest='display_each_chi2', action='store_true')
+    # -- stop the chains once converged (OPTIONAL)
+    runparser.add_argument('--converge', help=helpdict['converge'],
+                           type=float, default=0)
+    runparser.add_argument('--converge-step', help=helpdict['converge-step'],
+                           type=positive_int, dest='converge_step',
+                           default=100)
+    # -- size of the cache of cosmological models (OPTIONAL)
+    runparser.add_argument('--cosmo-cache', help=helpdict['cosmo-cache'],
+                           type=int, dest='cosmo_cache', default=0)
+    # -- speculative evaluation of the proposals (OPTIONAL)
+    runparser.add_argument('--speculative', help=helpdict['speculative'],
+                           type=int, dest='speculative', default=0)
+    # -- store the results of the cosmological module (OPTIONAL)
+    runparser.add_argument('--store-evaluations',
+                           help=helpdict['store-evaluations'],
+                           dest='store_evaluations', action='store_true')
+    runparser.add_argument('--store-derived', help=helpdict['store-derived'],
+                           dest='store_derived', type=str, default=[],
+                           nargs='+')
+    runparser.add_argument('--store-spectra', help=helpdict['store-spectra'],
+                           dest='store_spectra', action='store_true')
+    # -- timings of the computation (OPTIONAL)
+    runparser.add_argument('--profile', help=helpdict['profile'], type=int,
+                           dest='profile', nargs='?', const=0, default=None)
+    # -- checkpoints of the chain (OPTIONAL)
+    runparser.add_argument('--checkpoint', help=helpdict['checkpoint'],
+                           type=int, dest='checkpoint', default=0)
+    # -- format of the chains (OPTIONAL)
+    runparser.add_argument('--chain-format', help=helpdict['chain-format'],
+                           dest='chain_format', default=None,
+                           choices=['text', 'binary'])
+    # -- dragging of the fast parameters (OPTIONAL)
+    runparser.add_argument('--drag', help=helpdict['drag'], type=int,
+                           dest='drag', default=0)
+    # -- tuning of the blocks of the fast jumping method (OPTIONAL)
+    runparser.add_argument('--tune-blocks', help=helpdict['tune-blocks'],
+                           type=int, dest='tune_blocks', default=0)
+    # -- threads computing the likelihoods (OPTIONAL)
+    runparser.add_argument('--likelihood-threads',
+                           help=helpdict['likelihood-threads'], type=int,
+                           dest='likelihood_threads', default=0)
+    # -- seed of the random number generator (OPTIONAL)
+    runparser.add_argument('--seed', help=helpdict['seed'], type=int,
+                           default=None)
 
     ###############
     # MCMC restart from chain or best fit file
@@ -5,7 +5,6 @@
 
 """
 from initialise import initialise
-from data import Data
 import io_mp
 import sys
 import warnings
@@ -50,17 +49,19 @@ def mpi_run(custom_command=""):
     """
     Launch a simple MPI run, with no communication of covariance matrix
 
-    Each process will make sure to initialise the folder if needed. Then and
-    only then, it will send the signal to its next in line to proceed. This
-    allows for initialisation over an arbitrary cluster geometry (you can have
-    a single node with many cores, and all the chains living there, or many
-    nodes with few cores). The speed loss due to the time spend checking if the
-    folder is created should be negligible when running decently sized chains.
-
-    Each process will send the number that it found to be the first available
-    to its friends, so that the gathering of information post-run is made
-    easier. If a chain number is specified, this will be used as the first
-    number, and then incremented afterwards with the rank of the process.
+    The process of rank 0 initialises first: it creates the folder and writes
+    the log.param if needed, and finds the first available chain number. It
+    then reserves the chain files of all the processes, and broadcasts this
+    number, so that all the other processes initialise concurrently, each
+    using this number incremented by its rank. The startup time thus does not
+    grow with the number of processes, while keeping the chains of a run
+    consecutive, which makes the gathering of information post-run easier.
+
+    If a chain number is specified, this will be used as the first number,
+    and then incremented afterwards with the rank of the process.
+
+    A process whose initialisation fails removes its reserved chain file, if
+    it is still empty.
     """
 
     from mpi4py import MPI
@@ -69,76 +70,87 @@ def mpi_run(custom_command=""):
     nprocs = comm.Get_size()
     rank = comm.Get_rank()
 
-    success = True
-    folder = ''
-
-    # If the process is not the zeroth one, then wait for a signal from your
-    # n-1 before initializing the folder
-    if rank != 0:
-        status = comm.recv(source=rank-1, tag=1)
-        folder = comm.recv(source=rank-1, tag=2)
-        if status == 'failed':
-            success = False
-        else:
-            number = status
+    if not custom_command:
+        custom_command = " ".join(sys.argv[1:])
 
-    if success:
-        if not custom_command:
-            custom_command = " ".join(sys.argv[1:])
-        if rank != 0:
-            custom_command += " --chain-number %s" % str(int(number)+1)
-
-        # First check if the folder is there
-        already_sent = False
-        if rank != 0 and rank < nprocs-1:
-            status = int(number)+1
-            if Data.folder_is_initialised(folder):
-                comm.send(status, dest=rank+1, tag=1)
-                comm.send(folder, dest=rank+1, tag=2)
-                already_sent = True
-
-        # Then, properly initialise
-        cosmo, data, command_line, success = safe_initialisation(
-            custom_command, comm, nprocs)
-
-        # The first initialisation should check a few more things
-        if rank == 0:
+    if rank == 0:
+        # A failed initialisation is broadcast, for the other processes to
+        # stop as well
+        status = 'failed'
+        reserved = []
+        try:
+            cosmo, data, command_line, success = safe_initialisation(
+                custom_command)
             # Check that the run asked is compatible with mpirun and prepare.
-            if command_line.subparser_name == 'info':
-                warnings.warn(
-                    "Analyzing the chains is not supported in mpirun"
-                    " so this will run on one core only.")
-                status = 'failed'
-            elif command_line.method == "MH":
-                regexp = re.match(".*__(\w*).txt", data.out_name)
-                suffix = regexp.groups()[0]
-                status = suffix
+            if not success:
+                if command_line.subparser_name == 'info':
+                    warnings.warn(
+                        "Analyzing the chains is not supported in mpirun"
+                        " so this will run on one core only.")
+            elif command_line.method in ["MH", "DA"]:
+                regexp = re.match(".*__(\w*)\.(?:txt|bin)", data.out_name)
+                status = int(regexp.groups()[0])
+                reserved = reserve_chain_files(
+                    data.out_name, regexp.span(1), nprocs)
             elif command_line.method == "NS":
                 status = 1
             else:
                 warnings.warn(
                     "The method '%s' is not supported"%(command_line.method) +
                     " in mpirun so this will run on one core only.")
-                status = 'failed'
-            folder = data.out_name
-        elif rank < nprocs-1:
-            status = int(number)+1
-        # Send an "OK" signal to the next in line, giving the its own chain
-        # number for the other to add 1
-        if rank < nprocs-1:
-            if not already_sent:
-                comm.send(status, dest=rank+1, tag=1)
-                comm.send(folder, dest=rank+1, tag=2)
+        finally:
+            comm.bcast((status, reserved), root=0)
     else:
-        if rank < nprocs-1:
-            comm.send('failed', dest=rank+1, tag=1)
-            comm.send('', dest=rank+1, tag=2)
+        status, reserved = comm.bcast(None, root=0)
+        success = status != 'failed'
+        if success:
+            custom_command += " --chain-number %d" % (status+rank)
+            try:
+                cosmo, data, command_line, success = safe_initialisation(
+                    custom_command)
+            except:
+                # Release the name reserved for this chain, unless it already
+                # contains points (when resuming a chain)
+                if reserved and os.path.isfile(reserved[rank-1]) and \
+                        not os.path.getsize(reserved[rank-1]):
+                    os.remove(reserved[rank-1])
+                raise
 
     if success:
         import sampler
         sampler.run(cosmo, data, command_line)
 
-    return
+
+def reserve_chain_files(name, span, number):
+    """
+    Create the chain files of the processes of rank 1 to `number`-1
+
+    Their suffix is the one of the chain `name` of the process of rank 0,
+    incremented by the rank. Creating them right away prevents another run
+    started meanwhile in the same folder from taking these names, while the
+    processes initialise.
+
+    Parameters
+    ----------
+    name : str
+        Name of the chain of the process of rank 0
+    span : tuple
+        Start and end of the suffix in `name`
+    number : int
+        Number of processes
+
+    Returns
+    -------
+    names : list
+        Names of the chain files of the processes of rank 1 to `number`-1
+
+    """
+    first = int(name[span[0]:span[1]])
+    names = [name[:span[0]]+str(first+rank)+name[span[1]:]
+             for rank in range(1, number)]
+    for reserved in names:
+        open(reserved, 'a').close()
+    return names
 
 
 def mock_update_run(custom_command=""):
@@ -171,7 +183,7 @@ def mock_update_run(custom_command=""):
     return
 
 
-def safe_initialisation(custom_command="", comm=None, nprocs=1):
+def safe_initialisation(custom_command=""):
     """
     Wrapper around the init function to handle errors
 
@@ -179,17 +191,10 @@ def safe_initialisation(custom_command="", comm=None, nprocs=1):
     -----------------
     custom_command : str
         testing purposes
-    comm : MPI.Intracomm
-        object that helps communicating between the processes
-    nprocs : int
-        number of processes
     """
     try:
         cosmo, data, command_line, success = initialise(custom_command)
     except io_mp.ConfigurationError as message:
-        if comm:
-            for index in range(1, nprocs):
-                comm.send('failed', dest=index, tag=1)
         print str(message)
         raise io_mp.ConfigurationError(
             "The initialisation was not successful, resulting in a "
@@ -197,9 +202,6 @@ def safe_initialisation(custom_command="", comm=None, nprocs=1):
             "above error message. If you run the exact same command, it"
             " will not work. You should solve the problem, and try again.")
     except KeyError as e:
-        if comm:
-            for index in range(1, nprocs):
-                comm.send('failed', dest=index, tag=1)
         raise io_mp.ConfigurationError(
             "You are running in a folder that was created following "
             "a non-successful initialisation (wrong parameter name, "
@@ -15,7 +15,10 @@ all different sampler methods:
 * :func:`read_args_from_bestfit`
 * :func:`accept_step`
 * :func:`compute_lkl`
+* :func:`compute_fisher`
 
+The functions :func:`initialise_worker` and :func:`evaluate_position` allow to
+compute likelihoods in a pool of worker processes.
 
 """
 import numpy as np
@@ -24,6 +27,9 @@ import warnings
 
 import io_mp
 import os
+import hashlib
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 
 
 def run(cosmo, data, command_line):
@@ -38,10 +44,14 @@ def run(cosmo, data, command_line):
 
     """
 
-    if command_line.method == 'MH':
+    if command_line.method in ['MH', 'DA']:
         import mcmc
-        mcmc.chain(cosmo, data, command_line)
-        data.out.close()
+        # The chain is closed even if the run fails, so that the points
+        # waiting to be written by a binary chain are not lost
+        try:
+            mcmc.chain(cosmo, data, command_line)
+        finally:
+            data.out.close()
     elif command_line.method == 'NS':
         import nested_sampling as ns
         ns.run(cosmo, data, command_line)
@@ -82,14 +92,17 @@ def read_args_from_chain(data, chain):
         Name of the input chain provided with the command line.
 
     """
-    chain_file = io_mp.File(chain, 'r')
     parameter_names = data.get_mcmc_parameters(['varying'])
+    if io_mp.is_binary_chain(chain):
+        last_point = io_mp.read_binary_chain(chain)[1][-1]
+        data.parameter_store.set_last_accepted(
+            last_point[2:2+len(parameter_names)])
+        return
 
-    i = 1
-    for elem in parameter_names:
-        data.mcmc_parameters[elem]['last_accepted'] = float(
-            chain_file.tail(1)[0].split('\t')[i])
-        i += 1
+    chain_file = io_mp.File(chain, 'r')
+    last_line = chain_file.tail(1)[0].split('\t')
+    data.parameter_store.set_last_accepted(
+        [float(last_line[i+1]) for i in range(len(parameter_names))])
 
 
 def read_args_from_bestfit(data, bestfit):
@@ -118,19 +131,19 @@ def read_args_from_bestfit(data, bestfit):
 
     print
     print('\nStarting point for rescaled parameters:')
+    starting_point = []
     for elem in parameter_names:
         if elem in bestfit_names:
-            data.mcmc_parameters[elem]['last_accepted'] = \
-                bestfit_values[bestfit_names.index(elem)] / \
-                data.mcmc_parameters[elem]['scale']
+            starting_point.append(
+                bestfit_values[bestfit_names.index(elem)] /
+                data.mcmc_parameters[elem]['scale'])
             print 'from best-fit file : ', elem, ' = ',
-            print bestfit_values[bestfit_names.index(elem)] / \
-                data.mcmc_parameters[elem]['scale']
+            print starting_point[-1]
         else:
-            data.mcmc_parameters[elem]['last_accepted'] = \
-                data.mcmc_parameters[elem]['initial'][0]
+            starting_point.append(data.mcmc_parameters[elem]['initial'][0])
             print 'from input file    : ', elem, ' = ',
-            print data.mcmc_parameters[elem]['initial'][0]
+            print starting_point[-1]
+    data.parameter_store.set_last_accepted(starting_point)
 
 
 def get_covariance_matrix(cosmo, data, command_line):
@@ -176,6 +189,8 @@ def get_covariance_matrix(cosmo, data, command_line):
         from copy import deepcopy
         # Do not modify data, instead copy
         temp_data = deepcopy(data)
+        # Both share the same cosmological module, hence the same cache
+        temp_data.cosmo_cache = data.cosmo_cache
         done = False
 
         # Create the center dictionary, which will hold the center point
@@ -185,15 +200,13 @@ def get_covariance_matrix(cosmo, data, command_line):
         center = {}
         if not command_line.bf:
             for elem in parameter_names:
-                temp_data.mcmc_parameters[elem]['current'] = (
-                    data.mcmc_parameters[elem]['initial'][0])
                 center[elem] = data.mcmc_parameters[elem]['initial'][0]
         else:
             read_args_from_bestfit(temp_data, command_line.bf)
             for elem in parameter_names:
-                temp_data.mcmc_parameters[elem]['current'] = (
-                    temp_data.mcmc_parameters[elem]['last_accepted'])
                 center[elem] = temp_data.mcmc_parameters[elem]['last_accepted']
+        temp_data.parameter_store.set_current(
+            [center[elem] for elem in parameter_names])
 
         # Have a security index that prevents looping indefinitely
         security = 0
@@ -224,6 +237,12 @@ def get_covariance_matrix(cosmo, data, command_line):
                 io_mp.write_covariance_matrix(
                     cov_matrix, parameter_names,
                     os.path.join(command_line.folder, 'covariance_fisher.mat'))
+                # The points of the stencil are not needed anymore
+                try:
+                    os.remove(os.path.join(
+                        command_line.folder, 'fisher_points.txt'))
+                except OSError:
+                    pass
 
                 command_line.cov = os.path.join(
                     command_line.folder, 'covariance_fisher.mat')
@@ -409,12 +428,7 @@ def accept_step(data):
     one.
 
     """
-    for elem in data.get_mcmc_parameters(['varying']):
-        data.mcmc_parameters[elem]['last_accepted'] = \
-            data.mcmc_parameters[elem]['current']
-    for elem in data.get_mcmc_parameters(['derived']):
-        data.mcmc_parameters[elem]['last_accepted'] = \
-            data.mcmc_parameters[elem]['current']
+    data.parameter_store.accept()
 
 
 def check_flat_bound_priors(parameters, names):
@@ -458,22 +472,59 @@ def compute_lkl(cosmo, data):
     """
     from classy import CosmoSevereError, CosmoComputationError
 
-    # If the cosmological module has already been called once, and if the
-    # cosmological parameters have changed, then clean up, and compute.
-    if cosmo.state and data.need_cosmo_update is True:
-        cosmo.struct_cleanup()
-
-    # If the data needs to change, then do a normal call to the cosmological
-    # compute function. Note that, even if need_cosmo update is True, this
-    # function must be called if the jumping factor is set to zero. Indeed,
-    # this means the code is called for only one point, to set the fiducial
-    # model.
-    if ((data.need_cosmo_update) or
-            (not cosmo.state) or
-            (data.jumping_factor == 0)):
+    store = data.parameter_store
+    derived_names = data.get_mcmc_parameters(['derived'])
+    profiler = data.profiler
+    profiler.evaluations += 1
+
+    # Recover what was already computed for these cosmological arguments (see
+    # :class:`CosmologyCache <data.CosmologyCache>`). If the cosmological
+    # module previously failed there, the point is rejected right away.
+    cache = data.cosmo_cache
+    key = cache.key(data.cosmo_arguments)
+    entry = cache.get(key)
+    if entry['failed'] and data.jumping_factor != 0:
+        return data.boundary_loglike
+
+    # Find the likelihoods whose value is known: either unchanged since the
+    # previous step, or last computed for this cosmology with the same
+    # nuisance parameters.
+    values = {}
+    for likelihood in data.lkl.itervalues():
+        if likelihood.need_update is not True:
+            values[likelihood.name] = likelihood.backup_value
+        else:
+            nuisance, value = entry['loglkl'].get(
+                likelihood.name, (None, None))
+            if nuisance == store.get_values(likelihood.nuisance):
+                values[likelihood.name] = value
+
+    # If anything is missing, the cosmological module must hold this
+    # cosmology. Note that the computation must be done if the jumping factor
+    # is set to zero. Indeed, this means the code is called for only one
+    # point, to set the fiducial model.
+    computed = False
+    need_computation = (
+        len(values) < len(data.lkl) or
+        (derived_names != [] and entry['derived'] is None) or
+        data.jumping_factor == 0)
+    if need_computation and (
+            cache.computed_key != key or
+            not cosmo.state or
+            data.jumping_factor == 0):
+
+        # If the cosmological module has already been called once, clean up
+        profiler.computations += 1
+        if cosmo.state:
+            start = profiler.start()
+            cosmo.struct_cleanup()
+            profiler.stop('cosmo.struct_cleanup', start)
+        cache.computed_key = None
 
         # Prepare the cosmological module with the new set of parameters
+        start = profiler.start()
         cosmo.set(data.cosmo_arguments)
+        profiler.stop('cosmo.set', start)
 
         # Compute the model, keeping track of the errors
 
@@ -488,11 +539,13 @@ def compute_lkl(cosmo, data):
         # output given the parameter values. This will be considered as a valid
         # point, but with minimum likelihood, so will be rejected, resulting in
         # the choice of a new point.
+        start = profiler.start()
         try:
             cosmo.compute(["lensing"])
         except CosmoComputationError as failure_message:
             sys.stderr.write(str(failure_message)+'\n')
             sys.stderr.flush()
+            entry['failed'] = True
             return data.boundary_loglike
         except CosmoSevereError as critical_message:
             raise io_mp.CosmologicalModuleError(
@@ -501,6 +554,34 @@ def compute_lkl(cosmo, data):
         except KeyboardInterrupt:
             raise io_mp.CosmologicalModuleError(
                 "You interrupted execution")
+        finally:
+            profiler.stop('cosmo.compute', start)
+        cache.computed_key = key
+        computed = True
+
+    # The background quantities and the power spectrum requested by the
+    # likelihoods are computed at once, when a likelihood is to be computed
+    # for a new cosmology (the likelihoods called directly by other samplers
+    # compute them when first asking for them)
+    if len(values) < len(data.lkl):
+        for stage, table in [('background', data.background),
+                             ('power spectrum', data.power_spectrum)]:
+            if table.z.size:
+                start = profiler.start()
+                if table.update(cosmo, key):
+                    profiler.stop(stage, start)
+
+    # With --likelihood-threads, the thread safe likelihoods to be computed
+    # are sent to a pool of threads, while the others are computed in the
+    # loop below, which then adds all the values in the usual order
+    pending = {}
+    threads = data.command_line.likelihood_threads
+    if threads > 1 and len(data.lkl)-len(values) > 1:
+        pool = get_thread_pool(threads)
+        for likelihood in data.lkl.itervalues():
+            if likelihood.thread_safe and likelihood.name not in values:
+                pending[likelihood.name] = pool.apply_async(
+                    compute_likelihood, (likelihood, cosmo, data))
 
     # For each desired likelihood, compute its value against the theoretical
     # model
@@ -511,13 +592,18 @@ def compute_lkl(cosmo, data):
     flag_wrote_fiducial = 0
 
     for likelihood in data.lkl.itervalues():
-        if likelihood.need_update is True:
-            value = likelihood.loglkl(cosmo, data)
-            # Storing the result
-            likelihood.backup_value = value
-        # Otherwise, take the existing value
+        if likelihood.name in values:
+            value = values[likelihood.name]
         else:
-            value = likelihood.backup_value
+            if likelihood.name in pending:
+                value = pending[likelihood.name].get()
+            else:
+                value = compute_likelihood(likelihood, cosmo, data)
+            if value != 1j:
+                entry['loglkl'][likelihood.name] = (
+                    store.get_values(likelihood.nuisance), value)
+        # Storing the result
+        likelihood.backup_value = value
         if data.command_line.display_each_chi2:
             print "-> for ",likelihood.name,":  loglkl=",value,",  chi2eff=",-2.*value
         loglike += value
@@ -528,10 +614,13 @@ def compute_lkl(cosmo, data):
             print "-> Total:  loglkl=",loglike,",  chi2eff=",-2.*loglike
 
     # Compute the derived parameters if relevant
-    if data.get_mcmc_parameters(['derived']) != []:
+    if derived_names != [] and entry['derived'] is not None:
+        for name, value in entry['derived'].iteritems():
+            data.mcmc_parameters[name]['current'] = value
+    elif derived_names != []:
+        start = profiler.start()
         try:
-            derived = cosmo.get_current_derived_parameters(
-                data.get_mcmc_parameters(['derived']))
+            derived = cosmo.get_current_derived_parameters(derived_names)
             for name, value in derived.iteritems():
                 data.mcmc_parameters[name]['current'] = value
         except AttributeError:
@@ -541,9 +630,18 @@ def compute_lkl(cosmo, data):
         except CosmoSevereError:
             raise io_mp.CosmologicalModuleError(
                 "Could not write the current derived parameters")
-    for elem in data.get_mcmc_parameters(['derived']):
-        data.mcmc_parameters[elem]['current'] /= \
-            data.mcmc_parameters[elem]['scale']
+        for elem in derived_names:
+            data.mcmc_parameters[elem]['current'] /= \
+                data.mcmc_parameters[elem]['scale']
+        entry['derived'] = dict(
+            (elem, data.mcmc_parameters[elem]['current'])
+            for elem in derived_names)
+        profiler.stop('derived parameters', start)
+    store.read_current(derived_names)
+
+    # Keep the results of the cosmological module for the post-processing
+    if computed and data.evaluation_store is not None:
+        store_evaluation(cosmo, data)
 
     # If fiducial files were created, inform the user, and exit
     if flag_wrote_fiducial > 0:
@@ -567,86 +665,343 @@ def compute_lkl(cosmo, data):
     return loglike
 
 
+def compute_likelihood(likelihood, cosmo, data):
+    """
+    Compute one likelihood, timed by the profiler of `data`
+
+    Called by :func:`compute_lkl`, either directly or in the pool of threads
+    of :func:`get_thread_pool`. A point where the likelihood needs the power
+    spectrum outside of the grid computed for it (see
+    :class:`io_mp.OutOfGridError`) is rejected, with a warning the first
+    time.
+
+    """
+    start = data.profiler.start()
+    try:
+        value = likelihood.loglkl(cosmo, data)
+    except io_mp.OutOfGridError as error:
+        if likelihood.name not in _out_of_grid:
+            _out_of_grid.add(likelihood.name)
+            warnings.warn(
+                "%s The points where this happens are rejected." % (
+                    error.message))
+        value = data.boundary_loglike
+    data.profiler.stop('loglkl '+likelihood.name, start)
+    return value
+
+
+# Names of the likelihoods which already warned about a point outside of the
+# grid of the power spectrum, see compute_likelihood
+_out_of_grid = set()
+
+
+# Pool of threads of the current process, see get_thread_pool
+_thread_pool = {}
+
+
+def get_thread_pool(size):
+    """
+    Return the pool of threads computing the likelihoods
+
+    It is created at the first call, and again in a process forked afterwards
+    (for instance a worker of :func:`mcmc.speculate` or
+    :func:`evaluate_fisher_points`), whose copy of the pool has no threads.
+
+    Parameters
+    ----------
+    size : int
+        Number of threads
+
+    """
+    if _thread_pool.get('pid') != os.getpid():
+        _thread_pool['pool'] = ThreadPool(size)
+        _thread_pool['pid'] = os.getpid()
+    return _thread_pool['pool']
+
+
+def store_evaluation(cosmo, data):
+    """
+    Write the results of the cosmological module to the evaluation store
+
+    The derived parameters of the run are stored, along with the ones
+    specified with `--store-derived`, and, if asked with `--store-spectra`,
+    the lensed and unlensed :math:`C_\ell`. See
+    :class:`io_mp.EvaluationStore`.
+
+    """
+    from classy import CosmoSevereError
+
+    store = data.parameter_store
+    derived_names = data.get_mcmc_parameters(['derived'])
+    derived_names.extend([name for name in data.command_line.store_derived
+                          if name not in derived_names])
+    record = {}
+    try:
+        record['derived'] = cosmo.get_current_derived_parameters(
+            derived_names)
+        if data.command_line.store_spectra:
+            record['T_cmb'] = cosmo.T_cmb()
+            record['lensed_cl'] = cosmo.lensed_cl()
+            record['raw_cl'] = cosmo.raw_cl()
+    except (CosmoSevereError, AttributeError):
+        # The requested quantities are not available, nothing is stored
+        return
+    indices = store.varying_cosmo_indices
+    data.evaluation_store.add(
+        data.evaluation_store.key(
+            store.varying_cosmo_names, store.current[indices]),
+        record)
+
+
 def compute_fisher(data, cosmo, center, step_size):
+    """
+    Compute the Fisher matrix and the gradient of -log-likelihood at `center`
+
+    The second derivatives are computed with finite differences, with a step
+    of `step_size` times the value of every parameter. The points needed are
+    listed once by :func:`fisher_stencil`, then evaluated by
+    :func:`evaluate_fisher_points`, possibly in parallel.
+
+    Returns
+    -------
+    fisher_matrix : numpy array
+        Fisher matrix of the varying parameters
+    gradient : numpy array
+        Gradient of -log-likelihood
 
+    """
     parameter_names = data.get_mcmc_parameters(['varying'])
-    fisher_matrix = np.zeros(
-        (len(parameter_names), len(parameter_names)), 'float64')
+    dimension = len(parameter_names)
+    center_vector = np.array(
+        [center[elem] for elem in parameter_names], 'float64')
+    steps = center_vector*step_size
+    steps[steps == 0.0] = step_size
+
+    # Build the vector of every point of the stencil
+    vectors = {}
+    for offsets in fisher_stencil(dimension):
+        vector = np.copy(center_vector)
+        for index, sign in offsets:
+            vector[index] += sign*steps[index]
+        vectors[offsets] = vector
+    loglikes = evaluate_fisher_points(data, cosmo, vectors)
+
+    fisher_matrix = np.zeros((dimension, dimension), 'float64')
     # Initialise the gradient field
-    gradient = np.zeros(len(parameter_names), 'float64')
-
-    for k, elem_k in enumerate(parameter_names):
-        kdiff = center[elem_k]*step_size
-        if kdiff == 0.0:
-            kdiff = step_size
-        for h, elem_h in enumerate(parameter_names):
-            hdiff = center[elem_h]*step_size
-            if hdiff == 0.0:
-                hdiff = step_size
-            # Since the matrix is symmetric, we only compute the
-            # elements of one half of it plus the diagonal.
-            if k > h:
-                continue
-            if k != h:
-                fisher_matrix[k][h] = compute_fisher_element(
-                    data, cosmo, center,
-                    (elem_k, kdiff),
-                    (elem_h, hdiff))
-                fisher_matrix[h][k] = fisher_matrix[k][h]
-            else:
-                fisher_matrix[k][k], gradient[k] = compute_fisher_element(
-                    data, cosmo, center,
-                    (elem_k, kdiff))
+    gradient = np.zeros(dimension, 'float64')
+    for k in range(dimension):
+        fisher_matrix[k][k] = -(
+            loglikes[((k, 1),)]-2.*loglikes[()]+loglikes[((k, -1),)]) / \
+            steps[k]**2
+        gradient[k] = -(
+            loglikes[((k, 1),)]-loglikes[((k, -1),)])/(2.*steps[k])
+        # Since the matrix is symmetric, we only compute the elements of one
+        # half of it
+        for h in range(k+1, dimension):
+            fisher_matrix[k][h] = -(
+                loglikes[((k, 1), (h, 1))]-loglikes[((k, 1), (h, -1))] -
+                loglikes[((k, -1), (h, 1))]+loglikes[((k, -1), (h, -1))]) / \
+                (4.*steps[k]*steps[h])
+            fisher_matrix[h][k] = fisher_matrix[k][h]
 
     return fisher_matrix, gradient
 
 
-def compute_fisher_element(data, cosmo, center, one, two=None):
+def fisher_stencil(dimension):
+    """
+    List the points needed to compute the Fisher matrix
 
-    # Unwrap
-    name_1, diff_1 = one
-    if two:
-        name_2, diff_2 = two
-        data.mcmc_parameters[name_1]['current'] = (
-            center[name_1]+diff_1)
-        data.mcmc_parameters[name_2]['current'] = (
-            center[name_2]+diff_2)
-        data.update_cosmo_arguments()
-        loglike_1 = compute_lkl(cosmo, data)
+    Every point is described by a tuple of offsets from the center, each of
+    them being a tuple (index of the parameter, sign of the step). The center
+    is thus the empty tuple. Every point appears only once: the center, two
+    points per parameter for the diagonal, and four per pair of parameters for
+    the off-diagonal elements.
 
-        data.mcmc_parameters[name_2]['current'] -= 2*diff_2
-        data.update_cosmo_arguments()
-        loglike_2 = compute_lkl(cosmo, data)
+    """
+    stencil = [()]
+    for k in range(dimension):
+        stencil.extend([((k, 1),), ((k, -1),)])
+    for k in range(dimension):
+        for h in range(k+1, dimension):
+            stencil.extend([((k, sign_k), (h, sign_h))
+                            for sign_k in (1, -1) for sign_h in (1, -1)])
+    return stencil
 
-        data.mcmc_parameters[name_1]['current'] -= 2*diff_1
-        data.mcmc_parameters[name_2]['current'] += 2*diff_2
-        data.update_cosmo_arguments()
-        loglike_3 = compute_lkl(cosmo, data)
 
-        data.mcmc_parameters[name_2]['current'] -= 2*diff_2
-        data.update_cosmo_arguments()
-        loglike_4 = compute_lkl(cosmo, data)
+def evaluate_fisher_points(data, cosmo, vectors):
+    """
+    Compute the log-likelihood of all the points of the Fisher stencil
 
-        fisher_off_diagonal = -(
-            loglike_1-loglike_2-loglike_3+loglike_4)/(4.*diff_1*diff_2)
+    The points already computed, and stored in the file `fisher_points.txt` of
+    the output folder, are not computed again: this allows to resume an
+    interrupted computation. The file is only used if it was written with the
+    same configuration, see :func:`fisher_fingerprint`. The other points are
+    shared between the chains when running with MPI, or otherwise computed by
+    a pool of `--fisher-processes` processes, each with its own instance of
+    the cosmological module, and added to the file as soon as they are known.
+
+    Parameters
+    ----------
+    vectors : dict
+        values of the varying parameters for every point of the stencil
+
+    Returns
+    -------
+    loglikes : dict
+        log-likelihood of every point of the stencil
+
+    """
+    try:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        rank, size = comm.Get_rank(), comm.Get_size()
+    except ImportError:
+        rank, size = 0, 1
+
+    # The file is read by the first chain only, so that all of them agree on
+    # the points to compute
+    path = os.path.join(data.command_line.folder, 'fisher_points.txt')
+    known = None
+    if not rank:
+        fingerprint = fisher_fingerprint(data)
+        known = io_mp.read_fisher_points(path, fingerprint)
+        if known is None:
+            if os.path.isfile(path):
+                warnings.warn(
+                    "The points of %s were computed with another " % path +
+                    "configuration, and are ignored")
+            io_mp.start_fisher_points(path, fingerprint)
+            known = {}
+    if size > 1:
+        known = comm.bcast(known, root=0)
+
+    # Identical points are computed once
+    keys = dict((offsets, ' '.join(['%.10e' % value for value in vector]))
+                for offsets, vector in vectors.iteritems())
+    missing = {}
+    for offsets, key in keys.iteritems():
+        if key not in known:
+            missing[key] = vectors[offsets]
+    missing_keys = sorted(missing.keys())
+
+    if size > 1:
+        # Every chain computes its share, then all the results are exchanged
+        computed = {}
+        for key in missing_keys[rank::size]:
+            computed[key] = compute_position(cosmo, data, missing[key])[0]
+            io_mp.write_fisher_point(path, key, computed[key])
+        for part in comm.allgather(computed):
+            known.update(part)
+    elif missing_keys:
+        pool = Pool(min(fisher_processes(data.command_line),
+                        len(missing_keys)),
+                    initialise_worker, (data, type(cosmo)))
+        results = pool.imap(
+            evaluate_position, [missing[key] for key in missing_keys])
+        for key, (loglike, _, _) in zip(missing_keys, results):
+            known[key] = loglike
+            io_mp.write_fisher_point(path, key, loglike)
+        pool.close()
+        pool.join()
+
+    return dict((offsets, known[key]) for offsets, key in keys.iteritems())
+
+
+def fisher_fingerprint(data):
+    """
+    Return a fingerprint of the configuration of the Fisher computation
+
+    The log-likelihoods stored in `fisher_points.txt` are only valid for the
+    experiments, the fixed parameters and the arguments of the cosmological
+    module of the run that computed them, all written in its `log.param`, for
+    the same ordering of the varying parameters, and for the same fiducial
+    files of the likelihoods. The comments of the `log.param`, to which the
+    chains append information during the run, are not considered.
+
+    """
+    digest = hashlib.md5()
+    digest.update(' '.join(data.experiments)+'\n')
+    digest.update(' '.join(data.get_mcmc_parameters(['varying']))+'\n')
+    log_param = os.path.join(data.command_line.folder, 'log.param')
+    if os.path.isfile(log_param):
+        with open(log_param, 'r') as log:
+            for line in log:
+                if not line.lstrip().startswith('#'):
+                    digest.update(line)
+    for likelihood in data.lkl.itervalues():
+        if hasattr(likelihood, 'fiducial_file'):
+            path = os.path.join(
+                likelihood.data_directory, likelihood.fiducial_file)
+            if os.path.isfile(path):
+                with open(path, 'rb') as fiducial:
+                    digest.update(fiducial.read())
+    return digest.hexdigest()
 
-        return fisher_off_diagonal
-    # It is otherwise a diagonal component
-    else:
-        data.mcmc_parameters[name_1]['current'] = center[name_1]
-        data.update_cosmo_arguments()
-        loglike_1 = compute_lkl(cosmo, data)
 
-        data.mcmc_parameters[name_1]['current'] += diff_1
-        data.update_cosmo_arguments()
-        loglike_2 = compute_lkl(cosmo, data)
+def fisher_processes(command_line):
+    """
+    Return the number of processes computing the points of the Fisher matrix
+
+    Unless specified with `--fisher-processes`, the cores are shared between
+    the OpenMP threads of the instances of the cosmological module: one
+    process is used if `OMP_NUM_THREADS` is not set.
+
+    """
+    try:
+        if command_line.fisher_processes is not None:
+            return max(1, command_line.fisher_processes)
+    except AttributeError:
+        pass
+    try:
+        threads = int(os.environ['OMP_NUM_THREADS'])
+    except (KeyError, ValueError):
+        return 1
+    return max(1, cpu_count()//max(1, threads))
+
+
+def compute_position(cosmo, data, vector):
+    """
+    Compute the likelihood at the given values of the varying parameters
+
+    Returns
+    -------
+    loglike : float
+        Log-likelihood of the point
+    derived : numpy array
+        Values of the derived parameters at this point
+    values : dict
+        Value of every likelihood at this point, to be set as its
+        :attr:`backup_value` by a process taking this point as its current
+        one without computing it
+
+    """
+    store = data.parameter_store
+    data.check_for_slow_step(vector)
+    store.set_current(vector)
+    data.update_cosmo_arguments()
+    loglike = compute_lkl(cosmo, data)
+    values = dict((likelihood.name, likelihood.backup_value)
+                  for likelihood in data.lkl.itervalues())
+    return loglike, store.current[store.derived_indices].copy(), values
+
+
+# State of the worker processes computing likelihoods in parallel. The data
+# instance is inherited when the processes are forked, and each of them creates
+# its own instance of the cosmological module.
+_worker = {}
 
-        data.mcmc_parameters[name_1]['current'] -= 2*diff_1
-        data.update_cosmo_arguments()
-        loglike_3 = compute_lkl(cosmo, data)
 
-        fisher_diagonal = -(
-            loglike_2-2.*loglike_1+loglike_3)/(diff_1**2)
-        gradient = -(loglike_2-loglike_3)/(2.*diff_1)
+def initialise_worker(data, cosmo_class):
+    """Set the data and create the cosmological module of a worker process"""
+    _worker['data'] = data
+    _worker['cosmo'] = cosmo_class()
 
-        return fisher_diagonal, gradient
+
+def evaluate_position(vector):
+    """
+    Compute, in a worker process, the likelihood of a point
+
+    See :func:`compute_position` for the returned values.
+
+    """
+    return compute_position(_worker['cosmo'], _worker['data'], vector)
@@ -0,0 +1,299 @@
+"""
+.. module:: statistics_mp
+    :synopsis: Running statistics of the Markov chains
+
+This module defines the class :class:`WeightedStatistics`, which keeps the
+weighted mean and covariance matrix of the points of a chain, updated with
+every new accepted point. It allows :mod:`mcmc` to adapt the proposal density,
+or to monitor the convergence, without reading the chains from the disk with
+:mod:`analyze`.
+
+The statistics of the chains running in parallel with MPI are shared with
+:func:`gather`, then put together with :func:`combine`, or compared with
+:func:`gelman_rubin`.
+
+The class :class:`QuadraticApproximation` builds, from a mean and a covariance
+matrix, a cheap Gaussian approximation of the log-likelihood, used to screen
+the proposals in the delayed-acceptance mode of :func:`mcmc.chain`.
+"""
+import numpy as np
+
+# Defined to remove the burnin for all the points that were produced before the
+# first time where -log-likelihood <= min-minus-log-likelihood+LOG_LKL_CUTOFF
+LOG_LKL_CUTOFF = 3
+
+
+class WeightedStatistics(object):
+    """
+    Running weighted mean and covariance of the points of a chain
+
+    The points are added one by one with their multiplicity, and the mean and
+    second moments are updated with the weighted version of Welford's
+    algorithm, which is numerically stable and costs :math:`O(d^2)` per point,
+    `d` being the number of parameters.
+
+    As in :func:`analyze.remove_bad_points`, the burn-in is removed: points
+    are ignored until the chain reaches the region where -log-likelihood is
+    smaller than the minimum found so far plus :data:`LOG_LKL_CUTOFF`. If the
+    minimum later improves by more than this cutoff, all the previous points
+    are considered as burn-in, and the statistics start again.
+
+    The points added so far can be marked with :meth:`mark`, so that
+    :meth:`recent` gives the statistics of the last points only, as the
+    option `--keep-fraction` of :mod:`analyze`.
+
+    With `subchains` greater than zero, the statistics of as many subchains,
+    each made of every `subchains`-th point, are also kept, as in
+    :func:`analyze.convergence` for a single chain.
+
+    """
+
+    def __init__(self, dimension, subchains=0):
+        self.dimension = dimension
+        self.number_subchains = subchains
+        self.min_minus_lkl = np.inf
+        self.reset()
+
+    def reset(self):
+        """Forget all the points added so far"""
+        self.weight = 0.
+        self.points = 0
+        self.mean = np.zeros(self.dimension, 'float64')
+        self.comoment = np.zeros((self.dimension, self.dimension), 'float64')
+        # Value of the minimum of -log-likelihood when the burn-in ended
+        self.burnin_reference = None
+        self.subchains = [WeightedStatistics(self.dimension)
+                          for index in range(self.number_subchains)]
+        # States of the statistics at every call of mark
+        self.marks = []
+
+    def add(self, point, weight, minus_lkl=None):
+        """
+        Add a point of the chain, with its multiplicity
+
+        Parameters
+        ----------
+        point : numpy array
+            Value of the parameters
+        weight : float
+            Multiplicity of the point
+        minus_lkl : float
+            Value of -log-likelihood at this point. If not specified, the
+            burn-in is not checked.
+
+        """
+        if minus_lkl is not None:
+            self.min_minus_lkl = min(self.min_minus_lkl, minus_lkl)
+            # The minimum improved a lot: everything before was burn-in
+            if (self.burnin_reference is not None and
+                    self.min_minus_lkl < self.burnin_reference-LOG_LKL_CUTOFF):
+                self.reset()
+            if self.burnin_reference is None:
+                if minus_lkl > self.min_minus_lkl+LOG_LKL_CUTOFF:
+                    return
+                self.burnin_reference = self.min_minus_lkl
+
+        if self.subchains:
+            self.subchains[self.points % len(self.subchains)].add(
+                point, weight)
+        self.weight += weight
+        self.points += 1
+        delta = point-self.mean
+        self.mean += delta*weight/self.weight
+        self.comoment += weight*np.outer(delta, point-self.mean)
+
+    def merge(self, other):
+        """Add all the points of another instance to this one"""
+        if other.weight == 0:
+            return
+        total = self.weight+other.weight
+        delta = other.mean-self.mean
+        self.comoment += other.comoment + np.outer(delta, delta) * \
+            self.weight*other.weight/total
+        self.mean += delta*other.weight/total
+        self.weight = total
+        self.points += other.points
+        self.min_minus_lkl = min(self.min_minus_lkl, other.min_minus_lkl)
+
+    def mark(self):
+        """Remember the points added so far, see :meth:`recent`"""
+        self.marks.append(self.get_state())
+        for subchain in self.subchains:
+            subchain.mark()
+
+    def since(self, state):
+        """
+        Return the statistics of the points added after the given state
+
+        `state` is an earlier output of :meth:`get_state` of this instance.
+
+        """
+        weight, points, mean, comoment, _ = state
+        statistics = WeightedStatistics(self.dimension)
+        statistics.min_minus_lkl = self.min_minus_lkl
+        if self.weight <= weight:
+            return statistics
+        statistics.weight = self.weight-weight
+        statistics.points = self.points-points
+        statistics.mean = (self.weight*self.mean-weight*mean) / \
+            statistics.weight
+        delta = statistics.mean-mean
+        statistics.comoment = self.comoment-comoment-np.outer(
+            delta, delta)*weight*statistics.weight/self.weight
+        return statistics
+
+    def recent(self, fraction):
+        """
+        Return the statistics of the last points
+
+        They start at the last mark (see :meth:`mark`) after which at least
+        `fraction` of the weight was added, or at the first point if there is
+        none. The marks before it are not needed any more, and are forgotten.
+        The statistics of the subchains are given as the subchains of the
+        returned instance.
+
+        """
+        index = -1
+        for position, state in enumerate(self.marks):
+            if state[0] <= (1.-fraction)*self.weight:
+                index = position
+
+        def part(statistics):
+            """Statistics of the points after the mark, or of all of them"""
+            if index < 0:
+                return WeightedStatistics.from_state(statistics.get_state())
+            del statistics.marks[:index]
+            return statistics.since(statistics.marks[0])
+        recent = part(self)
+        recent.subchains = [part(subchain) for subchain in self.subchains]
+        return recent
+
+    def covariance(self):
+        """
+        Return the covariance matrix of the points
+
+        Normalised as in :func:`analyze.compute_covariance_matrix`.
+
+        """
+        return self.comoment/self.weight
+
+    def variance(self):
+        """
+        Return the variance of every parameter
+
+        Normalised as in :func:`analyze.compute_variance`.
+
+        """
+        return np.diag(self.comoment)/(self.weight-1)
+
+    def get_state(self):
+        """Return the minimal information needed to rebuild this instance"""
+        return (self.weight, self.points, self.mean.copy(),
+                self.comoment.copy(), self.min_minus_lkl)
+
+    @classmethod
+    def from_state(cls, state):
+        """Create an instance from the output of :meth:`get_state`"""
+        weight, points, mean, comoment, min_minus_lkl = state
+        statistics = cls(len(mean))
+        statistics.weight = weight
+        statistics.points = points
+        statistics.mean = np.array(mean, 'float64')
+        statistics.comoment = np.array(comoment, 'float64')
+        statistics.min_minus_lkl = min_minus_lkl
+        return statistics
+
+
+class QuadraticApproximation(object):
+    """
+    Gaussian approximation of the log-likelihood
+
+    The log-likelihood is approximated by :math:`-\\frac{1}{2}(x-\\mu)^T
+    C^{-1} (x-\\mu)`, up to a constant, where :math:`\\mu` and :math:`C` are
+    estimates of the mean and of the covariance matrix of the posterior.
+
+    """
+
+    def __init__(self, center, covariance):
+        self.center = np.array(center, 'float64')
+        self.inverse = np.linalg.pinv(covariance)
+
+    def __call__(self, point):
+        """Return the approximated log-likelihood at this point"""
+        delta = point-self.center
+        return -0.5*np.dot(delta, np.dot(self.inverse, delta))
+
+
+def gather(statistics, comm=None):
+    """
+    Recover the statistics of all the chains
+
+    This is a collective operation: when running with MPI, every process must
+    call it at the same time.
+
+    Parameters
+    ----------
+    statistics : :class:`WeightedStatistics`
+        statistics of the current chain
+    comm : MPI.Intracomm
+        object that helps communicating between the processes. If None, only
+        the current chain is considered.
+
+    Returns
+    -------
+    chains : list
+        A list of :class:`WeightedStatistics`, one per chain, ordered by rank
+
+    """
+    if comm is None:
+        return [statistics]
+    return [WeightedStatistics.from_state(state) for state in
+            comm.allgather(statistics.get_state())]
+
+
+def combine(chains):
+    """Return the statistics of all the chains taken together"""
+    total = WeightedStatistics(chains[0].dimension)
+    for chain in chains:
+        total.merge(chain)
+    return total
+
+
+def gelman_rubin(chains, require_all=False):
+    """
+    Compute the Gelman-Rubin convergence criterion R-1 for every parameter
+
+    The definition follows :func:`analyze.convergence`: the ratio of the
+    variance of the means (between) to the mean of the variances (within) of
+    the chains, both weighted by the number of points, without square root.
+
+    Parameters
+    ----------
+    chains : list
+        :class:`WeightedStatistics` of the chains. Those without enough
+        points, for instance still in their burn-in, are ignored.
+    require_all : bool
+        If True, the criterion is only computed when no chain is ignored, as
+        for a decision concerning all the chains.
+
+    Returns
+    -------
+    R : numpy array
+        R-1 for every parameter, or None if there are less than two chains
+        with enough points to compute it, or if a chain was ignored with
+        `require_all`.
+
+    """
+    kept = [chain for chain in chains if chain.weight > 1]
+    if len(kept) < 2 or (require_all and len(kept) < len(chains)):
+        return None
+    chains = kept
+    total = combine(chains)
+    within = np.zeros(total.dimension, 'float64')
+    between = np.zeros(total.dimension, 'float64')
+    for chain in chains:
+        within += chain.weight*chain.variance()
+        between += chain.weight*(chain.mean-total.mean)**2
+    within /= total.weight
+    between /= (total.weight-1)
+    return between/within
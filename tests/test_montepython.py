@@ -7,9 +7,14 @@ to run it, do
 import unittest
 import nose
 import os
+import sys
+import types
+import argparse
 import datetime
 import shutil
+import tempfile
 import re
+from copy import deepcopy
 import numpy as np
 from itertools import count
 import warnings
@@ -21,9 +26,22 @@ warnings.filterwarnings('ignore')
 from montepython import io_mp
 from montepython import parser_mp
 from montepython import sampler
+from montepython import mcmc
+from montepython import statistics_mp
+from montepython.data import CosmologyCache, ClCache, Container
+from montepython.data import PowerSpectrumGrid, BackgroundTable
+from montepython.data import StageTimings, Profiler
 from montepython.initialise import initialise
 from montepython.run import run
 from montepython.analyze import Information
+from montepython.likelihoods.bicep import bicep
+from montepython.likelihoods.boomerang import boomerang
+from montepython.likelihoods.clik_fake_planck import clik_fake_planck
+from montepython.likelihoods.fake_planck_bluebook import fake_planck_bluebook
+from montepython.likelihoods.Planck_highl import Planck_highl
+from montepython.likelihoods.Planck_lensing import Planck_lensing
+from montepython.likelihoods.quad import quad
+from montepython.likelihoods.sdss_lrgDR4 import sdss_lrgDR4
 
 
 class TestMontePython(unittest.TestCase):
@@ -319,6 +337,25 @@ class Test05DataModule(TestMontePython):
             self.data.cosmo_arguments['omega_b'],
             "the cosmo_arguments dict was not updated properly")
 
+    def test_parameter_store(self):
+        """
+        Is the parameter store consistent with the mcmc_parameters?
+        """
+        store = self.data.parameter_store
+        self.assertEqual(
+            store.varying_names,
+            self.data.get_mcmc_parameters(['varying']))
+        # Run the sampler, and check that the last accepted point was
+        # propagated to the dictionaries
+        sampler.run(self.cosmo, self.data, self.command_line)
+        for index, name in enumerate(store.varying_names):
+            self.assertEqual(
+                store.get_last_accepted()[index],
+                self.data.mcmc_parameters[name]['last_accepted'])
+            self.assertEqual(
+                store.get_current()[index],
+                self.data.mcmc_parameters[name]['current'])
+
     def test_block_behaviour(self):
         """
         Are the mcmc arguments well grouped by block?
@@ -365,6 +402,1322 @@ class Test05DataModule(TestMontePython):
             float(self.number)/10*5)
 
 
+class Test05StatisticsModule(TestMontePython):
+    """
+    Check the running statistics of the chains, without the cosmological code
+    """
+    def setUp(self):
+        generator = np.random.RandomState(42)
+        self.points = generator.normal(size=(200, 3))
+        self.weights = generator.randint(1, 5, size=200).astype('float64')
+
+    def tearDown(self):
+        del self.points, self.weights
+
+    def test_weighted_statistics(self):
+        """Are the running mean and covariance the weighted ones?"""
+        statistics = statistics_mp.WeightedStatistics(3)
+        for point, weight in zip(self.points, self.weights):
+            statistics.add(point, weight)
+        self.assertEqual(statistics.points, len(self.points))
+        self.assertEqual(statistics.weight, np.sum(self.weights))
+        mean = np.average(self.points, axis=0, weights=self.weights)
+        self.assertTrue(np.allclose(statistics.mean, mean))
+        covariance = np.cov(
+            self.points, rowvar=0, fweights=self.weights.astype('int'),
+            ddof=0)
+        self.assertTrue(np.allclose(statistics.covariance(), covariance))
+        # The state is enough to rebuild the statistics
+        copy = statistics_mp.WeightedStatistics.from_state(
+            statistics.get_state())
+        self.assertTrue(np.allclose(copy.mean, statistics.mean))
+        self.assertTrue(np.allclose(copy.comoment, statistics.comoment))
+        self.assertEqual(copy.weight, statistics.weight)
+
+    def test_burnin(self):
+        """Are the points before the end of the burn-in ignored?"""
+        statistics = statistics_mp.WeightedStatistics(3)
+        statistics.add(self.points[0], 1, minus_lkl=100.)
+        statistics.add(self.points[1], 1, minus_lkl=10.)
+        # The first point was accepted before the minimum improved by more
+        # than the cutoff, and is then forgotten
+        self.assertEqual(statistics.points, 1)
+        self.assertTrue(np.allclose(statistics.mean, self.points[1]))
+        # Once the burn-in is over, worse points are kept
+        statistics.add(self.points[2], 1,
+                       minus_lkl=10.+2*statistics_mp.LOG_LKL_CUTOFF)
+        self.assertEqual(statistics.points, 2)
+
+    def test_combine(self):
+        """Is the combination of several chains the one of all points?"""
+        whole = statistics_mp.WeightedStatistics(3)
+        chains = [statistics_mp.WeightedStatistics(3) for _ in range(3)]
+        for index, (point, weight) in enumerate(
+                zip(self.points, self.weights)):
+            whole.add(point, weight)
+            chains[index % 3].add(point, weight)
+        total = statistics_mp.combine(chains)
+        self.assertEqual(total.points, whole.points)
+        self.assertEqual(total.weight, whole.weight)
+        self.assertTrue(np.allclose(total.mean, whole.mean))
+        self.assertTrue(np.allclose(total.covariance(), whole.covariance()))
+
+    def test_recent(self):
+        """Are the statistics of the last points the direct ones?"""
+        statistics = statistics_mp.WeightedStatistics(3, subchains=3)
+        marks = []
+        for index, (point, weight) in enumerate(
+                zip(self.points, self.weights)):
+            if index and not index % 40:
+                statistics.mark()
+                marks.append(index)
+            statistics.add(point, weight)
+        # The last half of the weight starts after the mark at the point 80
+        recent = statistics.recent(0.5)
+        self.assertEqual(recent.points, len(self.points)-80)
+        self.assertEqual(len(statistics.marks), len(marks)-1)
+        whole = statistics_mp.WeightedStatistics(3)
+        for point, weight in zip(self.points[80:], self.weights[80:]):
+            whole.add(point, weight)
+        self.assertTrue(np.allclose(recent.mean, whole.mean))
+        self.assertTrue(np.allclose(recent.covariance(), whole.covariance()))
+        # The subchains are made of every third point
+        for index, subchain in enumerate(recent.subchains):
+            direct = statistics_mp.WeightedStatistics(3)
+            start = 80+(index-80) % 3
+            for point, weight in zip(self.points[start::3],
+                                     self.weights[start::3]):
+                direct.add(point, weight)
+            self.assertTrue(np.allclose(subchain.mean, direct.mean))
+            self.assertTrue(np.allclose(
+                subchain.covariance(), direct.covariance()))
+        # Without mark, all the points are kept
+        statistics = statistics_mp.WeightedStatistics(3)
+        for point, weight in zip(self.points, self.weights):
+            statistics.add(point, weight)
+        self.assertEqual(statistics.recent(0.5).points, len(self.points))
+
+    def test_shared_folder(self):
+        """Are the statistics of the other running chains read?"""
+        folder = tempfile.mkdtemp()
+        try:
+            chains = [os.path.join(folder, '2015-01-01_100__%d.txt' % index)
+                      for index in (1, 2, 3)]
+            # The last chain was interrupted, and its lock released
+            locks = [io_mp.lock_statistics(chain) for chain in chains]
+            locks[2].close()
+            for index, chain in enumerate(chains):
+                statistics = statistics_mp.WeightedStatistics(3)
+                statistics.add(self.points[index], self.weights[index])
+                io_mp.write_statistics(chain, statistics)
+            states = io_mp.read_statistics(folder, chains[0])
+            # Once finished, the second chain is not read any more
+            io_mp.remove_statistics(chains[1], locks[1])
+            finished = io_mp.read_statistics(folder, chains[0])
+            remaining = sorted(os.listdir(folder))
+            locks[0].close()
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(len(states), 1)
+        self.assertTrue(np.all(states[0][2] == self.points[1]))
+        self.assertEqual(finished, [])
+        self.assertEqual(remaining, [
+            '2015-01-01_100__1.statistics',
+            '2015-01-01_100__1.statistics.lock',
+            '2015-01-01_100__3.statistics',
+            '2015-01-01_100__3.statistics.lock'])
+
+    def test_finished_chain(self):
+        """Are the statistics of a chain removed when it ends?"""
+        folder = tempfile.mkdtemp()
+        installation = FakeInstallation(folder)
+        written = []
+        write_statistics = io_mp.write_statistics
+
+        def recorded(chain_name, statistics):
+            written.append(os.listdir(os.path.dirname(chain_name)))
+            write_statistics(chain_name, statistics)
+        io_mp.write_statistics = recorded
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-N 200 --update 10 --seed 3')
+            sampler.run(cosmo, data, command_line)
+            remaining = os.listdir(installation.folder)
+        finally:
+            io_mp.write_statistics = write_statistics
+            installation.remove()
+            shutil.rmtree(folder)
+        self.assertTrue(written)
+        self.assertIn(
+            os.path.basename(io_mp.statistics_path(data.out_name))+'.lock',
+            written[0])
+        self.assertFalse([name for name in remaining if 'statistics' in name])
+
+    def test_gelman_rubin(self):
+        """Does the Gelman-Rubin criterion follow its definition?"""
+        chains = []
+        for index in range(4):
+            chain = statistics_mp.WeightedStatistics(3)
+            for point, weight in zip(self.points[index::4],
+                                     self.weights[index::4]):
+                chain.add(point+0.1*index, weight)
+            chains.append(chain)
+        # Direct computation, as in analyze.convergence
+        total_weight = sum(chain.weight for chain in chains)
+        mean = sum(chain.weight*chain.mean for chain in chains)/total_weight
+        within = sum(
+            chain.weight*np.diag(chain.comoment)/(chain.weight-1)
+            for chain in chains)/total_weight
+        between = sum(
+            chain.weight*(chain.mean-mean)**2
+            for chain in chains)/(total_weight-1)
+        self.assertTrue(np.allclose(
+            statistics_mp.gelman_rubin(chains), between/within))
+        # Not defined with less than two chains
+        self.assertIsNone(statistics_mp.gelman_rubin(chains[:1]))
+        self.assertIsNone(statistics_mp.gelman_rubin(
+            chains[:1]+[statistics_mp.WeightedStatistics(3)]))
+
+    def test_gelman_rubin_burnin(self):
+        """Are all the chains required to decide to stop them all?"""
+        chains = []
+        for index in range(3):
+            chain = statistics_mp.WeightedStatistics(3)
+            for point, weight in zip(self.points[index::3],
+                                     self.weights[index::3]):
+                chain.add(point, weight, 0.)
+            chains.append(chain)
+        # The last chain just found a much better point: all its previous
+        # points were burn-in
+        chains[-1].add(self.points[0], 1., -10.)
+        self.assertEqual(chains[-1].weight, 1.)
+        self.assertIsNotNone(statistics_mp.gelman_rubin(chains))
+        self.assertTrue(np.allclose(
+            statistics_mp.gelman_rubin(chains),
+            statistics_mp.gelman_rubin(chains[:2], require_all=True)))
+        self.assertIsNone(
+            statistics_mp.gelman_rubin(chains, require_all=True))
+
+
+class Test05CosmologyCache(TestMontePython):
+    """
+    Check the cache of the results per cosmology
+    """
+    def test_eviction(self):
+        """Is the least recently used cosmology removed first?"""
+        cache = CosmologyCache(2)
+        keys = [CosmologyCache.key({'omega_b': value})
+                for value in [0.021, 0.022, 0.023]]
+        # The order of the arguments does not matter
+        self.assertEqual(
+            CosmologyCache.key({'h': 0.7, 'omega_b': 0.022}),
+            CosmologyCache.key(dict([('omega_b', 0.022), ('h', 0.7)])))
+        first = cache.get(keys[0])
+        first['loglkl']['test'] = -1.
+        cache.get(keys[1])
+        # Using the first key again makes the second one the oldest
+        self.assertIs(cache.get(keys[0]), first)
+        cache.get(keys[2])
+        self.assertEqual(list(cache.entries.keys()), [keys[0], keys[2]])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        # A removed entry is recreated empty
+        self.assertEqual(cache.get(keys[1])['loglkl'], {})
+        self.assertNotIn(keys[0], cache.entries)
+
+    def test_no_size(self):
+        """Is nothing kept with a size of zero?"""
+        cache = CosmologyCache(0)
+        key = CosmologyCache.key({'omega_b': 0.022})
+        cache.get(key)['failed'] = True
+        self.assertEqual(len(cache.entries), 0)
+        self.assertFalse(cache.get(key)['failed'])
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_chain(self):
+        """Is one value per likelihood kept, and reused correctly?"""
+        folder = tempfile.mkdtemp()
+        installation = FakeInstallation(folder)
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-N 100 -j fast --cosmo-cache 5 --seed 3')
+            sampler.run(cosmo, data, command_line)
+            chain, = installation.chains()
+            points = np.loadtxt(chain)
+        finally:
+            installation.remove()
+            shutil.rmtree(folder)
+        cache = data.cosmo_cache
+        self.assertEqual(len(cache.entries), 5)
+        for entry in cache.entries.itervalues():
+            self.assertLessEqual(
+                set(entry['loglkl'].keys()),
+                set(['test_nuisance1', 'test_nuisance2']))
+        self.assertGreater(cache.hits, 0)
+        self.assertTrue(np.allclose(
+            -points[:, 1], [installation.loglkl(point[2:])
+                            for point in points], rtol=1e-4))
+
+
+class Test05BackgroundTable(TestMontePython):
+    """
+    Check the background quantities shared by the likelihoods
+    """
+    def test_request(self):
+        """Is every redshift computed once, and where it is requested?"""
+        table = BackgroundTable({})
+        first = table.request([0.5, 1.0])
+        second = table.request([[1.0, 2.0], [0.1, 0.5]])
+        self.assertEqual(list(first), [0, 1])
+        self.assertEqual(second.tolist(), [[1, 2], [3, 0]])
+        self.assertEqual(table.z.tolist(), [0.5, 1.0, 2.0, 0.1])
+
+    def test_compute(self):
+        """Are the distances those of the cosmological module?"""
+        z = np.array([[0.1, 0.5], [1.0, 2.0]])
+        # In a flat universe, the distances follow from the comoving one,
+        # and in a curved universe, the angular distance is asked at every
+        # redshift
+        for cosmo in [FakeMatterPower(1.), FakeCurvedBackground(1.)]:
+            table = BackgroundTable({})
+            indices = table.request(z)
+            background = table.get(cosmo)
+            angular = np.array([[cosmo.angular_distance(value)
+                                 for value in row] for row in z])
+            comoving, hubble = cosmo.z_of_r(z.ravel())
+            self.assertTrue(np.allclose(
+                background.angular_distance[indices], angular, rtol=1e-12))
+            self.assertTrue(np.allclose(
+                background.luminosity_distance[indices],
+                angular*(1+z)**2, rtol=1e-12))
+            self.assertTrue(np.allclose(
+                background.comoving_distance[indices].ravel(), comoving))
+            self.assertTrue(np.allclose(
+                background.hubble[indices].ravel(), hubble))
+            self.assertEqual(background.rs_drag, cosmo.rs_drag())
+
+    def test_new_cosmology(self):
+        """Is the table computed again for a new cosmology?"""
+        # As with the CosmoHammer, the same instance of the cosmological
+        # module holds the successive cosmologies, and the table is only
+        # asked by the likelihoods
+        cosmo_arguments = {}
+        table = BackgroundTable(cosmo_arguments)
+        indices = table.request([0.5, 1.0])
+        cosmo = FakeMatterPower(1.)
+        for scale in [1., 1.2, 1.]:
+            cosmo_arguments['h'] = cosmo.scale = scale
+            self.assertTrue(np.allclose(
+                table.get(cosmo).comoving_distance[indices],
+                scale*4400.*np.log([1.5, 2.])))
+
+
+class Test05PowerSpectrumGrid(TestMontePython):
+    """
+    Check the matter power spectrum shared by the likelihoods
+    """
+    def test_new_cosmology(self):
+        """Is the grid computed again for a new cosmology?"""
+        cosmo_arguments = {}
+        grid = PowerSpectrumGrid(cosmo_arguments)
+        indices = grid.request([0., 1.], 1e-3, 0.5)
+        k = np.array([[0.01], [0.1]])
+        cosmo = FakeMatterPower(1.)
+        for amplitude in [1., 2., 1.]:
+            cosmo_arguments['A_s'] = cosmo.amplitude = amplitude
+            self.assertTrue(np.allclose(
+                grid.get(cosmo, k, indices), cosmo.power(k, grid.z[indices]),
+                rtol=1e-3))
+
+    def test_range(self):
+        """Is a range depending on the cosmology covered for every one?"""
+        # As for the lensing likelihoods, the smallest wavenumber is l/r at
+        # the highest redshift, for distances r larger than c z/H0 for the
+        # largest scale
+        z, l = np.array([0.5, 3.5]), 10.
+        for scale in [1., 3.]:
+            cosmo = FakeMatterPower(scale)
+            grid = PowerSpectrumGrid({})
+            indices = grid.request(
+                z, lambda cosmo: 0.99*l/cosmo.z_of_r(z)[0][-1], 1.)
+            k = l/cosmo.z_of_r(z)[0]
+            self.assertTrue(np.allclose(
+                grid.get(cosmo, k, indices), cosmo.power(k, z), rtol=1e-3))
+        self.assertLess(grid.k[0], l/(2997.92458/cosmo.h()*z[-1]))
+        # Outside of the grid, the point is rejected
+        self.assertRaises(
+            io_mp.OutOfGridError, grid.get, cosmo, 0.5*k, indices)
+
+
+class Test05Drag(TestMontePython):
+    """
+    Check the dragging of the fast parameters along the slow proposals
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder
+
+    def installation(self, parameters):
+        """Return a :class:`FakeInstallation` with other parameters"""
+        return type('Installation', (FakeInstallation, ), {
+            'parameters': parameters})(self.folder)
+
+    def test_likelihood_calls(self):
+        """Are only the likelihoods of the dragged parameters computed?"""
+        # Only the parameter other, of test_nuisance2, is dragged, and it is
+        # unbounded, so that every update is computed
+        installation = self.installation("""
+data.experiments=['test_nuisance1', 'test_nuisance2']
+data.parameters['h']         = [0.7, 0.6, 0.8, 0.02, 1, 'cosmo']
+data.parameters['amplitude'] = [1.0, 0.5, 1.5, 0, 1, 'nuisance']
+data.parameters['other']     = [1.0, None, None, 0.05, 1, 'nuisance']
+data.N=10
+data.write_step=5
+""")
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-j fast --drag 5 --seed 2')
+            store = data.parameter_store
+            calls = dict.fromkeys(data.lkl, 0)
+
+            def counted(likelihood):
+                loglkl = likelihood.loglkl
+
+                def wrapper(cosmo, data):
+                    calls[likelihood.name] += 1
+                    return loglkl(cosmo, data)
+                return wrapper
+            for likelihood in data.lkl.itervalues():
+                likelihood.loglkl = counted(likelihood)
+
+            # Start from the mean values, and propose a new h
+            loglike = sampler.compute_position(
+                cosmo, data, store.get_last_accepted())[0]
+            sampler.accept_step(data)
+            accepted = dict((likelihood.name, likelihood.backup_value)
+                            for likelihood in data.lkl.itervalues())
+            vector = store.get_last_accepted()+[0.01, 0.]
+            data.check_for_slow_step(vector)
+            store.set_current(vector)
+            data.update_cosmo_arguments()
+            calls = dict.fromkeys(data.lkl, 0)
+            drag_cosmo = FakeClass()
+            newloglike = mcmc.drag(
+                cosmo, drag_cosmo, None, data, loglike, accepted,
+                mcmc.compute_cholesky(data, np.diag([0.02, 0.05])**2), 5)[0]
+        finally:
+            installation.remove()
+        # The new cosmology is computed once, with all the likelihoods, and
+        # test_nuisance2 at both ends for every update
+        self.assertEqual(calls, {'test_nuisance1': 1, 'test_nuisance2': 11})
+        self.assertEqual(drag_cosmo.h(), 0.71)
+        # The end point is the current one, with its likelihoods
+        point = [data.mcmc_parameters[name]['current']
+                 for name in ['h', 'amplitude', 'other']]
+        self.assertEqual(point[0], 0.71)
+        self.assertNotEqual(point[2], 1.)
+        self.assertAlmostEqual(newloglike, installation.loglkl(point), 10)
+        self.assertAlmostEqual(newloglike, sum(
+            likelihood.backup_value for likelihood in data.lkl.itervalues()),
+            10)
+
+    def test_detailed_balance(self):
+        """Does a dragged chain sample the posterior?"""
+        # The Hubble parameter is constrained by hst, and the nuisance
+        # parameters are strongly correlated with it
+        installation = self.installation("""
+data.experiments=['hst', 'test_nuisance1', 'test_nuisance2']
+data.parameters['h']         = [0.7, 0.5, 1.0, 0.02, 1, 'cosmo']
+data.parameters['amplitude'] = [1.0, 0.3, 2.0, 0.1, 1, 'nuisance']
+data.parameters['other']     = [1.0, 0.3, 2.0, 0.1, 1, 'nuisance']
+data.write_step=5
+""")
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-N 10000 -j fast --drag 3 --seed 5')
+            sampler.run(cosmo, data, command_line)
+            chain, = installation.chains()
+            points = np.loadtxt(chain)
+        finally:
+            installation.remove()
+
+        def loglkl(point):
+            return installation.loglkl(point) - \
+                0.5*(point[0]-0.738)**2/0.024**2
+        self.assertTrue(np.allclose(
+            -points[:, 1], [loglkl(point[2:]) for point in points],
+            rtol=1e-4, atol=1e-4))
+
+        # Moments of the posterior, integrated on a grid
+        grid = np.meshgrid(np.linspace(0.5, 1., 101),
+                           np.linspace(0.3, 2., 101),
+                           np.linspace(0.3, 2., 101), indexing='ij')
+        posterior = np.exp(loglkl(grid))
+        posterior /= posterior.sum()
+        mean = np.array([np.sum(posterior*x) for x in grid])
+        std = np.sqrt([np.sum(posterior*(x-m)**2)
+                       for x, m in zip(grid, mean)])
+        weights, samples = points[:, 0], points[:, 2:]
+        chain_mean = np.average(samples, axis=0, weights=weights)
+        chain_std = np.sqrt(np.average(
+            (samples-chain_mean)**2, axis=0, weights=weights))
+        self.assertTrue((abs(chain_mean-mean) < 0.1*std).all())
+        self.assertTrue((abs(chain_std/std-1) < 0.1).all())
+
+
+class Test05TuneBlocks(TestMontePython):
+    """
+    Check the ordering and over-sampling of the blocks from their costs
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.installation = FakeInstallation(self.folder)
+        _, self.data, _ = self.installation.initialise('-j fast')
+
+    def tearDown(self):
+        self.installation.remove()
+        shutil.rmtree(self.folder)
+        del self.folder, self.installation, self.data
+
+    def test_costs(self):
+        """Are the slowest likelihoods first, and the fastest over-sampled?"""
+        data = self.data
+        self.assertEqual(data.get_mcmc_parameters(['varying']),
+                         ['h', 'amplitude', 'other'])
+        # test_nuisance2 varies other, test_nuisance1 varies amplitude
+        data.tune_blocks(1., {'test_nuisance1': 0.02, 'test_nuisance2': 0.1})
+        self.assertEqual(data.block_order, [0, 2, 1])
+        self.assertEqual(data.block_parameters, [1, 2, 3])
+        # The block of other is followed by the one of amplitude, so that
+        # both likelihoods are computed when varying it: 1.12/(2*0.12)
+        # rounded, then 1.12/(2*0.02)
+        self.assertEqual(data.over_sampling, [1, 5, 28])
+        self.assertEqual(data.over_sampling_indices, [0]+[1]*5+[2]*28)
+        # Free likelihoods are over-sampled as much as allowed, in the order
+        # of the varying parameters
+        data.tune_blocks(1., {'test_nuisance1': 0., 'test_nuisance2': 0.})
+        self.assertEqual(data.block_order, [0, 1, 2])
+        self.assertEqual(data.over_sampling, [1, 100, 100])
+
+    def test_cholesky(self):
+        """Is the covariance matrix recovered from the ordered blocks?"""
+        data = self.data
+        data.tune_blocks(1., {'test_nuisance1': 0.02, 'test_nuisance2': 0.1})
+        sigma = np.array([0.02, 0.05, 0.05])
+        correlation = np.array([[1., 0.5, 0.3],
+                                [0.5, 1., -0.4],
+                                [0.3, -0.4, 1.]])
+        C = correlation*np.outer(sigma, sigma)
+        Cholesky = mcmc.compute_cholesky(data, C)
+        self.assertTrue(np.allclose(np.dot(Cholesky, Cholesky.T), C))
+        # The jumps of a block only move its parameters and the ones of the
+        # following blocks: the last jump, of amplitude, leaves other
+        # unchanged, while the jump of other also moves amplitude
+        self.assertTrue(np.all(np.triu(Cholesky[data.block_order], 1) == 0))
+        self.assertEqual(Cholesky[2, 2], 0)
+        self.assertNotEqual(Cholesky[1, 1], 0)
+
+
+class Test05DelayedAcceptance(TestMontePython):
+    """
+    Check the delayed acceptance with an approximate log-likelihood
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder
+
+    def test_biased_surrogate(self):
+        """Does a chain sample the target with a wrong approximation?"""
+        # The Gaussian target of hst is centered on 0.738 with a standard
+        # deviation of 0.024, while the approximation is centered on the
+        # starting point, with the width of the proposal
+        installation = type('Installation', (FakeInstallation, ), {
+            'parameters': """
+data.experiments=['hst']
+data.parameters['h'] = [0.7, 0.5, 1.0, 0.035, 1, 'cosmo']
+data.write_step=100
+"""})(self.folder)
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-m DA -N 20000 --seed 4')
+            sampler.run(cosmo, data, command_line)
+            chain, = installation.chains()
+            points = np.loadtxt(chain)
+        finally:
+            installation.remove()
+        weights, h = points[:, 0], points[:, 2]
+        self.assertTrue(np.allclose(
+            points[:, 1], 0.5*(h-0.738)**2/0.024**2, rtol=1e-4, atol=1e-4))
+        mean = np.average(h, weights=weights)
+        std = np.sqrt(np.average((h-mean)**2, weights=weights))
+        self.assertLess(abs(mean-0.738), 0.05*0.024)
+        self.assertLess(abs(std/0.024-1), 0.05)
+
+
+class Test05Fisher(TestMontePython):
+    """
+    Check the computation of the Fisher matrix, and its resumption
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.installation = FakeInstallation(self.folder)
+        self.cosmo, self.data, _ = self.installation.initialise(
+            '-f 0 --fisher-processes 1')
+        self.center = {'h': 0.7, 'amplitude': 1.1, 'other': 0.9}
+        self.path = os.path.join(
+            self.data.command_line.folder, 'fisher_points.txt')
+
+    def tearDown(self):
+        self.installation.remove()
+        shutil.rmtree(self.folder)
+        del self.folder, self.installation, self.cosmo, self.data
+
+    def test_stencil(self):
+        """Is every point needed listed once?"""
+        stencil = sampler.fisher_stencil(3)
+        self.assertEqual(len(stencil), 1+2*3+4*3)
+        self.assertEqual(len(set(stencil)), len(stencil))
+        self.assertEqual(stencil[0], ())
+        for offsets in stencil:
+            self.assertEqual(
+                sorted(index for index, _ in offsets),
+                sorted(set(index for index, _ in offsets)))
+            self.assertTrue(all(sign in (1, -1) for _, sign in offsets))
+
+    def test_compute(self):
+        """Are the Fisher matrix and the gradient the derivatives?"""
+        fisher_matrix, gradient = sampler.compute_fisher(
+            self.data, self.cosmo, self.center, 1e-3)
+        # Derivatives of -log-likelihood of test_nuisance1 and test_nuisance2
+        h, amplitude, other = [
+            self.center[name]
+            for name in self.data.get_mcmc_parameters(['varying'])]
+        residuals = [h-0.7*amplitude, other*h-0.68*amplitude]
+        derivatives = [np.array([1., -0.7, 0.]),
+                       np.array([other, -0.68, h])]
+        variances = [0.1**2, 0.12**2]
+        expected = sum(np.outer(derivative, derivative)/variance
+                       for derivative, variance in zip(derivatives, variances))
+        expected[0, 2] += residuals[1]/variances[1]
+        expected[2, 0] += residuals[1]/variances[1]
+        self.assertTrue(np.allclose(fisher_matrix, expected, rtol=1e-5))
+        self.assertTrue(np.allclose(gradient, sum(
+            residual*derivative/variance for residual, derivative, variance
+            in zip(residuals, derivatives, variances)), rtol=1e-5))
+
+    def test_resume(self):
+        """Is an interrupted computation resumed with the complete points?"""
+        fisher_matrix, gradient = sampler.compute_fisher(
+            self.data, self.cosmo, self.center, 1e-3)
+        # Interrupt the writing of the last point in its exponent, which is
+        # still a number
+        with open(self.path, 'r') as points:
+            lines = points.readlines()
+        self.assertEqual(len(lines), 1+19)
+        with open(self.path, 'w') as points:
+            points.writelines(lines[:-1])
+            points.write(lines[-1][:-2])
+        key = lines[-1].split('\t')[0]
+        fingerprint = lines[0][2:].strip()
+        self.assertNotIn(
+            key, io_mp.read_fisher_points(self.path, fingerprint))
+        resumed = sampler.compute_fisher(
+            self.data, self.cosmo, self.center, 1e-3)
+        # The other points are read with the precision of the file
+        self.assertTrue(np.allclose(resumed[0], fisher_matrix, rtol=1e-4))
+        self.assertTrue(np.allclose(resumed[1], gradient, rtol=1e-4))
+        # The point is computed again, on its own line
+        with open(self.path, 'r') as points:
+            lines = points.readlines()
+        self.assertEqual(len(lines), 1+19+1)
+        self.assertEqual(lines[-1].split('\t')[0], key)
+        self.assertEqual(
+            len(io_mp.read_fisher_points(self.path, fingerprint)), 19)
+
+
+class Test05Profiler(TestMontePython):
+    """
+    Check the summary of the timings of the stages
+    """
+    def test_stage_timings(self):
+        """Are the timings exact, with a sample of bounded size?"""
+        durations = np.random.RandomState(5).exponential(size=5000)
+        timings = StageTimings(size=100)
+        for duration in durations:
+            timings.add(duration)
+        self.assertEqual(timings.count, len(durations))
+        self.assertAlmostEqual(timings.total, durations.sum())
+        self.assertAlmostEqual(timings.mean(), durations.mean())
+        self.assertAlmostEqual(timings.std(), durations.std())
+        self.assertEqual(len(timings.sample), 100)
+        self.assertTrue(set(timings.sample) <= set(durations))
+        # The sample is uniform, and its median close to the real one
+        self.assertLess(abs(timings.percentiles(50) -
+                            np.median(durations)), 0.2)
+
+
+class Test05EvaluationStore(TestMontePython):
+    """
+    Check the store of the results of the cosmological module
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder
+
+    def test_round_trip(self):
+        """Are the records read back as they were written?"""
+        store = io_mp.EvaluationStore(self.folder)
+        names = ['omega_b', 'h']
+        first = io_mp.EvaluationStore.key(names, [0.0222, 0.7])
+        second = io_mp.EvaluationStore.key(names, [0.0223, 0.7])
+        self.assertIsNone(store.get(first))
+        store.add(first, {'derived': {'sigma8': 0.8}})
+        store.add(second, {'derived': {'sigma8': 0.81},
+                           'cl': np.arange(4.)})
+        # The key has the precision of the chains
+        self.assertEqual(
+            io_mp.EvaluationStore.key(names, [0.02220000001, 0.7]), first)
+        self.assertEqual(store.get(first), {'derived': {'sigma8': 0.8}})
+        reader = io_mp.EvaluationStore(self.folder)
+        record = reader.get(second)
+        self.assertEqual(record['derived'], {'sigma8': 0.81})
+        self.assertTrue(np.all(record['cl'] == np.arange(4.)))
+        # A record appended later is found by an existing reader, and one
+        # being written is ignored
+        third = io_mp.EvaluationStore.key(names, [0.0224, 0.7])
+        store.add(third, {'derived': {}})
+        with open(store.path, 'ab') as partial:
+            partial.write(io_mp.EvaluationStore.header.pack(3, 100)+'abc')
+        self.assertEqual(reader.get(third), {'derived': {}})
+        self.assertIsNone(reader.get('abc'))
+
+
+class Test05BinaryChain(TestMontePython):
+    """
+    Check the chains written in binary format
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'chain__1.bin')
+        self.names = ['omega_b', 'h']
+        self.points = np.array([
+            [1, 1234.56789, 2.2181234567, 0.6781234567],
+            [3, 1234.12345, 2.2251234567, 0.6791234567],
+            [1, 1233.98765, 2.2231234567, 0.6771234567]])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder, self.path, self.names, self.points
+
+    def test_round_trip(self):
+        """Are the points and comments read back without loss?"""
+        # A short queue makes the chain wait for the thread
+        with io_mp.BinaryChain(self.path, self.names, [0.01, 1],
+                               queue_length=2) as chain:
+            chain.write('# Random seed: 42\n')
+            for point in self.points[:2]:
+                chain.write_point(point[0], point[1], point[2:])
+            # A comment longer than a record
+            chain.write('# %s\n' % ('long comment '*10))
+            chain.write_point(
+                self.points[2, 0], self.points[2, 1], self.points[2, 2:])
+            chain.flush()
+        self.assertTrue(io_mp.is_binary_chain(self.path))
+        header, points, comments = io_mp.read_binary_chain(self.path)
+        self.assertEqual(
+            header['columns'], ['multiplicity', '-loglkl']+self.names)
+        self.assertEqual(header['scales'], [0.01, 1])
+        self.assertTrue(np.all(points == self.points))
+        self.assertEqual(comments, [
+            (0, '# Random seed: 42\n'),
+            (2, '# %s\n' % ('long comment '*10))])
+        lines = list(io_mp.iterate_chain(self.path))
+        self.assertEqual(lines[0], '# Random seed: 42\n')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(np.all(lines[4] == self.points[2]))
+
+        # A record interrupted while being written is ignored
+        with open(self.path, 'ab') as chain:
+            chain.write(self.points[0].astype('<f8').tostring()[:20])
+        _, points, _ = io_mp.read_binary_chain(self.path)
+        self.assertTrue(np.all(points == self.points))
+
+    def test_write_error(self):
+        """Is an error of the writing thread raised in the chain?"""
+        chain = io_mp.BinaryChain(self.path, self.names, [1, 1],
+                                  queue_length=2)
+        # Writing to a closed file fails in the thread
+        chain.file.close()
+        def write_points():
+            for point in self.points:
+                chain.write_point(point[0], point[1], point[2:])
+            chain.flush()
+        self.assertRaises(ValueError, write_points)
+        self.assertRaises(ValueError, chain.close)
+
+    def test_deepcopy(self):
+        """Is the chain shared by a copy of the data?"""
+        # The data is copied to compute the Fisher matrix
+        data = Container()
+        data.out = io_mp.BinaryChain(self.path, self.names, [1, 1])
+        data.out_name = self.path
+        copied = deepcopy(data)
+        self.assertIs(copied.out, data.out)
+        copied.out.write_point(
+            self.points[0, 0], self.points[0, 1], self.points[0, 2:])
+        data.out.close()
+        _, points, _ = io_mp.read_binary_chain(self.path)
+        self.assertTrue(np.all(points == self.points[:1]))
+
+
+class Test05RandomSeed(TestMontePython):
+    """
+    Check that a chain can be reproduced from its seed
+    """
+    def setUp(self):
+        self.folders = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        self.installations = [FakeInstallation(folder)
+                              for folder in self.folders]
+
+    def tearDown(self):
+        # Both installations share the fake cosmological module
+        self.installations[0].remove()
+        for folder in self.folders:
+            shutil.rmtree(folder)
+        del self.folders, self.installations
+
+    def run_chain(self, installation, options=''):
+        """Run a chain of the installation, and return its lines"""
+        cosmo, data, command_line = installation.initialise(
+            ('-N 50 --seed 7 '+options).strip())
+        sampler.run(cosmo, data, command_line)
+        with open(data.out_name, 'r') as chain:
+            return chain.readlines()
+
+    def test_reproduce(self):
+        """Are the chains of a folder different, and reproducible?"""
+        first = self.run_chain(self.installations[0])
+        second = self.run_chain(self.installations[0])
+        self.assertEqual(first[0], '# Random seed: 7\n')
+        self.assertEqual(second[0], '# Random seed: 8\n')
+        self.assertNotEqual(first[1:], second[1:])
+        with open(os.path.join(
+                self.installations[0].folder, 'log.param'), 'r') as log:
+            seeds = [line for line in log if 'Random-seed' in line]
+        self.assertEqual(len(seeds), 2)
+        self.assertTrue(seeds[1].rstrip().endswith('__2.txt: 8-----'))
+        # The same chains are found again in another folder
+        self.assertEqual(self.run_chain(self.installations[1]), first)
+        self.assertEqual(
+            self.run_chain(self.installations[1], '--chain-number 2'),
+            second)
+
+    def test_restart(self):
+        """Is the seed of a restarted chain written before the copied points?"""
+        first = self.run_chain(self.installations[0])
+        chain, = self.installations[0].chains()
+        restarted = self.run_chain(self.installations[0], '-r %s' % chain)
+        # The longer chain is the first one of its name
+        self.assertEqual(restarted[0], '# Random seed: 7\n')
+        self.assertEqual(restarted[1:1+len(first)], first)
+
+
+class Test05Checkpoint(TestMontePython):
+    """
+    Check the checkpoints of the chains
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, '2015-01-01_100__1.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder, self.path
+
+    def test_round_trip(self):
+        """Is the state of the sampler recovered from its checkpoint?"""
+        statistics = statistics_mp.WeightedStatistics(2)
+        statistics.add(np.array([1., 2.]), 3)
+        random_numbers = np.random.RandomState(3)
+        state = {'k': 11, 'N': 2, 'statistics': statistics,
+                 'random_numbers': random_numbers,
+                 'current': np.array([0.1, 0.2])}
+        io_mp.write_checkpoint(self.path, state)
+        self.assertEqual(os.listdir(self.folder), [
+            '2015-01-01_100__1.checkpoint'])
+        resumed = io_mp.read_checkpoint(self.path)
+        self.assertEqual(resumed['k'], 11)
+        self.assertTrue(np.all(resumed['current'] == state['current']))
+        self.assertTrue(np.all(
+            resumed['statistics'].mean == statistics.mean))
+        # The random numbers continue exactly as in the original chain
+        self.assertEqual(resumed['random_numbers'].uniform(),
+                         random_numbers.uniform())
+
+    def test_resume_in_place(self):
+        """Is a resumed chain truncated to its size at the checkpoint?"""
+        class Namespace(object):
+            pass
+        lines = ['# Random seed: 3\n', '1\t10.0\t0.1\n',
+                 '2\t11.0\t0.2\n']
+        with open(self.path, 'w') as chain:
+            chain.write(''.join(lines))
+        io_mp.write_checkpoint(
+            self.path, {'chain_size': len(''.join(lines[:2]))})
+        command_line, data = Namespace(), Namespace()
+        command_line.restart = self.path
+        io_mp.create_output_files(command_line, data)
+        self.assertEqual(data.out_name, self.path)
+        # The chain is locked for other runs, also after having been written
+        # to the disk
+        self.assertRaises(io_mp.ConfigurationError,
+                          io_mp.create_output_files, command_line, Namespace())
+        data.out.write(lines[2])
+        io_mp.refresh_file(data)
+        self.assertRaises(io_mp.ConfigurationError,
+                          io_mp.create_output_files, command_line, Namespace())
+        data.out.close()
+        with open(self.path, 'r') as chain:
+            self.assertEqual(chain.readlines(), lines)
+
+
+    def test_resume_speculative(self):
+        """Is a speculative chain resumed with the likelihoods of its point?"""
+        installation = FakeInstallation(self.folder)
+        options = '-j fast --speculative 2 --checkpoint 20 --seed 3'
+        write_checkpoint = io_mp.write_checkpoint
+        saved = os.path.join(self.folder, 'saved.checkpoint')
+
+        # The second checkpoint is kept, to resume the chain from it as if
+        # the run had been interrupted there
+        def save(chain_name, state, comm=None):
+            write_checkpoint(chain_name, state, comm)
+            if state['k'] == 41:
+                shutil.copy(io_mp.checkpoint_path(chain_name), saved)
+        try:
+            cosmo, data, command_line = installation.initialise(
+                '-N 60 '+options)
+            io_mp.write_checkpoint = save
+            sampler.run(cosmo, data, command_line)
+            io_mp.write_checkpoint = write_checkpoint
+            chain, = installation.chains()
+            shutil.move(saved, io_mp.checkpoint_path(chain))
+            cosmo, data, command_line = installation.initialise(
+                '-r %s %s' % (chain, options))
+            sampler.run(cosmo, data, command_line)
+        finally:
+            io_mp.write_checkpoint = write_checkpoint
+            installation.remove()
+        self.assertEqual(installation.chains(), [chain])
+        points = np.loadtxt(chain)
+        self.assertEqual(np.sum(points[:, 0]), 60)
+        # The steps changing only the nuisance parameters of one likelihood
+        # reuse the value of the other one at the resumed point
+        self.assertTrue(np.allclose(
+            -points[:, 1], [installation.loglkl(point[2:])
+                            for point in points], rtol=1e-4))
+
+class LikelihoodData(object):
+    """
+    Minimal replacement of :class:`data.Data`, to initialise the likelihoods
+    without the cosmological module
+    """
+    def __init__(self, folder, nuisance={}):
+        root = os.path.sep.join(
+            os.path.realpath(__file__).split(os.path.sep)[:-2])
+        self.path = {'MontePython': os.path.join(root, 'montepython'),
+                     'data': os.path.join(root, 'data', ''),
+                     'clik': folder}
+        self.log_flag = True
+        self.cosmo_arguments = {}
+        self.cl_cache = ClCache(self.cosmo_arguments)
+        self.power_spectrum = PowerSpectrumGrid(self.cosmo_arguments)
+        self.background = BackgroundTable(self.cosmo_arguments)
+        self.mcmc_parameters = dict(
+            (name, {'current': value, 'scale': 1., 'role': 'nuisance'})
+            for name, value in nuisance.iteritems())
+
+    def get_mcmc_parameters(self, table_of_strings):
+        return [name for name, parameter in self.mcmc_parameters.iteritems()
+                if parameter['role'] in table_of_strings]
+
+
+class FakeClik(object):
+    """
+    Likelihood of the clik library, keeping the vector it is given
+
+    Its multipoles and nuisance parameters are set by subclassing.
+    """
+    l_max = []
+    extra_parameter_names = []
+
+    def __init__(self, path):
+        self.vector = None
+
+    def get_lmax(self):
+        return self.l_max
+
+    def __call__(self, vector):
+        self.vector = np.array(vector)
+        return [0.]
+
+
+class FakeSpectra(object):
+    """Cosmological module only providing fixed lensed spectra in muK**2"""
+    def __init__(self, spectra):
+        self.spectra = spectra
+
+    def lensed_cl(self):
+        return dict(self.spectra)
+
+    def T_cmb(self):
+        return 1.e-6
+
+
+class FakeMatterPower(object):
+    """
+    Cosmological module providing a smooth matter power spectrum, with
+    small oscillations, and a background stretched by `scale`
+    """
+    amplitude = 1.
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def power(self, k, z):
+        return (self.amplitude*2.e4*k/(1.+(k/0.02)**2.5)*(
+            1.+0.05*np.sin(150.*k)*np.exp(-(k/0.2)**2))/(1.+z)**2)
+
+    def h(self):
+        return 0.7
+
+    def pk(self, k, z):
+        return float(self.power(k, z))
+
+    def get_pk(self, k, z, k_size, z_size, mu_size):
+        return self.power(k, z[None, :, None])
+
+    def z_of_r(self, z):
+        z = np.atleast_1d(z)
+        return (self.scale*4400.*np.log(1.+z),
+                (1.+z)**1.5/3000./1.6/self.scale)
+
+    def angular_distance(self, z):
+        return self.scale*4400.*np.log(1.+z)/(1.+z)
+
+    def rs_drag(self):
+        return 147.
+
+
+class FakeCurvedBackground(FakeMatterPower):
+    """
+    Cosmological module with the background of :class:`FakeMatterPower`,
+    in a closed universe
+    """
+    def angular_distance(self, z):
+        radius = 20000.
+        return radius*np.sin(
+            FakeMatterPower.angular_distance(self, z)*(1.+z)/radius)/(1.+z)
+
+
+class FakeClass(object):
+    """
+    Cosmological module only providing the Hubble parameter, given as the
+    argument `h`
+    """
+    def __init__(self):
+        self.state = False
+        self.arguments = {}
+
+    def set(self, arguments):
+        self.arguments = dict(arguments)
+
+    def compute(self, level=None):
+        self.state = True
+
+    def struct_cleanup(self):
+        self.state = False
+
+    def empty(self):
+        self.arguments = {}
+
+    def h(self):
+        return self.arguments['h']
+
+    def get_current_derived_parameters(self, names):
+        return {}
+
+
+class FakeInstallation(object):
+    """
+    Configuration file and folder of the cosmological module, which is
+    :class:`FakeClass`, to run chains of the likelihoods test_nuisance1 and
+    test_nuisance2 without CLASS
+    """
+    parameters = """
+data.experiments=['test_nuisance1', 'test_nuisance2']
+data.parameters['h']         = [0.7, 0.6, 0.8, 0.02, 1, 'cosmo']
+data.parameters['amplitude'] = [1.0, 0.5, 1.5, 0.05, 1, 'nuisance']
+data.parameters['other']     = [1.0, 0.5, 1.5, 0.05, 1, 'nuisance']
+data.N=10
+data.write_step=5
+"""
+
+    def __init__(self, folder):
+        cosmo_path = os.path.join(folder, 'class')
+        os.makedirs(os.path.join(cosmo_path, 'include'))
+        os.makedirs(os.path.join(cosmo_path, 'python', 'build', 'lib.fake'))
+        with open(os.path.join(
+                cosmo_path, 'include', 'common.h'), 'w') as common:
+            common.write('#define _VERSION_ "v0"\n')
+        self.conf = os.path.join(folder, 'fake.conf')
+        with open(self.conf, 'w') as conf:
+            conf.write("path['cosmo'] = '%s'\n" % cosmo_path)
+        self.param = os.path.join(folder, 'nuisance.param')
+        with open(self.param, 'w') as param:
+            param.write(self.parameters)
+        self.folder = os.path.join(folder, 'chains')
+        module = types.ModuleType('classy')
+        module.Class = FakeClass
+        module.CosmoSevereError = type('CosmoSevereError', (Exception, ), {})
+        module.CosmoComputationError = type(
+            'CosmoComputationError', (Exception, ), {})
+        sys.modules['classy'] = module
+
+    def remove(self):
+        del sys.modules['classy']
+
+    def initialise(self, options):
+        """Initialise a run in the folder of the chains"""
+        return initialise('run -p %s -o %s --conf %s %s' % (
+            self.param, self.folder, self.conf, options))[:3]
+
+    def chains(self):
+        return sorted([os.path.join(self.folder, name)
+                       for name in os.listdir(self.folder)
+                       if name.endswith('.txt')])
+
+    @staticmethod
+    def loglkl(point):
+        """Log-likelihood of test_nuisance1 and test_nuisance2"""
+        h, amplitude, other = point
+        return (-0.5*(h-amplitude*0.7)**2/0.1**2 -
+                0.5*(other*h-amplitude*0.68)**2/0.12**2)
+
+
+class Test05LikelihoodRegression(TestMontePython):
+    """
+    Compare the likelihoods to their values before they were optimised
+
+    The values were obtained with the previous implementations, for the same
+    fixed spectra.
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.command_line = argparse.Namespace(folder=self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        del self.folder, self.command_line
+
+    def initialise(self, likelihood_class, options=None, nuisance={}):
+        """
+        Return an instance of the likelihood, from its folder, and the data
+
+        The `options` (:class:`data.Container`) take precedence over the
+        .data file, as when given in the parameter file.
+        """
+        data = LikelihoodData(self.folder, nuisance)
+        name = likelihood_class.__name__
+        if options is not None:
+            setattr(data, name, options)
+        path = os.path.join(
+            data.path['MontePython'], 'likelihoods', name, name+'.data')
+        return likelihood_class(path, data, self.command_line), data
+
+    @staticmethod
+    def spectra(l_max, scale=1.):
+        """Return smooth spectra in muK**2, with small oscillations"""
+        ell = np.arange(l_max+1.)
+        shape = 2*np.pi*1000./(ell+10.)**2*(1.+0.1*np.cos(ell/50.))
+        return {'tt': scale*shape, 'ee': 0.05*scale*shape,
+                'te': 0.1*scale*shape, 'bb': 0.001*scale*shape,
+                'pp': 1e-8*scale*shape, 'tp': 1e-4*scale*shape, 'ell': ell}
+
+    def test_newdat_window(self):
+        """Are the band powers of the newdat likelihoods unchanged?"""
+        for likelihood_class, expected in [
+                (bicep, -1705.151775527587), (quad, -1089.9558734240527)]:
+            likelihood, data = self.initialise(likelihood_class)
+            self.assertAlmostEqual(likelihood.compute_lkl(
+                self.spectra(likelihood.l_max), None, data), expected, 6)
+
+    def test_cl_cache(self):
+        """Are the spectra of a new cosmology used outside of compute_lkl?"""
+        # As with the CosmoHammer, the same instance of the cosmological
+        # module holds the successive cosmologies, and the likelihoods are
+        # called directly
+        likelihood, data = self.initialise(bicep)
+        cosmo = FakeSpectra(None)
+        context = {'cosmo': cosmo, 'data': data}
+        for scale in [1., 1.3, 1.]:
+            data.cosmo_arguments['A_s'] = scale
+            cosmo.spectra = self.spectra(likelihood.l_max, scale)
+            self.assertAlmostEqual(
+                likelihood.computeLikelihood(context),
+                likelihood.compute_lkl(
+                    self.spectra(likelihood.l_max, scale), None, data), 6)
+
+    def test_newdat_marginalisation(self):
+        """Are the calibration and beam errors marginalised as before?"""
+        # The spectra are far enough from the data for the marginalisation
+        # to matter, with a calibration error for both, a beam error of type
+        # 1 for boomerang, and of type 2 for quad
+        for likelihood_class, expected in [
+                (boomerang, -1507.0896748986347),
+                (quad, -1492.8573484020349)]:
+            likelihood, data = self.initialise(likelihood_class)
+            self.assertAlmostEqual(likelihood.compute_lkl(
+                self.spectra(likelihood.l_max, 1.3), None, data), expected, 6)
+
+    def test_mock_cmb(self):
+        """Is the mock CMB likelihood unchanged, for all its modes?"""
+        nldd_file = os.path.join(self.folder, 'nldd.dat')
+        with open(nldd_file, 'w') as nldd:
+            for l in range(2, 2501):
+                nldd.write('%d 0 0 %.8g\n' % (l, 1e-7*l*(l+1)/2/np.pi))
+        for flags, expected in [
+                ({}, -240.21822034777318),
+                ({'Bmodes': True}, -241.32294566012413),
+                ({'LensingExtraction': True, 'neglect_TD': False},
+                 -634.9223090667422)]:
+            options = Container()
+            options.fiducial_file = os.path.join(self.folder, 'fiducial.dat')
+            options.temporary_Nldd_file = nldd_file
+            for name, value in flags.iteritems():
+                setattr(options, name, value)
+            # The first call writes the fiducial spectra
+            likelihood, data = self.initialise(fake_planck_bluebook, options)
+            self.assertEqual(likelihood.compute_lkl(
+                self.spectra(likelihood.l_max), None, data), 1j)
+            likelihood, data = self.initialise(fake_planck_bluebook, options)
+            self.assertAlmostEqual(likelihood.compute_lkl(
+                self.spectra(likelihood.l_max, 1.02), None, data),
+                expected, 6)
+            os.remove(options.fiducial_file)
+
+    def test_mpk(self):
+        """Is the likelihood of the matter power spectrum unchanged?"""
+        for scale, expected in [
+                (1.0, -47.056541158246546), (1.1, -40.298197670052105)]:
+            likelihood, data = self.initialise(sdss_lrgDR4)
+            cosmo = FakeMatterPower(scale)
+            self.assertAlmostEqual(
+                likelihood.loglkl(cosmo, data), expected, 6)
+
+    def test_mpk_out_of_grid(self):
+        """Is a point outside of the grid of P(k) rejected, with a warning?"""
+        likelihood, data = self.initialise(sdss_lrgDR4)
+        data.boundary_loglike = -1e30
+        data.profiler = Profiler()
+        cosmo = FakeMatterPower(2.0)
+        self.assertRaises(
+            io_mp.OutOfGridError, likelihood.loglkl, cosmo, data)
+        sampler._out_of_grid.discard(likelihood.name)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            for _ in range(2):
+                self.assertEqual(
+                    sampler.compute_likelihood(likelihood, cosmo, data),
+                    data.boundary_loglike)
+        self.assertEqual(len(caught), 1)
+
+    def test_threads(self):
+        """Are the likelihoods computed in threads identical to serial ones?"""
+        spectra = self.spectra
+
+        # Cosmological module providing spectra scaled by h
+        class Class(FakeClass):
+            def lensed_cl(self):
+                return spectra(
+                    self.arguments['l_max_scalars'], self.h()/0.7)
+
+            def T_cmb(self):
+                return 1.e-6
+        # The newdat likelihoods are computed in the threads, and hst in the
+        # main one
+        installation = type('Installation', (FakeInstallation, ), {
+            'parameters': """
+data.experiments=['bicep', 'quad', 'hst']
+data.parameters['h'] = [0.7, 0.6, 0.8, 0.02, 1, 'cosmo']
+"""})(self.folder)
+        sys.modules['classy'].Class = Class
+        results = []
+        try:
+            cosmo, data, command_line = installation.initialise('-N 10')
+            for threads in (1, 4):
+                command_line.likelihood_threads = threads
+                results.append([])
+                for h in (0.7, 0.75):
+                    data.parameter_store.set_current(np.array([h]))
+                    data.update_cosmo_arguments()
+                    loglike = sampler.compute_lkl(cosmo, data)
+                    results[-1].append((loglike, [
+                        likelihood.backup_value
+                        for likelihood in data.lkl.itervalues()]))
+        finally:
+            installation.remove()
+        self.assertEqual(sampler._thread_pool['pid'], os.getpid())
+        self.assertNotEqual(results[0][0], results[0][1])
+        self.assertEqual(results[0], results[1])
+
+    def test_clik(self):
+        """Is the vector given to clik laid out as before?"""
+        cl = self.spectra(3000)
+        zeros = np.zeros(30)
+        # Every case gives the multipoles and nuisance parameters of clik,
+        # and the vector built by the previous implementation
+        cases = [
+            (clik_fake_planck, [29, 29, 29, 29, 29, 29], {},
+             [cl['tt'][:30], cl['ee'][:30], cl['bb'][:30], cl['te'][:30],
+              zeros, zeros]),
+            (Planck_highl, [2508, 2000, -1, 1996, -1, -1],
+             {'A_planck': 1.01, 'calib_100T': 0.998},
+             [cl['tt'][:2509], cl['ee'][:2001], cl['te'][:1997],
+              [1.01, 0.998]]),
+            (Planck_lensing, [2048, 2048, -1, -1, -1, -1, -1], {},
+             [cl['pp'][:2049], cl['tt'][:2049]]),
+            # Before 2014, the lensing likelihoods have a single l_max, and
+            # the last multipole of each spectrum is left to zero
+            (Planck_lensing, 2048, {},
+             [cl['pp'][:2048], [0.], cl['tt'][:2048], [0.]])]
+        module = types.ModuleType('clik')
+        module.lkl = Container()
+        module.lkl.CError = IOError
+        sys.modules['clik'] = module
+        try:
+            for likelihood_class, l_max, nuisance, expected in cases:
+                module.clik = module.clik_lensing = type(
+                    'FakeClik', (FakeClik, ), {
+                        'l_max': l_max,
+                        'extra_parameter_names': sorted(nuisance.keys())})
+                likelihood, data = self.initialise(
+                    likelihood_class, nuisance=nuisance)
+                likelihood.loglkl(FakeSpectra(cl), data)
+                self.assertTrue(np.array_equal(
+                    likelihood.clik.vector, np.concatenate(expected)))
+        finally:
+            del sys.modules['clik']
+
+
 class Test06MetropolisHastingsImportanceSampling(TestMontePython):
     """
     Check that the default sampling method is working